@@ -0,0 +1,130 @@
+import asyncio
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Optional
+
+from pydantic import BaseModel
+
+from errors import OverloadedError
+
+
+class AdmissionSettings(BaseModel):
+    """Limits of the admission layer in front of /chatbot."""
+
+    max_in_flight: int = 32
+    max_queue: int = 128
+    queue_timeout: float = 10.0  # Seconds a request may wait for a slot.
+
+    @classmethod
+    def from_env(cls) -> "AdmissionSettings":
+        settings = cls()
+        for field, env_name in (
+            ("max_in_flight", "CHATBOT_MAX_IN_FLIGHT"),
+            ("max_queue", "CHATBOT_MAX_QUEUE"),
+            ("queue_timeout", "CHATBOT_QUEUE_TIMEOUT"),
+        ):
+            if env_name in os.environ:
+                setattr(
+                    settings,
+                    field,
+                    type(getattr(settings, field))(os.environ[env_name]),
+                )
+        return settings
+
+
+class AdmissionController:
+    """Bounds the conversations running at once.
+
+    At most `max_in_flight` requests run; up to `max_queue` more wait for a slot
+    in arrival order and are shed with OverloadedError once they have waited
+    `queue_timeout` seconds, or right away if the queue is full.
+    Must be used from a single event loop; see SessionSerializer for the
+    ordering of requests within a session.
+    """
+
+    _shared: Optional["AdmissionController"] = None
+
+    def __init__(self, settings: Optional[AdmissionSettings] = None):
+        self.settings = settings or AdmissionSettings.from_env()
+        self._in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._counters: Dict[str, Any] = {
+            "admitted": 0,
+            "shed_queue_full": 0,
+            "shed_timeout": 0,
+            "queued": 0,
+            "queue_wait_seconds": 0.0,
+        }
+
+    @classmethod
+    def shared(cls) -> "AdmissionController":
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    @asynccontextmanager
+    async def admit(self) -> AsyncIterator[None]:
+        """Hold a slot for the duration of the block."""
+        await self._acquire()
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def _acquire(self) -> None:
+        if self._in_flight < self.settings.max_in_flight and not self._waiters:
+            self._in_flight += 1
+            self._counters["admitted"] += 1
+            return
+        if len(self._waiters) >= self.settings.max_queue:
+            self._counters["shed_queue_full"] += 1
+            raise OverloadedError("The chatbot is overloaded, please retry later.")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._counters["queued"] += 1
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(
+                asyncio.shield(waiter), timeout=self.settings.queue_timeout
+            )
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as the wait was given up.
+                self._release()
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                self._counters["shed_timeout"] += 1
+                raise OverloadedError(
+                    "The chatbot is overloaded, please retry later."
+                ) from None
+            raise
+        finally:
+            self._counters["queue_wait_seconds"] += time.monotonic() - start
+        self._counters["admitted"] += 1
+
+    def _release(self) -> None:
+        # Hand the slot to the oldest waiter instead of freeing it, so that
+        # queued requests are never overtaken by new arrivals.
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)
+                return
+        self._in_flight -= 1
+
+    def metrics(self) -> Dict[str, Any]:
+        counters = self._counters
+        shed = counters["shed_queue_full"] + counters["shed_timeout"]
+        arrivals = counters["admitted"] + shed
+        return {
+            **self.settings.dict(),
+            "in_flight": self._in_flight,
+            "queue_depth": len(self._waiters),
+            **counters,
+            "shed_rate": shed / arrivals if arrivals else 0.0,
+        }
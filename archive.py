@@ -0,0 +1,107 @@
+import fnmatch
+import io
+import os
+import tarfile
+import zipfile
+from typing import IO, Iterator, Optional, Tuple
+
+ARCHIVE_PATTERNS = ["*.zip", "*.tar", "*.tar.gz", "*.tgz", "*.tar.bz2", "*.tbz2", "*.tar.xz", "*.txz"]
+
+
+def is_archive(path: str) -> bool:
+    name = os.path.basename(path)
+    return any(fnmatch.fnmatch(name, pattern) for pattern in ARCHIVE_PATTERNS)
+
+
+def split_member_path(path: str) -> Optional[Tuple[str, str]]:
+    """(archive path, member name) if `path` names a member of an archive, as in
+    "original_content/site.zip/about/content01.md"."""
+    parts = path.split("/")
+    for end in range(1, len(parts)):
+        prefix = "/".join(parts[:end])
+        if is_archive(prefix) and os.path.isfile(prefix):
+            return prefix, "/".join(parts[end:])
+    return None
+
+
+class Archive:
+    """A zip or tar archive, read without extracting it.
+
+    Members are addressed by paths below the archive's path, see split_member_path.
+    Zip members are identified by their CRC-32 and size, tar members, which have
+    no checksum of the content, by their mtime and size. Compressed tar archives
+    are decompressed from the start for each member opened out of order; prefer
+    zip or plain tar for large archives.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._zip: Optional[zipfile.ZipFile] = None
+        self._tar: Optional[tarfile.TarFile] = None
+        if zipfile.is_zipfile(path):
+            self._zip = zipfile.ZipFile(path)
+        else:
+            self._tar = tarfile.open(path, "r:*")
+
+    def members(self, pattern: str = "*.md") -> Iterator[Tuple[str, str]]:
+        """The paths and checksums of the files matching `pattern`."""
+        if self._zip is not None:
+            for info in self._zip.infolist():
+                if not info.is_dir() and fnmatch.fnmatch(info.filename, pattern):
+                    yield self._path(info.filename), f"crc32:{info.CRC:08x}:{info.file_size}"
+        else:
+            for info in self._tar:
+                if info.isfile() and fnmatch.fnmatch(info.name, pattern):
+                    yield self._path(info.name), f"mtime:{int(info.mtime)}:{info.size}"
+
+    def open(self, path: str, encoding: Optional[str] = None) -> IO[str]:
+        """The text of the member at `path`. Closing it leaves the archive open."""
+        return io.TextIOWrapper(self._open_binary(path), encoding=encoding)
+
+    def close(self) -> None:
+        if self._zip is not None:
+            self._zip.close()
+        if self._tar is not None:
+            self._tar.close()
+
+    def __enter__(self) -> "Archive":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def _path(self, name: str) -> str:
+        return f"{self.path}/{name}"
+
+    def _open_binary(self, path: str) -> IO[bytes]:
+        name = path[len(self.path) :].lstrip("/")
+        if self._zip is not None:
+            return self._zip.open(name)
+        stream = self._tar.extractfile(name)
+        if stream is None:
+            raise FileNotFoundError(f"{name} is not a file in {self.path}")
+        return stream
+
+
+class _MemberText(io.TextIOWrapper):
+    """The text of a member that closes its archive along with it."""
+
+    def __init__(self, archive: Archive, path: str, encoding: Optional[str] = None):
+        try:
+            super().__init__(archive._open_binary(path), encoding=encoding)
+        except BaseException:
+            archive.close()
+            raise
+        self._archive = archive
+
+    def close(self) -> None:
+        try:
+            super().close()
+        finally:
+            self._archive.close()
+
+
+def open_member(path: str, encoding: Optional[str] = None) -> IO[str]:
+    """The text of an archive member, opening the archive for it alone."""
+    archive_path, _ = split_member_path(path)
+    return _MemberText(Archive(archive_path), path, encoding)
@@ -0,0 +1,66 @@
+"""Measure the per-request cost of building the chat chain.
+
+Run from the repository root (no OpenAI traffic is made, any key will do):
+
+    OPENAI_API_KEY=sk-dummy python -m benchmarks.bench_chain_construction
+
+"before" rebuilds everything per request the way Conversation used to:
+ChatOpenAI, ContentManager, the self-query retriever and its prompt, the QA
+prompts and the ConversationalRetrievalChain. "after" binds the session memory
+to the graph cached by ChainFactory.
+"""
+import argparse
+import tempfile
+import time
+
+from langchain.chat_models import ChatOpenAI
+from langchain.chains import ConversationalRetrievalChain
+
+from content_manager import ContentManager
+from conversation import ChainFactory, Conversation
+
+
+def before(persist_directory: str, memory):
+    llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0)
+    retriever = ContentManager(persist_directory=persist_directory).as_self_query_retriever(
+        llm=llm, search_kwargs={}
+    )
+    return ConversationalRetrievalChain.from_llm(
+        llm,
+        retriever=retriever,
+        memory=memory,
+        chain_type="stuff",
+        combine_docs_chain_kwargs=Conversation._prompts(chain_type="stuff"),
+    )
+
+
+def after(persist_directory: str, memory):
+    return ChainFactory.chat_chain(memory=memory)
+
+
+def measure(func, persist_directory: str, iterations: int) -> float:
+    memory = ChainFactory._template_memory()
+    func(persist_directory, memory)  # warm up imports and caches
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func(persist_directory, memory)
+    return (time.perf_counter() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as persist_directory:
+        ChainFactory._content_manager = ContentManager(
+            persist_directory=persist_directory
+        )
+        for name, func in (("before", before), ("after", after)):
+            per_request = measure(func, persist_directory, args.iterations)
+            print(f"{name:>6}: {per_request * 1e6:,.1f} us/request")
+        ChainFactory.clear()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Measure the import time of `main` and the time to the first answered request.
+
+Run from the repository root (OpenAI traffic goes to loadtest/stub_server.py):
+
+    python -m benchmarks.bench_cold_start
+
+"import" is the median wall time of `import main` in a fresh interpreter,
+next to `import conversation`, which main used to import eagerly. "startup"
+starts uvicorn in an empty working directory and reports when the port
+accepts connections and when the first /chatbot request, sent as soon as the
+port accepts, was answered, along with the warm-up's step timings from /metrics.
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN = "bench-token"
+
+
+def import_time(module: str, env: dict) -> float:
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    output = subprocess.run(
+        [sys.executable, "-c", code], env=env, cwd=ROOT, capture_output=True, text=True, check=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port: int, deadline: float) -> None:
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return
+        except OSError:
+            time.sleep(0.01)
+    raise TimeoutError(f"Nothing listens on port {port}")
+
+
+def request(url: str, body: dict = None) -> dict:
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(
+        url, data=data, headers={"X-Token": TOKEN, "Content-Type": "application/json"}
+    )
+    try:
+        with urllib.request.urlopen(req, timeout=60) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return {"code": f"HTTP {e.code}"}
+
+
+def startup(env: dict, latency: float) -> dict:
+    stub_port, app_port = free_port(), free_port()
+    stub = subprocess.Popen(
+        [sys.executable, "-m", "loadtest.stub_server", "--port", str(stub_port), "--latency", str(latency)],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    wait_for_port(stub_port, time.monotonic() + 30)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.makedirs(os.path.join(workdir, "memorystore"))
+        app_env = {
+            **env,
+            "PYTHONPATH": os.pathsep.join(filter(None, [ROOT, env.get("PYTHONPATH")])),
+            "OPENAI_API_BASE": f"http://127.0.0.1:{stub_port}/v1",
+        }
+        start = time.monotonic()
+        app = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(app_port), "--log-level", "warning"],
+            cwd=workdir,
+            env=app_env,
+        )
+        try:
+            wait_for_port(app_port, start + 60)
+            listening = time.monotonic() - start
+
+            base = f"http://127.0.0.1:{app_port}"
+            answer = request(
+                f"{base}/chatbot", {"session_id": "0" * 64, "message": "Who is Kyden?"}
+            )
+            first_response = time.monotonic() - start
+            warm_up = request(f"{base}/metrics")["message"]["warm_up"]
+        finally:
+            app.terminate()
+            app.wait()
+            stub.terminate()
+            stub.wait()
+
+    return {
+        "listening_s": round(listening, 3),
+        "first_response_s": round(first_response, 3),
+        "first_response_code": answer["code"],
+        "warm_up": warm_up,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.0, help="Stub server latency in seconds.")
+    args = parser.parse_args()
+
+    env = {**os.environ, "OPENAI_API_KEY": "sk-dummy", "ACCESS_TOKEN": TOKEN, "LANGCHAIN_TRACING_V2": "false"}
+    for module in ("main", "conversation"):
+        times = [import_time(module, env) for _ in range(args.runs)]
+        print(f"import {module:<12}: {statistics.median(times) * 1000:8.1f} ms (median of {args.runs})")
+
+    print(f"startup: {json.dumps(startup(env, args.latency), indent=4)}")
+
+
+if __name__ == "__main__":
+    main()
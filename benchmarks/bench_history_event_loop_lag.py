@@ -0,0 +1,99 @@
+"""Measure event-loop lag while many sessions write chat history concurrently.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_history_event_loop_lag --sessions 200 --turns 5
+
+A probe task sleeps for 1ms in a loop and records how late it wakes up. With the
+blocking SqliteChatMessageHistory every read and commit stalls the probe; with
+AsyncSqliteChatMessageHistory the lag should stay close to the idle baseline.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from chat_history import (
+    SqliteChatMessageHistory,
+    AsyncSqliteChatMessageHistory,
+    SqliteWorker,
+)
+
+PROBE_INTERVAL = 0.001
+
+
+async def probe_lag(stop: asyncio.Event, samples: list[float]):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        samples.append(time.perf_counter() - start - PROBE_INTERVAL)
+
+
+async def sync_session(db_file: str, session_id: str, turns: int):
+    history = SqliteChatMessageHistory(session_id=session_id, db_file=db_file)
+    for i in range(turns):
+        history.messages
+        history.add_user_message(f"question {i}")
+        history.add_ai_message(f"answer {i}")
+        await asyncio.sleep(0)
+
+
+async def async_session(db_file: str, session_id: str, turns: int):
+    history = AsyncSqliteChatMessageHistory(session_id=session_id, db_file=db_file)
+    await history.aload()
+    for i in range(turns):
+        history.messages
+        history.add_user_message(f"question {i}")
+        history.add_ai_message(f"answer {i}")
+        await asyncio.sleep(0)
+    await history.aflush()
+
+
+async def run(session_func, db_file: str, sessions: int, turns: int):
+    samples: list[float] = []
+    stop = asyncio.Event()
+    probe = asyncio.create_task(probe_lag(stop, samples))
+    await asyncio.sleep(0.05)
+
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(session_func(db_file, f"session-{i}", turns) for i in range(sessions))
+    )
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await probe
+    return elapsed, samples
+
+
+def report(name: str, elapsed: float, samples: list[float]):
+    samples = sorted(samples)
+    p99 = samples[int(len(samples) * 0.99) - 1] if samples else 0.0
+    print(
+        f"{name:>6}: elapsed={elapsed:.3f}s "
+        f"lag_p50={statistics.median(samples) * 1000:.2f}ms "
+        f"lag_p99={p99 * 1000:.2f}ms "
+        f"lag_max={samples[-1] * 1000:.2f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name, session_func in (("sync", sync_session), ("async", async_session)):
+            db_file = os.path.join(tmpdir, f"{name}.db")
+            elapsed, samples = asyncio.run(
+                run(session_func, db_file, args.sessions, args.turns)
+            )
+            report(name, elapsed, samples)
+        SqliteWorker.close_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Compare the size and read cost of chat histories stored as JSON and as typed columns.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_history_storage --sessions 1000 --turns 10
+
+Each session saves `--turns` turns: a short question and an answer of a few
+hundred words, as the chatbot gives them. The histories are first written in the
+former layout, one JSON `message` column, then migrated to the typed columns by
+`_create_table_if_not_exists`; both files are vacuumed before they are measured.
+A read fetches and rebuilds the messages of one session, as `messages` does. The
+former table had no index on the session; "json+index" adds one, to tell the
+cost of the encoding from that of the scan.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+from typing import Callable, List
+
+from langchain.schema.messages import (
+    AIMessage,
+    BaseMessage,
+    HumanMessage,
+    _message_to_dict,
+    messages_from_dict,
+)
+
+from chat_history import _create_table_if_not_exists, _fetch_messages
+
+WORDS = (
+    "kyden writes about python rust chatbots vector search embeddings sqlite "
+    "langchain markdown the a of to and in is for on with that this it"
+).split()
+
+
+def text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def write_json_history(db_file: str, sessions: int, turns: int) -> None:
+    rng = random.Random(0)
+    conn = sqlite3.connect(db_file)
+    conn.execute(
+        """
+        CREATE TABLE memory_store (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            message TEXT,
+            updated_time TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """
+    )
+    rows = []
+    for _ in range(turns):
+        for session in range(sessions):
+            for message in (
+                HumanMessage(content=text(rng, rng.randint(5, 20))),
+                AIMessage(content=text(rng, rng.randint(50, 300))),
+            ):
+                rows.append((f"session-{session}", json.dumps(_message_to_dict(message))))
+    conn.executemany("INSERT INTO memory_store (session_id, message) VALUES (?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+
+def fetch_json_messages(conn: sqlite3.Connection, session_id: str) -> List[BaseMessage]:
+    # The former _fetch_messages.
+    records = conn.execute(
+        "SELECT message FROM memory_store WHERE session_id = ?", (session_id,)
+    ).fetchall()
+    return messages_from_dict([json.loads(record[0]) for record in records])
+
+
+def vacuumed_size(db_file: str) -> int:
+    conn = sqlite3.connect(db_file)
+    conn.execute("VACUUM")
+    conn.close()
+    return os.path.getsize(db_file)
+
+
+def time_reads(
+    db_file: str, sessions: int, fetch: Callable[[sqlite3.Connection, str], List[BaseMessage]]
+) -> float:
+    """Mean seconds per session read."""
+    conn = sqlite3.connect(db_file)
+    start = time.perf_counter()
+    for session in range(sessions):
+        fetch(conn, f"session-{session}")
+    elapsed = time.perf_counter() - start
+    conn.close()
+    return elapsed / sessions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--turns", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        json_file = os.path.join(tmpdir, "json.db")
+        typed_file = os.path.join(tmpdir, "typed.db")
+        write_json_history(json_file, args.sessions, args.turns)
+        shutil.copy(json_file, typed_file)
+
+        conn = sqlite3.connect(typed_file)
+        start = time.perf_counter()
+        _create_table_if_not_exists(conn, "memory_store")
+        migration = time.perf_counter() - start
+        conn.close()
+
+        sizes, reads = {}, {}
+        sizes["json"] = vacuumed_size(json_file)
+        reads["json"] = time_reads(json_file, args.sessions, fetch_json_messages)
+
+        conn = sqlite3.connect(json_file)
+        conn.execute("CREATE INDEX memory_store_session ON memory_store (session_id, id)")
+        conn.close()
+        sizes["json+index"] = vacuumed_size(json_file)
+        reads["json+index"] = time_reads(json_file, args.sessions, fetch_json_messages)
+
+        sizes["typed"] = vacuumed_size(typed_file)
+        reads["typed"] = time_reads(
+            typed_file,
+            args.sessions,
+            lambda conn, session_id: _fetch_messages(conn, "memory_store", session_id),
+        )
+
+    messages = 2 * args.sessions * args.turns
+    print(f"{messages:,} messages, migrated in {migration:.2f}s")
+    for layout in ("json", "json+index", "typed"):
+        print(
+            f"{layout:<10} size={sizes[layout] / 2**20:7.2f} MiB "
+            f"read={reads[layout] * 1000:7.3f} ms/session "
+            f"({reads[layout] / (2 * args.turns) * 1e6:6.1f} us/message)"
+        )
+
+
+if __name__ == "__main__":
+    main()
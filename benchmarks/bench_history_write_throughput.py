@@ -0,0 +1,78 @@
+"""Measure chat-turn write throughput of the history store versus concurrency.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_history_write_throughput --turns 20
+
+Each session saves `--turns` turns (one human and one AI message each) through
+AsyncSqliteChatMessageHistory. With write-behind batching the number of commits,
+and therefore fsyncs, no longer grows with the number of concurrent sessions.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from chat_history import AsyncSqliteChatMessageHistory, SqliteWorker
+
+
+async def session(db_file: str, session_id: str, turns: int, **kwargs):
+    history = AsyncSqliteChatMessageHistory(
+        session_id=session_id, db_file=db_file, **kwargs
+    )
+    await history.aload()
+    for i in range(turns):
+        history.add_user_message(f"question {i}")
+        history.add_ai_message(f"answer {i}")
+        await history.aflush()
+
+
+async def run(db_file: str, sessions: int, turns: int, **kwargs) -> float:
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(session(db_file, f"session-{i}", turns, **kwargs) for i in range(sessions))
+    )
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument(
+        "--concurrency", type=int, nargs="+", default=[1, 10, 50, 200]
+    )
+    parser.add_argument(
+        "--flush-interval", type=float, nargs="+", default=[0.0, 0.005]
+    )
+    parser.add_argument(
+        "--durability", nargs="+", default=["full", "normal"]
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for durability in args.durability:
+            for flush_interval in args.flush_interval:
+                for sessions in args.concurrency:
+                    db_file = os.path.join(
+                        tmpdir, f"{durability}-{flush_interval}-{sessions}.db"
+                    )
+                    elapsed = asyncio.run(
+                        run(
+                            db_file,
+                            sessions,
+                            args.turns,
+                            flush_interval=flush_interval,
+                            durability=durability,
+                        )
+                    )
+                    SqliteWorker.close_all()
+                    print(
+                        f"durability={durability:<6} flush_interval={flush_interval:<6} "
+                        f"sessions={sessions:<4} "
+                        f"turns/s={sessions * args.turns / elapsed:,.0f}"
+                    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Compare the peak memory of loading and splitting a large document at once and streaming.
+
+Run from the repository root (no OpenAI traffic is made):
+
+    python -m benchmarks.bench_loader_memory --size-mb 50
+
+The document imitates a subtitle export: front matter followed by short cues
+separated by blank lines. Each mode runs in a fresh interpreter, which reports
+its peak RSS, the time taken and a digest of the chunks, so that both modes can
+be seen to produce the same chunks.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+RUN = """
+import hashlib, json, resource, sys, time
+from content_loader import ContentLoader
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+path, mode = sys.argv[1], sys.argv[2]
+splitter = RecursiveCharacterTextSplitter(
+    chunk_size=1000, chunk_overlap=100, separators=["\\n\\n", "\\n", "(?<=\\\\. )", " ", ""]
+)
+baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.perf_counter()
+loader = ContentLoader(path)
+if mode == "load":
+    chunks = iter(splitter.split_documents(loader.load()))
+else:
+    chunks = loader.lazy_load_and_split(splitter)
+digest, count = hashlib.sha256(), 0
+for chunk in chunks:
+    digest.update(chunk.page_content.encode())
+    digest.update(json.dumps(chunk.metadata, sort_keys=True).encode())
+    count += 1
+print(json.dumps({
+    "seconds": round(time.perf_counter() - start, 2),
+    "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    "added_rss_mb": round((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) / 1024, 1),
+    "chunks": count,
+    "digest": digest.hexdigest()[:16],
+}))
+"""
+
+
+def write_subtitles(path: str, size: int) -> None:
+    rng = random.Random(0)
+    words = "kyden talks about python testing vector stores and the weather today".split()
+    with open(path, "w") as f:
+        f.write("---\ncategory: 'video'\ntitle: 'Subtitles'\ndate: '2023-05-23T14:57:07.322Z'\n")
+        f.write("author: 'Kyden'\nisValid: 1\n---\n\n")
+        written, cue = 0, 0
+        while written < size:
+            text = " ".join(rng.choice(words) for _ in range(rng.randint(4, 14)))
+            block = f"{cue}\n00:{cue // 60 % 60:02d}:{cue % 60:02d},000 --> 00:{cue // 60 % 60:02d}:{cue % 60:02d},900\n{text}.\n\n"
+            written += f.write(block)
+            cue += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=float, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "subtitles.md")
+        write_subtitles(path, int(args.size_mb * 1024 * 1024))
+        for mode in ("load", "stream"):
+            output = subprocess.run(
+                [sys.executable, "-c", RUN, path, mode],
+                cwd=ROOT,
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+            print(f"{mode:<6}: {json.loads(output.strip().splitlines()[-1])}")
+
+
+if __name__ == "__main__":
+    main()
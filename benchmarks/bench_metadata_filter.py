@@ -0,0 +1,82 @@
+"""Compare filtered similarity search through Chroma's `where` with MetadataIndex.
+
+Run from the repository root (embeddings are random, no OpenAI traffic is made):
+
+    python -m benchmarks.bench_metadata_filter --sizes 1000 5000 20000
+
+Each corpus spreads its chunks over 8 categories, 50 authors and two years of
+dates. The query filters on one category and one author, the kind of filter the
+self-query retriever writes, which selects about 0.25% of the chunks.
+"""
+import argparse
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from langchain.embeddings import FakeEmbeddings
+from langchain.vectorstores import Chroma
+
+from metadata_index import MetadataIndex
+
+WHERE = {"$and": [{"category": {"$eq": "category-3"}}, {"author": {"$eq": "author-7"}}]}
+
+
+def build(size: int, directory: str, dimensions: int) -> Chroma:
+    rng = random.Random(size)
+    vectordb = Chroma(
+        collection_name=f"bench-{size}",
+        embedding_function=FakeEmbeddings(size=dimensions),
+        persist_directory=directory,
+    )
+    start = datetime(2022, 1, 1, tzinfo=timezone.utc)
+    metadatas = [
+        {
+            "category": f"category-{rng.randrange(8)}",
+            "author": f"author-{rng.randrange(50)}",
+            "date": (start + timedelta(hours=rng.randrange(2 * 365 * 24))).isoformat(),
+        }
+        for _ in range(size)
+    ]
+    for offset in range(0, size, 1000):
+        batch = metadatas[offset : offset + 1000]
+        vectordb.add_texts([f"chunk {offset + i}" for i in range(len(batch))], batch)
+    return vectordb
+
+
+def measure(func, iterations: int) -> float:
+    func()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 20000])
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            vectordb = build(size, directory, args.dimensions)
+            index = MetadataIndex()
+            index.index_collection(vectordb)
+
+            chroma = measure(
+                lambda: vectordb.similarity_search("query", k=4, filter=WHERE),
+                args.iterations,
+            )
+            indexed = measure(
+                lambda: index.search(vectordb, "query", WHERE, k=4), args.iterations
+            )
+            print(
+                f"{size:>7} chunks: chroma where {chroma * 1e3:8.2f} ms, "
+                f"metadata index {indexed * 1e3:8.2f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
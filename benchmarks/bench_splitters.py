@@ -0,0 +1,144 @@
+"""Compare retrieval with the recursive character splitter and MarkdownHeadingSplitter.
+
+Run from the repository root (no OpenAI traffic is made):
+
+    python -m benchmarks.bench_splitters --path ./original_content/
+
+Every heading of the content is a query: the heading's title, with the text of
+its section as the context the retriever should find. Chunks are ranked by the
+TF-IDF cosine similarity of their words to the query, a local stand-in for the
+embeddings. For k = 1, 2, 4 the benchmark reports the share of section lines
+found in the top k chunks, and the characters those chunks add to the prompt.
+It also reports the k needed to retrieve the whole section, and the characters
+that k costs.
+"""
+import argparse
+import glob
+import math
+import os
+import re
+import statistics
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from content_loader import ContentLoader
+from markdown_splitter import MarkdownHeadingSplitter
+
+K_VALUES = [1, 2, 4]
+
+
+def words(text: str) -> List[str]:
+    return re.findall(r"\w+", text.lower())
+
+
+class TfIdf:
+    def __init__(self, chunks: List[str]):
+        self.chunks = chunks
+        counts = [Counter(words(chunk)) for chunk in chunks]
+        document_frequency = Counter(word for count in counts for word in count)
+        self.idf = {
+            word: math.log(len(chunks) / frequency) + 1
+            for word, frequency in document_frequency.items()
+        }
+        self.vectors = [self._weigh(count) for count in counts]
+
+    def _weigh(self, count: Counter) -> Dict[str, float]:
+        vector = {word: n * self.idf.get(word, 0.0) for word, n in count.items()}
+        norm = math.sqrt(sum(value * value for value in vector.values())) or 1.0
+        return {word: value / norm for word, value in vector.items()}
+
+    def rank(self, query: str) -> List[str]:
+        vector = self._weigh(Counter(words(query)))
+        scores = [
+            sum(weight * chunk.get(word, 0.0) for word, weight in vector.items())
+            for chunk in self.vectors
+        ]
+        order = sorted(range(len(self.chunks)), key=lambda i: -scores[i])
+        return [self.chunks[i] for i in order]
+
+
+def queries(paths: List[str]) -> List[Tuple[str, List[str]]]:
+    """(heading title, lines of its section) for every heading of the content."""
+    result = []
+    for path in paths:
+        text = ContentLoader(path).load()[0].page_content
+        for headings, section in MarkdownHeadingSplitter()._sections(text):
+            lines = [
+                line.strip()
+                for line in section.split("\n")
+                if line.strip() and not line.lstrip().startswith("#")
+            ]
+            if headings and lines:
+                result.append((headings[-1], lines))
+    return result
+
+
+def evaluate(name: str, splitter, paths: List[str], cases) -> None:
+    chunks = [
+        document.page_content
+        for path in paths
+        for document in splitter.split_documents(ContentLoader(path).load())
+    ]
+    index = TfIdf(chunks)
+
+    recall = {k: [] for k in K_VALUES}
+    prompt = {k: [] for k in K_VALUES}
+    needed_k, needed_chars = [], []
+    for title, lines in cases:
+        ranked = index.rank(title)
+        for k in K_VALUES:
+            context = "\n".join(ranked[:k])
+            recall[k].append(sum(line in context for line in lines) / len(lines))
+            prompt[k].append(len(context))
+        for k in range(1, len(ranked) + 1):
+            context = "\n".join(ranked[:k])
+            if all(line in context for line in lines):
+                needed_k.append(k)
+                needed_chars.append(len(context))
+                break
+
+    average = statistics.mean(map(len, chunks))
+    print(f"{name}: {len(chunks)} chunks, {average:.0f} chars on average")
+    for k in K_VALUES:
+        print(
+            f"  k={k}: section recall {statistics.mean(recall[k]):6.1%}, "
+            f"prompt {statistics.mean(prompt[k]):6.0f} chars"
+        )
+    print(
+        f"  whole section: k={statistics.mean(needed_k):.2f} on average, "
+        f"prompt {statistics.mean(needed_chars):.0f} chars"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--path", default="./original_content/")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=100)
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.path, "**", "*.md"), recursive=True))
+    cases = queries(paths)
+    print(f"{len(paths)} files, {len(cases)} headings as queries")
+    evaluate(
+        "recursive",
+        RecursiveCharacterTextSplitter(
+            chunk_size=args.chunk_size,
+            chunk_overlap=args.chunk_overlap,
+            separators=["\n\n", "\n", "(?<=\\. )", " ", ""],
+        ),
+        paths,
+        cases,
+    )
+    evaluate(
+        "markdown",
+        MarkdownHeadingSplitter(chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap),
+        paths,
+        cases,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,179 @@
-from typing import List, Any, Optional
+from typing import List, Any, Optional, Callable, Set, Tuple, Union
+from functools import partial
+from concurrent.futures import Future
 
-from langchain.pydantic_v1 import BaseModel, Field, Required
+from langchain.pydantic_v1 import BaseModel, PrivateAttr
 from langchain.schema import (
     BaseChatMessageHistory,
 )
-from langchain.schema.messages import BaseMessage, _message_to_dict, messages_from_dict
+from langchain.schema.messages import (
+    AIMessage,
+    BaseMessage,
+    ChatMessage,
+    FunctionMessage,
+    HumanMessage,
+    SystemMessage,
+    messages_from_dict,
+)
+from sqlite_worker import SqliteWorker
+import asyncio
+import logging
 import sqlite3
 import json
+import zlib
+
+logger = logging.getLogger(__name__)
+
+
+# Messages are stored as typed columns: the role as a small integer, the content
+# as text, or as zlib-compressed bytes once it is long enough to benefit, and any
+# other field of the message, rarely set, as JSON in `extra`.
+ROLES = {"human": 1, "ai": 2, "system": 3, "chat": 4, "function": 5}
+MESSAGE_CLASSES = {
+    1: HumanMessage,
+    2: AIMessage,
+    3: SystemMessage,
+    4: ChatMessage,
+    5: FunctionMessage,
+}
+OTHER_ROLE = 0  # Any other message type, named in `extra`.
+COMPRESS_MIN_BYTES = 512
+
+
+def _create_table_if_not_exists(conn: sqlite3.Connection, table_name: str) -> None:
+    if {"role", "content"} <= _columns(conn, table_name):
+        return
+
+    # Other processes may be creating or migrating the table too; the first to
+    # take the write lock does it, the others find it done.
+    began = not conn.in_transaction
+    if began:
+        conn.execute("BEGIN IMMEDIATE")
+    try:
+        columns = _columns(conn, table_name)
+        if "message" in columns:
+            _migrate_json_messages(conn, table_name)
+        elif not columns:
+            _create_table(conn, table_name)
+        if began:
+            conn.execute("COMMIT")
+    except BaseException:
+        if began:
+            conn.execute("ROLLBACK")
+        raise
+
+
+def _columns(conn: sqlite3.Connection, table_name: str) -> Set[str]:
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table_name})")}
+
+
+def _create_table(conn: sqlite3.Connection, table_name: str) -> None:
+    conn.execute(
+        f"""
+        CREATE TABLE {table_name} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            role INTEGER NOT NULL,
+            content NOT NULL,
+            extra TEXT,
+            created_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
+        )
+    """
+    )
+    conn.execute(
+        f"CREATE INDEX IF NOT EXISTS {table_name}_session ON {table_name} (session_id, id)"
+    )
+
+
+def _migrate_json_messages(conn: sqlite3.Connection, table_name: str) -> None:
+    """Convert a table of the former layout, a JSON `message` column, in place."""
+    legacy = f"{table_name}_json"
+    conn.execute(f"ALTER TABLE {table_name} RENAME TO {legacy}")
+    _create_table(conn, table_name)
+    rows = conn.execute(
+        f"""
+        SELECT id, session_id, message, CAST(strftime('%s', updated_time) AS INTEGER)
+        FROM {legacy} WHERE message IS NOT NULL ORDER BY id
+    """
+    )
+    insert = f"""
+        INSERT INTO {table_name} (id, session_id, role, content, extra, created_at)
+        VALUES (?, ?, ?, ?, ?, COALESCE(?, CAST(strftime('%s', 'now') AS INTEGER)))
+    """
+    while batch := rows.fetchmany(1000):
+        messages = messages_from_dict([json.loads(message) for _, _, message, _ in batch])
+        conn.executemany(
+            insert,
+            [
+                (id, session_id, *_encode_message(message), created_at)
+                for (id, session_id, _, created_at), message in zip(batch, messages)
+            ],
+        )
+    conn.execute(f"DROP TABLE {legacy}")
+
+
+def _encode_message(message: BaseMessage) -> Tuple[int, Union[str, bytes], Optional[str]]:
+    data = message.dict()
+    content = data.pop("content")
+    # Only drop defaults: `value in (None, False, {})` would drop 0 too, as 0 == False.
+    extra = {
+        name: value
+        for name, value in data.items()
+        if not (value is None or value is False or value == {})
+    }
+    role = ROLES.get(message.type, OTHER_ROLE)
+    if role == OTHER_ROLE:
+        extra["type"] = message.type
+    stored: Union[str, bytes] = content
+    encoded = content.encode()
+    if len(encoded) >= COMPRESS_MIN_BYTES:
+        compressed = zlib.compress(encoded)
+        if len(compressed) < len(encoded):
+            stored = compressed
+    return role, stored, json.dumps(extra, separators=(",", ":")) if extra else None
+
+
+def _decode_message(role: int, content: Union[str, bytes], extra: Optional[str]) -> BaseMessage:
+    if isinstance(content, bytes):
+        content = zlib.decompress(content).decode()
+    fields = json.loads(extra) if extra else {}
+    if role == OTHER_ROLE:
+        message_type = fields.pop("type")
+        data = {"content": content, **fields}
+        return messages_from_dict([{"type": message_type, "data": data}])[0]
+    # Rows were validated when they were written.
+    return MESSAGE_CLASSES[role].construct(content=content, **fields)
+
+
+def _fetch_messages(
+    conn: sqlite3.Connection, table_name: str, session_id: str
+) -> List[BaseMessage]:
+    fetch_messages = f"""
+        SELECT role, content, extra FROM {table_name} WHERE session_id = ? ORDER BY id
+    """
+    cursor = conn.execute(fetch_messages, (session_id,))
+    return [_decode_message(*record) for record in cursor.fetchall()]
+
+
+def _add_messages(
+    conn: sqlite3.Connection,
+    table_name: str,
+    session_id: str,
+    messages: List[BaseMessage],
+) -> None:
+    add_message = f"""
+        INSERT INTO {table_name} (session_id, role, content, extra) VALUES (?, ?, ?, ?)
+    """
+    rows = [(session_id, *_encode_message(message)) for message in messages]
+    conn.executemany(add_message, rows)
+
+
+def _clear_messages(conn: sqlite3.Connection, table_name: str, session_id: str):
+    clear_message = f"""
+      DELETE FROM {table_name}
+      WHERE session_id = ?
+    """
+    conn.execute(clear_message, (session_id,))
 
 
 class SqliteChatMessageHistory(BaseChatMessageHistory, BaseModel):
@@ -35,44 +202,130 @@ class SqliteChatMessageHistory(BaseChatMessageHistory, BaseModel):
 
     @property
     def messages(self):
-        fetch_messages = f"""
-            SELECT message FROM {self.table_name} WHERE session_id = ?
-        """
         with self.conn:
-            cursor = self.conn.execute(fetch_messages, (self.session_id,))
-            records = cursor.fetchall()
-            items = [json.loads(record[0]) for record in records]
-            messages = messages_from_dict(items)
-            return messages
+            return _fetch_messages(self.conn, self.table_name, self.session_id)
 
     def add_message(self, message: BaseMessage) -> None:
-        add_message = f"""
-            INSERT INTO {self.table_name} (session_id, message) VALUES (?, ?)
-        """
-        jsonstr = json.dumps(_message_to_dict(message))
         with self.conn:
-            self.conn.execute(add_message, (self.session_id, jsonstr))
+            _add_messages(self.conn, self.table_name, self.session_id, [message])
 
     def clear(self):
         """Clear session memory from db"""
-        clear_message = f"""
-          DELETE FROM {self.table_name}
-          WHERE session_id = ?
-        """
         with self.conn:
-            self.conn.execute(clear_message, (self.session_id,))
+            _clear_messages(self.conn, self.table_name, self.session_id)
 
     def _create_table_if_not_exists(self) -> None:
-        create_table_query = f"""
-            CREATE TABLE IF NOT EXISTS {self.table_name} (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_id TEXT NOT NULL,
-                message TEXT,
-                updated_time TEXT DEFAULT CURRENT_TIMESTAMP
+        with self.conn:
+            _create_table_if_not_exists(self.conn, self.table_name)
+
+
+class AsyncSqliteChatMessageHistory(BaseChatMessageHistory, BaseModel):
+    """A SqliteChatMessageHistory whose I/O runs on a SqliteWorker thread.
+
+    Await `aload` before handing it to a memory object: `messages` is then served
+    from the loaded copy and `add_message` only enqueues the insert, so the
+    synchronous memory API never touches the database on the event loop.
+    """
+
+    session_id: str = "default"
+    table_name: str = "memory_store"
+    worker: SqliteWorker = None
+
+    _messages: Optional[List[BaseMessage]] = PrivateAttr(default=None)
+    _pending: List[Future] = PrivateAttr(default_factory=list)
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def __init__(
+        self,
+        session_id: str,
+        db_file: str = "./memorystore/chat_message_history.db",
+        table_name: str = "memory_store",
+        flush_interval: float = 0.005,
+        durability: str = "full",
+        *args: Any,
+        **kwargs: Any,
+    ):
+        super().__init__(*args, **kwargs)
+
+        self.worker = SqliteWorker.for_file(
+            db_file, flush_interval=flush_interval, durability=durability
+        )
+        self.session_id = session_id
+        self.table_name = table_name
+
+        self._submit(partial(_create_table_if_not_exists, table_name=table_name))
+
+    async def aload(self) -> List[BaseMessage]:
+        """Read the session's messages on the worker thread and keep them in memory."""
+        self._messages = await self.worker.run(
+            partial(
+                _fetch_messages,
+                table_name=self.table_name,
+                session_id=self.session_id,
             )
-        """
+        )
+        return list(self._messages)
 
-        with self.conn:
-            cursor = self.conn.cursor()
-            cursor.execute(create_table_query)
-            # cursor.execute(create_update_time_trigger)
+    @property
+    def messages(self) -> List[BaseMessage]:
+        if self._messages is None:
+            # Not preloaded with aload(), fall back to a blocking read.
+            self._messages = self.worker.submit(
+                partial(
+                    _fetch_messages,
+                    table_name=self.table_name,
+                    session_id=self.session_id,
+                )
+            ).result()
+        return list(self._messages)
+
+    def add_message(self, message: BaseMessage) -> None:
+        if self._messages is not None:
+            self._messages.append(message)
+        self._submit_write(
+            partial(
+                _add_messages,
+                table_name=self.table_name,
+                session_id=self.session_id,
+                messages=[message],
+            )
+        )
+
+    def clear(self):
+        """Clear session memory from db"""
+        self._messages = []
+        self._submit_write(
+            partial(
+                _clear_messages,
+                table_name=self.table_name,
+                session_id=self.session_id,
+            )
+        )
+
+    async def aclear(self):
+        self.clear()
+        await self.aflush()
+
+    async def aflush(self) -> None:
+        """Wait until every write enqueued by this history has been committed."""
+        pending, self._pending = self._pending, []
+        await asyncio.gather(*(asyncio.wrap_future(future) for future in pending))
+
+    def _submit(self, func: Callable[[sqlite3.Connection], Any]) -> Future:
+        return self._track(self.worker.submit(func))
+
+    def _submit_write(self, func: Callable[[sqlite3.Connection], Any]) -> Future:
+        return self._track(self.worker.submit_write(func))
+
+    def _track(self, future: Future) -> Future:
+        future.add_done_callback(self._log_failure)
+        self._pending = [item for item in self._pending if not item.done()]
+        self._pending.append(future)
+        return future
+
+    @staticmethod
+    def _log_failure(future: Future) -> None:
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("Chat history write failed", exc_info=future.exception())
@@ -1,17 +1,44 @@
-from typing import List
+import copy
+import hashlib
+import logging
+from itertools import chain
+from typing import IO, Iterator, List, Optional
 from langchain.docstore.document import Document
 from langchain.document_loaders import TextLoader
+from langchain.text_splitter import RecursiveCharacterTextSplitter, TextSplitter
 import yaml
 
+from archive import Archive, open_member, split_member_path
+
+logger = logging.getLogger(__name__)
+
+FRONT_MATTER_MARKER = "---"
+
 class ContentLoader(TextLoader):
-    def __init__(self, file_path: str, encoding: str | None = None, autodetect_encoding: bool = False):
+    """Loads a markdown doc, a file or a member of a zip or tar archive addressed as
+    "<archive path>/<member name>". Pass the open `archive` to read several members
+    without opening it again for each."""
+
+    def __init__(
+        self,
+        file_path: str,
+        encoding: str | None = None,
+        autodetect_encoding: bool = False,
+        archive: Optional[Archive] = None,
+    ):
         super().__init__(file_path, encoding, autodetect_encoding)
+        self.archive = archive
+        self.in_archive = archive is not None or split_member_path(file_path) is not None
 
     
     def load(self) -> List[Document]:
         """Load a doc file, then parse and use its YFM(YAML Front Matter) as metadata
         """
-        docs = super().load()
+        if self.in_archive:
+            with self._open() as f:
+                docs = [Document(page_content=f.read(), metadata={"source": self.file_path})]
+        else:
+            docs = super().load()
         text = docs[0].page_content
         metadata = docs[0].metadata
         
@@ -29,3 +56,205 @@ class ContentLoader(TextLoader):
                 return front_matter
         return None
 
+    def load_metadata(self) -> dict:
+        """The metadata `load` returns, read from the head of the file only."""
+        metadata = {"source": self.file_path}
+        if (text_metadata := self._read_front_matter()):
+            metadata.update(text_metadata)
+        return metadata
+
+    def digest(self, block_size: int = 1 << 16) -> str:
+        """The SHA-256 of the text, read in blocks."""
+        sha256 = hashlib.sha256()
+        with self._open() as f:
+            while block := f.read(block_size):
+                sha256.update(block.encode())
+        return sha256.hexdigest()
+
+    def lazy_load_and_split(
+        self, text_splitter: TextSplitter, block_size: int = 1 << 16
+    ) -> Iterator[Document]:
+        """Yield the documents of `text_splitter.split_documents(self.load())`, one at a time.
+
+        The file is read in blocks of `block_size` characters and cut into paragraphs at the
+        separator the splitter would choose for the whole text, which are merged into chunks
+        as they arrive. Memory use is bounded by the front matter, the longest paragraph and
+        the chunk size instead of the file size. Splitters other than a plain
+        RecursiveCharacterTextSplitter, and encoding autodetection, load the whole file.
+        """
+        if not self._can_stream(text_splitter):
+            yield from text_splitter.split_documents(self.load())
+            return
+
+        metadata = self.load_metadata()
+        separators = text_splitter._separators
+        index = self._first_separator(separators, block_size)
+        separator = separators[index] if index is not None else ""
+        if not separator:
+            # Nothing to cut at, the splitter would split the text character by character.
+            yield from text_splitter.split_documents(self.load())
+            return
+
+        merger = _ChunkMerger(text_splitter)
+        for piece in self._paragraphs(separator, block_size):
+            if text_splitter._length_function(piece) < text_splitter._chunk_size:
+                chunks = merger.add(piece)
+            elif index + 1 < len(separators):
+                chunks = chain(
+                    merger.flush(),
+                    text_splitter._split_text(piece, separators[index + 1 :]),
+                )
+            else:
+                chunks = chain(merger.flush(), [piece])
+            for chunk in chunks:
+                yield Document(page_content=chunk, metadata=copy.deepcopy(metadata))
+        for chunk in merger.flush():
+            yield Document(page_content=chunk, metadata=copy.deepcopy(metadata))
+
+    def _can_stream(self, text_splitter: TextSplitter) -> bool:
+        return (
+            type(text_splitter) is RecursiveCharacterTextSplitter
+            and text_splitter._keep_separator
+            and not text_splitter._is_separator_regex
+            and not text_splitter._add_start_index
+            and not self.autodetect_encoding
+        )
+
+    def _open(self) -> IO[str]:
+        if self.archive is not None:
+            return self.archive.open(self.file_path, encoding=self.encoding)
+        if self.in_archive:
+            return open_member(self.file_path, encoding=self.encoding)
+        return open(self.file_path, encoding=self.encoding)
+
+    def _read_front_matter(self) -> Optional[dict]:
+        # parse_front_matter of the whole text only looks at the text up to the second marker.
+        with self._open() as f:
+            if f.read(len(FRONT_MATTER_MARKER)) != FRONT_MATTER_MARKER:
+                return None
+        end = self._find(FRONT_MATTER_MARKER, start=len(FRONT_MATTER_MARKER))
+        if end is None:
+            return None
+        with self._open() as f:
+            return self.parse_front_matter(f.read(end + len(FRONT_MATTER_MARKER)))
+
+    def _find(self, needle: str, start: int = 0, block_size: int = 1 << 16) -> Optional[int]:
+        """The offset of the first `needle` at or after `start`, without holding the file."""
+        offset = 0  # of `window` in the text
+        window = ""
+        with self._open() as f:
+            while block := f.read(block_size):
+                window += block
+                found = window.find(needle, max(start - offset, 0))
+                if found != -1:
+                    return offset + found
+                keep = len(needle) - 1
+                offset += len(window) - keep
+                window = window[len(window) - keep :] if keep else ""
+        return None
+
+    def chunk_offsets(self, block_size: int = 1 << 16) -> Iterator[Optional[int]]:
+        """A generator that is sent the chunks split from the text, in order, and yields
+        the start offset of each, as the splitters' `add_start_index` finds it: the
+        first occurrence after the previous chunk's start, None if there is none. The
+        text is read once, alongside the split; prime it with `next`."""
+        previous = -1
+        offset = 0  # of `window` in the text
+        window = ""
+        with self._open() as f:
+            chunk = yield None
+            while True:
+                found = window.find(chunk, previous + 1 - offset)
+                if found == -1:
+                    block = f.read(block_size)
+                    if block:
+                        window += block
+                        continue
+                    chunk = yield None
+                    continue
+                previous = offset + found
+                # Later chunks start after this one.
+                window = window[found:]
+                offset = previous
+                chunk = yield previous
+
+    def _first_separator(self, separators: List[str], block_size: int) -> Optional[int]:
+        """The index of the first separator that occurs in the text, as the splitter picks
+        it. None if none does before the empty separator."""
+        if "" in separators:
+            separators = separators[: separators.index("")]
+        if not separators:
+            return None
+        found: Optional[int] = None
+        tail = ""
+        keep = max(len(separator) for separator in separators) - 1
+        with self._open() as f:
+            while block := f.read(block_size):
+                window = tail + block
+                for index, separator in enumerate(separators[:found]):
+                    if separator in window:
+                        found = index
+                        break
+                if found == 0:
+                    break
+                tail = window[len(window) - keep :] if keep else ""
+        return found
+
+    def _paragraphs(self, separator: str, block_size: int) -> Iterator[str]:
+        """The text split at `separator`, each piece but the first starting with it,
+        as `re.split` with a capturing group splits it."""
+        buffer = ""
+        start = 0  # of the current piece in `buffer`
+        searched = 0  # where to look for the next separator in `buffer`
+        with self._open() as f:
+            while block := f.read(block_size):
+                buffer = buffer[start:] + block
+                searched -= start
+                start = 0
+                while (found := buffer.find(separator, searched)) != -1:
+                    if buffer[start:found]:
+                        yield buffer[start:found]
+                    start = found
+                    searched = found + len(separator)
+                searched = max(searched, len(buffer) - len(separator) + 1)
+        if buffer[start:]:
+            yield buffer[start:]
+
+
+class _ChunkMerger:
+    """TextSplitter._merge_splits, fed one split at a time. Joins without a separator,
+    as RecursiveCharacterTextSplitter does when it keeps the separators in the splits."""
+
+    def __init__(self, text_splitter: TextSplitter):
+        self.text_splitter = text_splitter
+        self.current: List[str] = []
+        self.total = 0
+
+    def add(self, split: str) -> Iterator[str]:
+        length = self.text_splitter._length_function(split)
+        chunk_size = self.text_splitter._chunk_size
+        if self.total + length > chunk_size:
+            if self.total > chunk_size:
+                logger.warning(
+                    f"Created a chunk of size {self.total}, "
+                    f"which is longer than the specified {chunk_size}"
+                )
+            if self.current:
+                doc = self.text_splitter._join_docs(self.current, "")
+                if doc is not None:
+                    yield doc
+                while self.total > self.text_splitter._chunk_overlap or (
+                    self.total + length > chunk_size and self.total > 0
+                ):
+                    self.total -= self.text_splitter._length_function(self.current[0])
+                    self.current = self.current[1:]
+        self.current.append(split)
+        self.total += length
+
+    def flush(self) -> Iterator[str]:
+        doc = self.text_splitter._join_docs(self.current, "")
+        self.current = []
+        self.total = 0
+        if doc is not None:
+            yield doc
+
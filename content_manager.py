@@ -1,8 +1,15 @@
+import argparse
 import os
+import sys
+import threading
+import time
+import uuid
 import fnmatch
 import json
-from pydantic import BaseModel, Field
-from typing import List, Optional, Any, cast
+from contextlib import nullcontext
+from itertools import islice
+from pydantic import BaseModel, Field, PrivateAttr
+from typing import Callable, Iterator, List, Optional, Any, cast
 
 from langchain.embeddings.openai import OpenAIEmbeddings
 from langchain.vectorstores import Chroma
@@ -13,11 +20,29 @@ from langchain.schema import BaseRetriever, Document
 from langchain.schema.language_model import BaseLanguageModel
 from langchain.callbacks.manager import AsyncCallbackManagerForRetrieverRun
 from langchain.chains.query_constructor.ir import StructuredQuery
+from archive import Archive, is_archive, split_member_path
 from content_loader import ContentLoader
+from dedup import DuplicateIndex
+from executors import BoundedExecutor, Executors
+from markdown_splitter import MarkdownHeadingSplitter
+from split_cache import SplitCache
+from http_pool import HttpClientPool
+from index_snapshots import IndexSnapshots
+from metadata_index import MetadataIndex, TIMESTAMP_SUFFIX, to_timestamp
+from retrieval_cache import RetrievalCache
+from usage import MeteredEmbeddings, measure_embeddings
 from datetime import datetime, timezone
 
 
 class AsyncSelfQueryRetriever(SelfQueryRetriever):
+    metadata_index: Optional[MetadataIndex] = None
+    """Precomputed metadata postings; filtered similarity searches rank only their candidates."""
+    retrieval_cache: Optional[RetrievalCache] = None
+    """Results of similarity searches; a repeated search embeds nothing and queries nothing."""
+    index_version: Optional[str] = None
+    """The snapshot version "vectorstore" was opened from; results are cached per version,
+    so a retriever of a replaced version never serves, nor stores, results of another."""
+
     async def _aget_relevant_documents(
         self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
     ) -> List[Document]:
@@ -28,6 +53,8 @@ class AsyncSelfQueryRetriever(SelfQueryRetriever):
         Returns:
             List of relevant documents
         """
+        # Before any await: a result is stored only if the index did not change since.
+        cache_version = self.retrieval_cache.version if self.retrieval_cache is not None else None
         inputs = self.llm_chain.prep_inputs({"query": query})
 
         structured_query = cast(
@@ -50,11 +77,98 @@ class AsyncSelfQueryRetriever(SelfQueryRetriever):
             new_query = query
 
         search_kwargs = {**self.search_kwargs, **new_kwargs}
-        docs = await self.vectorstore.asearch(
-            new_query, self.search_type, **search_kwargs
+        if self.retrieval_cache is not None and self.search_type == "similarity":
+            return await self._cached_similarity_search(
+                new_query, search_kwargs, cache_version, run_manager=run_manager
+            )
+
+        where = search_kwargs.get("filter")
+        if where and self.metadata_index is not None:
+            if self.search_type == "similarity":
+                docs = await self._search(
+                    run_manager,
+                    self.metadata_index.search,
+                    self.vectorstore,
+                    new_query,
+                    where,
+                    search_kwargs.get("k", 4),
+                )
+                if docs is not None:
+                    return docs
+            search_kwargs["filter"] = self.metadata_index.chroma_where(where)
+        # Not VectorStore.asearch, which runs on asyncio's default executor.
+        docs = await self._search(
+            run_manager, self.vectorstore.search, new_query, self.search_type, **search_kwargs
         )
         return docs
 
+    async def _search(
+        self,
+        run_manager: Optional[AsyncCallbackManagerForRetrieverRun],
+        fn: Callable[..., Any],
+        *args: Any,
+        **kwargs: Any,
+    ) -> Any:
+        """Run a search on the search pool, and report the query embeddings it made
+        to the callbacks, see UsageRecorder."""
+        result, calls = await Executors.shared().search.run(
+            measure_embeddings, fn, *args, **kwargs
+        )
+        if calls and run_manager is not None:
+            await run_manager.on_text("", usage_calls=calls)
+        return result
+
+    async def _cached_similarity_search(
+        self,
+        query: str,
+        search_kwargs: dict,
+        version: Optional[int] = None,
+        run_manager: Optional[AsyncCallbackManagerForRetrieverRun] = None,
+    ) -> List[Document]:
+        """`version` is the cache version when the retrieval started, by default now."""
+        cache = cast(RetrievalCache, self.retrieval_cache)
+        if version is None:
+            version = cache.version
+        key = RetrievalCache.key(
+            query,
+            self.search_type,
+            search_kwargs.get("filter"),
+            search_kwargs.get("k", 4),
+            self.index_version,
+        )
+        docs = cache.get(key)
+        if docs is not None:
+            return docs
+        found = await self._search(
+            run_manager, self._similarity_search_with_ids, query, search_kwargs
+        )
+        cache.put(key, found, version)
+        return [doc for _, doc in found]
+
+    def _similarity_search_with_ids(
+        self, query: str, search_kwargs: dict
+    ) -> List[tuple[str, Document]]:
+        """The similarity search of _aget_relevant_documents, with the IDs of the documents."""
+        where = search_kwargs.get("filter")
+        k = search_kwargs.get("k", 4)
+        if where and self.metadata_index is not None:
+            found = self.metadata_index.search_with_ids(self.vectorstore, query, where, k)
+            if found is not None:
+                return found
+            where = self.metadata_index.chroma_where(where)
+        results = self.vectorstore._collection.query(
+            query_embeddings=[self.vectorstore._embedding_function.embed_query(query)],
+            n_results=k,
+            where=where or None,
+            include=["documents", "metadatas"],
+        )
+        return [
+            (id, Document(page_content=document, metadata=metadata or {}))
+            for id, document, metadata in zip(
+                results["ids"][0], results["documents"][0], results["metadatas"][0]
+            )
+        ]
+
 
 class FileForEmbedding(BaseModel):
     """Specifies the required metadata when using ContentManager to manage embedding."""
@@ -63,6 +177,8 @@ class FileForEmbedding(BaseModel):
     update_time: datetime
     IDs: List[str]
     is_valid: bool = True
+    # Of archive members, see Archive.members: a changed checksum updates the file too.
+    checksum: Optional[str] = None
 
     @classmethod
     def from_dict(cls, data):
@@ -74,21 +190,65 @@ class FileForEmbedding(BaseModel):
             update_time=update_time,
             IDs=data["IDs"],
             is_valid=data["is_valid"],
+            checksum=data.get("checksum"),
         )
 
     def to_dict(self):
-        return {
+        data = {
             "file": self.file,
             "update_time": self.update_time.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z",
             "IDs": self.IDs,
             "is_valid": self.is_valid,
         }
+        if self.checksum is not None:
+            data["checksum"] = self.checksum
+        return data
+
+
+class SyncPlan:
+    """The operations of a sync, computed by ContentManager.plan from the files in
+    "original_content_path" and their embedding records. A file in both `adding`
+    and `deleting` is updated: its chunks are deleted, then embedded again."""
+
+    def __init__(
+        self,
+        all_files: list[FileForEmbedding],
+        adding: list[FileForEmbedding],
+        deleting: list[FileForEmbedding],
+        rebuild: bool = False,
+    ):
+        self.all_files = all_files
+        self.adding = adding
+        self.deleting = deleting
+        self.rebuild = rebuild
+
+    def summary(self) -> dict[str, Any]:
+        adding = {item.file for item in self.adding}
+        deleting = {item.file for item in self.deleting}
+        return {
+            "rebuild": self.rebuild,
+            "add": sorted(adding - deleting),
+            "update": sorted(adding & deleting),
+            "delete": sorted(deleting - adding),
+            "unchanged": len(self.all_files) - len(adding | deleting),
+        }
+
+
+# Called with the events of a sync: {"stage": "plan", "add": 2, ...} once, {"stage": "embed",
+# "files": 3, "files_total": 10, "chunks": 240, ...} after each batch and file, and
+# {"stage": ..., "seconds": 1.5} at the end of the "delete", "embed" and "index" stages.
+SyncProgress = Callable[[dict[str, Any]], None]
 
 
 class ContentManager(BaseModel):
     """A class used to manage embedding data.
     Place markdown docs to the path specified by the "original_content_path" field,
     ContentManager will traverse all the docs and handle embedding, adding, updating, and deletion properly.
+
+    With "snapshots" set, the vector store and its embedding record live in versioned
+    snapshots instead of "persist_directory": each sync builds a new version and publishes
+    it atomically, and "refresh" switches a running reader to the latest published version.
+    A "read_only" manager only serves published versions, as in the workers started by serve.py.
     """
 
     class Config:
@@ -96,14 +256,39 @@ class ContentManager(BaseModel):
 
     original_content_path: str = "./original_content/"
     embedding_record_file: str = "embedding.json"
+    metadata_index_file: str = "metadata_index.json"
     persist_directory: str = "./vectorstore/chroma/"
     collection_name: str = "kyden-chatbot"
     chunk_size: int = 1000
     chunk_overlap: int = 100
     separators: List[str] = ["\n\n", "\n", "(?<=\\. )", " ", ""]
+    # Split at markdown headings and record the heading path of each chunk, see
+    # MarkdownHeadingSplitter. Files already embedded keep their chunks until they change.
+    markdown_headings: bool = False
+    # Skip chunks that nearly duplicate an indexed chunk, see DuplicateIndex. The file
+    # then shares the indexed chunk, whose "sources" metadata field lists all its files.
+    deduplicate: bool = False
+    duplicate_threshold: float = 0.85
+    # Chunks of a file are embedded and added in batches of this size, as they are split.
+    embedding_batch_size: int = 1000
+    # Files embedded at the same time. Writes to the vector store are serialized.
+    embedding_workers: int = 1
+    # Chunks and front matter of files already split, see SplitCache.
+    split_cache: Optional[SplitCache] = None
+    # Results of the retrievers' similarity searches, dropped whenever the index changes.
+    retrieval_cache: Optional[RetrievalCache] = None
     embedding: Optional[OpenAIEmbeddings] = None
     vectordb: Optional[Chroma] = None
     splitter: Optional[TextSplitter] = None
+    snapshots: Optional[IndexSnapshots] = None
+    metadata_index: Optional[MetadataIndex] = None
+    index_version: Optional[str] = None
+    read_only: bool = False
+    # Counts and timings of the last sync, see _sync.
+    last_sync: Optional[dict[str, Any]] = None
+
+    # Change token of the served index as of the last refresh, see _change_mtime.
+    _seen_mtime: Optional[int] = PrivateAttr(default=None)
 
     def __init__(
         self,
@@ -114,6 +299,12 @@ class ContentManager(BaseModel):
         chunk_size: int = 1000,
         chunk_overlap: int = 100,
         separators: Optional[List[str]] = None,
+        snapshots: Optional[IndexSnapshots] = None,
+        read_only: bool = False,
+        markdown_headings: bool = False,
+        deduplicate: bool = False,
+        split_cache: Optional[SplitCache] = None,
+        retrieval_cache: Optional[RetrievalCache] = None,
         *args: Any,
         **kwargs: Any,
     ) -> None:
@@ -131,35 +322,98 @@ class ContentManager(BaseModel):
         self.chunk_overlap = chunk_overlap
         if separators:
             self.separators = separators
+        self.markdown_headings = markdown_headings
+        self.deduplicate = deduplicate
+        if split_cache:
+            self.split_cache = split_cache
+        if retrieval_cache:
+            self.retrieval_cache = retrieval_cache
+
+        self.read_only = read_only
+        if snapshots:
+            self.snapshots = snapshots
+            self.index_version = snapshots.current_version()
+            if self.index_version is None:
+                if read_only:
+                    raise ValueError(f"No index version is published in {snapshots.root}")
+                # Bootstrap an empty first version.
+                self.index_version = snapshots.begin()
+                snapshots.publish(self.index_version, documents=0)
+            self.persist_directory = snapshots.version_path(self.index_version)
 
+        # Embedding requests share the process-wide keep-alive pool.
+        HttpClientPool.shared()
         self.embedding = OpenAIEmbeddings()
-        self.vectordb = Chroma(
-            collection_name=self.collection_name,
-            embedding_function=self.embedding,
-            persist_directory=self.persist_directory,
-        )
-        self.splitter = RecursiveCharacterTextSplitter(
-            chunk_size=self.chunk_size,
-            chunk_overlap=self.chunk_overlap,
-            separators=self.separators,
-        )
+        self._seen_mtime = self._change_mtime()
+        self.vectordb = self._open_vectordb()
+        if self.markdown_headings:
+            self.splitter = MarkdownHeadingSplitter(
+                chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap
+            )
+        else:
+            self.splitter = RecursiveCharacterTextSplitter(
+                chunk_size=self.chunk_size,
+                chunk_overlap=self.chunk_overlap,
+                separators=self.separators,
+            )
 
-    def trigger_embedding(self):
+    def trigger_embedding(
+        self, rebuild: bool = False, progress: Optional[SyncProgress] = None
+    ) -> Optional[dict[str, Any]]:
         """Traverse the docs in the directory specified by the "original_content_path" field,
         compare them with the records in the embedding.json file to determine proper operations (embedding, adding, updating, deleting),
-        then evoke those operations.
+        then evoke those operations, see plan.
+        With snapshots, the operations are applied to a new version, which is verified and then published.
+        With "rebuild", the records are ignored and every valid doc is embedded into an empty collection.
+        With "deduplicate", returns how many of the new chunks were skipped as duplicates.
+        Counts and timings are kept in "last_sync".
         """
-        all_files = self._traverse_original_content(self.original_content_path)
-        embedding_dict: dict[str, FileForEmbedding] = {}
+        if self.read_only:
+            raise ValueError("This ContentManager is read-only, ingestion is owned by another process.")
+        if self.snapshots is None:
+            try:
+                self.last_sync = self._sync(rebuild, progress)
+            finally:
+                # Even a failed sync may have changed the vector store. This instance
+                # already serves it, no need to open it again on refresh.
+                self._seen_mtime = self._change_mtime()
+                self._index_changed()
+            return self.last_sync["duplicates"]
 
-        if os.path.exists(f"{self.original_content_path}{self.embedding_record_file}"):
-            with open(
-                f"{self.original_content_path}{self.embedding_record_file}", "r"
-            ) as file:
-                data_list = json.load(file)
-                for item in data_list:
-                    obj = FileForEmbedding.from_dict(item)
-                    embedding_dict[obj.file] = obj
+        version = self.snapshots.begin()
+        try:
+            builder = self.copy(
+                update={
+                    "persist_directory": self.snapshots.version_path(version),
+                    "index_version": version,
+                }
+            )
+            builder.vectordb = builder._open_vectordb()
+            report = builder._sync(rebuild, progress)
+            start = time.perf_counter()
+            problems = builder.verify()
+            if problems:
+                raise ValueError(f"Index version {version} is invalid: {problems}")
+            report["seconds"]["verify"] = time.perf_counter() - start
+        except BaseException:
+            self.snapshots.discard(version)
+            raise
+
+        start = time.perf_counter()
+        self.snapshots.publish(
+            version, documents=report["documents"], duplicates=report["duplicates"]
+        )
+        self.refresh()
+        report["seconds"]["publish"] = time.perf_counter() - start
+        report["index_version"] = version
+        self.last_sync = report
+        return report["duplicates"]
+
+    def plan(self, rebuild: bool = False) -> SyncPlan:
+        """Compare the docs with their embedding records, without changing anything.
+        With "rebuild", the records are ignored."""
+        all_files = self._traverse_original_content(self.original_content_path)
+        embedding_dict = {} if rebuild else self._load_records()
 
         deleting_list: list[FileForEmbedding] = []
         adding_list: list[FileForEmbedding] = []
@@ -172,45 +426,384 @@ class ContentManager(BaseModel):
                     deleting_list.append(item)
                 elif not record.is_valid and item.is_valid:
                     adding_list.append(item)
-                elif item.update_time > record.update_time:
+                elif item.update_time > record.update_time or (
+                    item.is_valid and item.checksum != record.checksum
+                ):
                     deleting_list.append(item)
                     adding_list.append(item)
 
             elif item.is_valid:
                 adding_list.append(item)
 
-        self._delete_embedding(all_files=deleting_list)
-        self._embedding(all_files=adding_list)
+        return SyncPlan(all_files, adding_list, deleting_list, rebuild=rebuild)
+
+    def has_new_version(self) -> bool:
+        """Whether the index changed since the last `refresh`. Only stats a file, cheap
+        enough for the request path."""
+        return self._change_mtime() != self._seen_mtime
 
-        with open(
-            f"{self.original_content_path}{self.embedding_record_file}", "w"
-        ) as file:
-            file.write(json.dumps([item.to_dict() for item in all_files], indent=4))
+    def refresh(self) -> bool:
+        """Switch to the current snapshot if a new one was published or rolled back to,
+        or, without snapshots, reopen the vector store if another process synced into it.
+        Returns True if the vector store was swapped. Searches already running keep
+        using the previous one."""
+        mtime = self._change_mtime()
+        if mtime == self._seen_mtime:
+            return False
+        self._seen_mtime = mtime
 
-    def _embedding(self, all_files: list[FileForEmbedding]) -> list[FileForEmbedding]:
+        if self.snapshots is not None:
+            version = self.snapshots.current_version()
+            if version is None or version == self.index_version:
+                return False
+            self.persist_directory = self.snapshots.version_path(version)
+            self.vectordb = self._open_vectordb()
+            self.index_version = version
+        else:
+            self.vectordb = self._open_vectordb()
+        self._index_changed()
+        return True
+
+    def rollback(self, version: Optional[str] = None) -> str:
+        """Serve a previously published version again, by default the one before the current one."""
+        if self.snapshots is None:
+            raise ValueError("Rollback requires snapshots.")
+        version = self.snapshots.rollback(version)
+        self.refresh()
+        return version
+
+    def verify(self) -> list[str]:
+        """Check that the embedding record and the vector store agree. Returns the problems found."""
+        problems: list[str] = []
+        # Files share the chunks that were skipped as duplicates.
+        ids = list(
+            dict.fromkeys(id for item in self._load_records().values() for id in item.IDs)
+        )
+        count = self.vectordb._collection.count()
+        if count != len(ids):
+            problems.append(
+                f"The collection holds {count} documents, the record lists {len(ids)}."
+            )
+        if ids:
+            found = set(self.vectordb._collection.get(ids=ids, include=[])["ids"])
+            missing = [id for id in ids if id not in found]
+            if missing:
+                problems.append(f"{len(missing)} recorded IDs are missing: {missing[:5]}")
+        if self.metadata_index is not None and self.metadata_index.ids != set(ids):
+            problems.append("The metadata index is out of date.")
+        return problems
+
+    def stats(self) -> dict[str, Any]:
+        """The served index version and the number of documents in the vector store."""
+        return {
+            "index_version": self.index_version,
+            "documents": self.vectordb._collection.count(),
+        }
+
+    def probe(self) -> dict[str, Any]:
+        """Run a nearest-neighbour query on the vector store, with a stored embedding
+        instead of calling the embedding API, so that its index is loaded. Returns the stats."""
+        stats = self.stats()
+        if stats["documents"]:
+            collection = self.vectordb._collection
+            sample = collection.get(limit=1, include=["embeddings"])["embeddings"]
+            collection.query(query_embeddings=sample, n_results=1, include=[])
+        return stats
+
+    def _sync(
+        self, rebuild: bool = False, progress: Optional[SyncProgress] = None
+    ) -> dict[str, Any]:
+        """Plan and apply a sync. Returns the counts of the plan and of the chunks,
+        the duplicate stats and the seconds spent in each stage."""
+        start = time.perf_counter()
+        plan = self.plan(rebuild)
+        planned = time.perf_counter()
+        report = self._apply(plan, progress)
+        report["seconds"] = {"plan": planned - start, **report["seconds"]}
+        return report
+
+    def _apply(self, plan: SyncPlan, progress: Optional[SyncProgress] = None) -> dict[str, Any]:
+        seconds: dict[str, float] = {}
+
+        def stage(name: str, start: float) -> float:
+            now = time.perf_counter()
+            seconds[name] = now - start
+            if progress:
+                progress({"stage": name, "seconds": seconds[name]})
+            return now
+
+        summary = plan.summary()
+        files = {key: len(summary[key]) for key in ("add", "update", "delete")}
+        files["unchanged"] = summary["unchanged"]
+        if progress:
+            progress({"stage": "plan", **files})
+
+        start = time.perf_counter()
+        if plan.rebuild:
+            self.vectordb.delete_collection()
+            self.vectordb = self._open_vectordb()
+        deleting = {item.file for item in plan.deleting}
+        self._delete_embedding(
+            all_files=plan.deleting,
+            keep={id for item in plan.all_files if item.file not in deleting for id in item.IDs},
+        )
+        start = stage("delete", start)
+
+        documents = self.vectordb._collection.count()
+        duplicates = None
+        if self.deduplicate:
+            # Indexing the collection is only worth it when there are chunks to check.
+            duplicates = (
+                DuplicateIndex.from_collection(self.vectordb, threshold=self.duplicate_threshold)
+                if plan.adding
+                else DuplicateIndex(threshold=self.duplicate_threshold)
+            )
+        pool = None
+        if self.embedding_workers > 1 and len(plan.adding) > 1:
+            pool = BoundedExecutor("embedding", self.embedding_workers)
         try:
-            for item in all_files:
-                splits = self.splitter.split_documents(
-                    ContentLoader(file_path=item.file).load()
-                )
-                IDs = self.vectordb.add_documents(documents=splits)
-                item.IDs = IDs
+            self._embedding(
+                all_files=plan.adding, duplicates=duplicates, progress=progress, pool=pool
+            )
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        if self.deduplicate:
+            self._update_sources(plan.all_files)
+        start = stage("embed", start)
+
+        with open(self._record_path(), "w") as file:
+            file.write(json.dumps([item.to_dict() for item in plan.all_files], indent=4))
+
+        if self.metadata_index is None:
+            self.metadata_index = MetadataIndex()
+        self.metadata_index.index_collection(self.vectordb)
+        self.metadata_index.save(self._metadata_index_path())
+        stage("index", start)
+
+        count = self.vectordb._collection.count()
+        return {
+            "files": files,
+            "chunks": count - documents,
+            "documents": count,
+            "duplicates": duplicates.stats() if duplicates is not None else None,
+            "split_cache": self.split_cache.stats() if self.split_cache is not None else None,
+            "embedding_pool": pool.metrics() if pool is not None else None,
+            "seconds": seconds,
+        }
+
+    def _index_changed(self) -> None:
+        if self.retrieval_cache is not None:
+            self.retrieval_cache.bump()
+
+    def _record_path(self) -> str:
+        if self.snapshots is not None:
+            # The record belongs to the snapshot it describes.
+            return os.path.join(self.persist_directory, self.embedding_record_file)
+        return f"{self.original_content_path}{self.embedding_record_file}"
+
+    def _load_records(self) -> dict[str, FileForEmbedding]:
+        embedding_dict: dict[str, FileForEmbedding] = {}
+        if os.path.exists(self._record_path()):
+            with open(self._record_path(), "r") as file:
+                data_list = json.load(file)
+                for item in data_list:
+                    obj = FileForEmbedding.from_dict(item)
+                    embedding_dict[obj.file] = obj
+        return embedding_dict
+
+    def _change_mtime(self) -> Optional[int]:
+        """The CURRENT pointer with snapshots, otherwise the metadata index, which a
+        sync writes last."""
+        if self.snapshots is not None:
+            return self.snapshots.pointer_mtime()
+        try:
+            return os.stat(self._metadata_index_path()).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _metadata_index_path(self) -> str:
+        return os.path.join(self.persist_directory, self.metadata_index_file)
+
+    def _open_vectordb(self) -> Chroma:
+        # The metadata index is persisted next to the vector store it describes.
+        self.metadata_index = MetadataIndex.load(self._metadata_index_path())
+        return Chroma(
+            collection_name=self.collection_name,
+            embedding_function=MeteredEmbeddings(self.embedding),
+            persist_directory=self.persist_directory,
+        )
+
+    def _embedding(
+        self,
+        all_files: list[FileForEmbedding],
+        duplicates: Optional[DuplicateIndex] = None,
+        progress: Optional[SyncProgress] = None,
+        pool: Optional[BoundedExecutor] = None,
+    ) -> list[FileForEmbedding]:
+        """Embed the files, on the threads of `pool` if given. The embedding requests of
+        the workers overlap; duplicate checks and writes to the vector store take turns."""
+        lock = threading.Lock()
+        done = {"files": 0, "files_total": len(all_files), "chunks": 0}
+
+        def embed(item: FileForEmbedding) -> None:
+            member = split_member_path(item.file)
+            with Archive(member[0]) if member else nullcontext() as archive:
+                embed_file(item, archive)
+
+        def embed_file(item: FileForEmbedding, archive: Optional[Archive]) -> None:
+            splits = self._splits(ContentLoader(file_path=item.file, archive=archive))
+            IDs: dict[str, None] = {}  # ordered, a file may share a chunk twice
+            while batch := list(islice(splits, self.embedding_batch_size)):
+                with lock:
+                    if duplicates is not None:
+                        batch, ids = self._skip_duplicates(batch, IDs, duplicates)
+                    else:
+                        ids = [str(uuid.uuid1()) for _ in batch]
+                        IDs.update(dict.fromkeys(ids))
+                if batch:
+                    self._add_documents(batch, ids, lock)
+                with lock:
+                    done["chunks"] += len(batch)
+                    if progress:
+                        progress({"stage": "embed", "file": item.file, **done})
+            item.IDs = list(IDs)
+            with lock:
+                done["files"] += 1
+                if progress:
+                    progress({"stage": "embed", "file": item.file, **done})
+
+        try:
+            if pool is not None:
+                futures = [pool.submit(embed, item) for item in all_files]
+                try:
+                    for future in futures:
+                        future.result()
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+            else:
+                for item in all_files:
+                    embed(item)
         finally:
             # Maintain backwards compatibility with chromadb < 0.4.0
             self.vectordb.persist()
 
         return all_files
 
+    def _splits(self, loader: ContentLoader) -> Iterator[Document]:
+        """The chunks of a file, from the split cache if it has them. Large files are
+        read and split incrementally, never held whole, and only cached if their
+        chunks fit in the cache."""
+        if self.split_cache is None:
+            yield from loader.lazy_load_and_split(self.splitter)
+            return
+
+        key = SplitCache.key(self.splitter, loader.digest())
+        cached = self.split_cache.get(key)
+        if cached is not None:
+            for text, metadata, _ in cached:
+                yield Document(page_content=text, metadata={**metadata, "source": loader.file_path})
+            return
+
+        chunks: Optional[list] = []
+        size = 0
+        offsets = loader.chunk_offsets()
+        next(offsets)
+        try:
+            for split in loader.lazy_load_and_split(self.splitter):
+                if chunks is not None:
+                    metadata = {
+                        name: value for name, value in split.metadata.items() if name != "source"
+                    }
+                    chunks.append((split.page_content, metadata, offsets.send(split.page_content)))
+                    size += len(split.page_content)
+                    if size > self.split_cache.max_bytes:
+                        chunks = None
+                yield split
+        finally:
+            offsets.close()
+        if chunks is not None:
+            self.split_cache.put(key, chunks)
+
+    def _add_documents(self, batch: list[Document], ids: list[str], lock: threading.Lock) -> None:
+        """Chroma.add_documents, with the embedding request outside of `lock`."""
+        for split in batch:
+            timestamp = to_timestamp(split.metadata.get("date"))
+            if timestamp is not None:
+                split.metadata[f"date{TIMESTAMP_SUFFIX}"] = timestamp
+        texts = [split.page_content for split in batch]
+        embeddings = self.vectordb._embedding_function.embed_documents(texts)
+        with lock:
+            # ContentLoader's metadata is never empty, it has the "source" at least.
+            self.vectordb._collection.upsert(
+                ids=ids,
+                embeddings=embeddings,
+                documents=texts,
+                metadatas=[split.metadata for split in batch],
+            )
+
+    def _skip_duplicates(
+        self, batch: list[Document], IDs: dict[str, None], duplicates: DuplicateIndex
+    ) -> tuple[list[Document], list[str]]:
+        """Drop the chunks of `batch` that duplicate an indexed chunk, and give the
+        others IDs. Appends the IDs of both, in chunk order, to the file's `IDs`."""
+        kept: list[Document] = []
+        ids: list[str] = []
+        for split in batch:
+            match, signature = duplicates.find(split.page_content)
+            if match is not None:
+                IDs[match] = None
+                continue
+            id = str(uuid.uuid1())
+            duplicates.add(id, split.page_content, signature)
+            kept.append(split)
+            ids.append(id)
+            IDs[id] = None
+        return kept, ids
+
+    def _update_sources(self, all_files: list[FileForEmbedding]) -> None:
+        """Set the "sources" metadata field of the chunks shared by several files, and
+        move the "source" of a shared chunk whose file was deleted to a remaining one."""
+        files_of: dict[str, list[str]] = {}
+        for item in all_files:
+            for id in item.IDs:
+                files_of.setdefault(id, []).append(item.file)
+
+        found = self.vectordb._collection.get(include=["metadatas"])
+        ids: list[str] = []
+        metadatas: list[dict] = []
+        for id, metadata in zip(found["ids"], found["metadatas"]):
+            files = sorted(set(files_of.get(id, [])))
+            update = {}
+            if len(files) > 1 or (files and "sources" in metadata):
+                sources = "\n".join(files)
+                if metadata.get("sources") != sources:
+                    update["sources"] = sources
+            if files and metadata.get("source") not in files:
+                update["source"] = files[0]
+            if update:
+                ids.append(id)
+                metadatas.append({**metadata, **update})
+        if ids:
+            self.vectordb._collection.update(ids=ids, metadatas=metadatas)
+
     def _delete_embedding(
-        self, all_files: list[FileForEmbedding]
+        self, all_files: list[FileForEmbedding], keep: Optional[set[str]] = None
     ) -> list[FileForEmbedding]:
+        """Delete the chunks of the files, except those in `keep`, which other files share."""
+        keep = keep or set()
         try:
             ids: list[str] = []
             for item in all_files:
-                ids.extend(item.IDs)
+                ids.extend(id for id in item.IDs if id not in keep)
                 item.IDs.clear()
+            ids = list(dict.fromkeys(ids))
 
-            self.vectordb.delete(ids=ids)
+            # Chroma deletes the whole collection when given no IDs.
+            if ids:
+                self.vectordb.delete(ids=ids)
         finally:
             # Maintain backwards compatibility with chromadb < 0.4.0
             self.vectordb.persist()
@@ -218,28 +811,56 @@ class ContentManager(BaseModel):
         return all_files
 
     def _traverse_original_content(self, path) -> list[FileForEmbedding]:
+        """The markdown docs under `path`, including those in zip and tar archives,
+        which are read in place, see Archive."""
         all_files: list[FileForEmbedding] = []
         for dirpath, dirnames, filenames in os.walk(path):
             for filename in fnmatch.filter(filenames, "*.md"):
                 file_path = os.path.join(dirpath, filename)
-                metadata = ContentLoader(file_path=file_path).load()[0].metadata
-
-                update_time = datetime.fromisoformat(
-                    metadata["date"].rstrip("Z")
-                ).replace(tzinfo=timezone.utc)
-                is_valid = True if metadata.get("isValid") == 1 else False
-
-                all_files.append(
-                    FileForEmbedding(
-                        file=file_path,
-                        update_time=update_time,
-                        IDs=[],
-                        is_valid=is_valid,
-                    )
-                )
+                all_files.append(self._file_for_embedding(ContentLoader(file_path=file_path)))
+            for filename in filenames:
+                if not is_archive(filename):
+                    continue
+                with Archive(os.path.join(dirpath, filename)) as archive:
+                    for file_path, checksum in archive.members():
+                        loader = ContentLoader(file_path=file_path, archive=archive)
+                        all_files.append(self._file_for_embedding(loader, checksum))
 
         return all_files
 
+    def _file_for_embedding(
+        self, loader: ContentLoader, checksum: Optional[str] = None
+    ) -> FileForEmbedding:
+        metadata = None
+        if self.split_cache is not None:
+            if checksum is None:
+                stat = os.stat(loader.file_path)
+                version = f"{stat.st_mtime_ns}:{stat.st_size}"
+            else:
+                version = checksum
+            metadata = self.split_cache.front_matter(loader.file_path, version)
+        if metadata is None:
+            metadata = loader.load_metadata()
+            if self.split_cache is not None:
+                self.split_cache.put_front_matter(
+                    loader.file_path,
+                    version,
+                    {"date": metadata["date"], "isValid": metadata.get("isValid")},
+                )
+
+        update_time = datetime.fromisoformat(
+            metadata["date"].rstrip("Z")
+        ).replace(tzinfo=timezone.utc)
+        is_valid = True if metadata.get("isValid") == 1 else False
+
+        return FileForEmbedding(
+            file=loader.file_path,
+            update_time=update_time,
+            IDs=[],
+            is_valid=is_valid,
+            checksum=checksum,
+        )
+
     def as_self_query_retriever(
         self,
         llm: BaseLanguageModel,
@@ -311,4 +932,139 @@ class ContentManager(BaseModel):
             verbose=verbose,
             search_type=search_type,
             search_kwargs=search_kwargs,
+            metadata_index=self.metadata_index,
+            retrieval_cache=self.retrieval_cache,
+            index_version=self.index_version,
         )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """python -m content_manager: run and inspect syncs from the command line."""
+    parser = argparse.ArgumentParser(
+        prog="python -m content_manager",
+        description="Sync the original content into the vector store.",
+    )
+    parser.add_argument(
+        "command",
+        choices=["sync", "dry-run", "rebuild", "verify", "stats"],
+        help="dry-run prints the files a sync would add, update and delete; rebuild "
+        "embeds every valid file into an empty collection.",
+    )
+    parser.add_argument("--original-content-path", default=None)
+    parser.add_argument("--persist-directory", default=None)
+    parser.add_argument(
+        "--snapshot-dir", default=None, help="Sync into versioned snapshots, see IndexSnapshots."
+    )
+    parser.add_argument("--collection-name", default=None)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=100)
+    parser.add_argument("--markdown-headings", action="store_true")
+    parser.add_argument("--deduplicate", action="store_true")
+    parser.add_argument(
+        "--split-cache",
+        default=None,
+        metavar="PATH",
+        help="SQLite file caching split files across syncs, e.g. ./vectorstore/split_cache.db.",
+    )
+    parser.add_argument("--workers", type=int, default=1, help="Files embedded at the same time.")
+    parser.add_argument(
+        "--batch-size", type=int, default=1000, help="Chunks per embedding and write batch."
+    )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="Print the result as JSON, and the progress as JSON lines on stderr.",
+    )
+    parser.add_argument("--quiet", action="store_true", help="No progress output.")
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv, find_dotenv
+
+    _ = load_dotenv(find_dotenv())
+
+    # Only sync and rebuild may write; the other commands must not even bootstrap
+    # the first snapshot version.
+    read_only = args.command in ("dry-run", "verify", "stats")
+    try:
+        manager = ContentManager(
+            original_content_path=args.original_content_path,
+            persist_directory=args.persist_directory,
+            collection_name=args.collection_name,
+            chunk_size=args.chunk_size,
+            chunk_overlap=args.chunk_overlap,
+            snapshots=IndexSnapshots(root=args.snapshot_dir) if args.snapshot_dir else None,
+            read_only=read_only,
+            markdown_headings=args.markdown_headings,
+            deduplicate=args.deduplicate,
+            split_cache=SplitCache(args.split_cache) if args.split_cache else None,
+            embedding_workers=args.workers,
+            embedding_batch_size=args.batch_size,
+        )
+    except ValueError as e:
+        if not (read_only and args.snapshot_dir):
+            raise
+        parser.error(f"{e}, run sync first.")
+
+    def output(result: Any, text: str) -> None:
+        print(json.dumps(result, indent=4) if args.json else text)
+
+    def progress(event: dict[str, Any]) -> None:
+        if args.json:
+            print(json.dumps(event), file=sys.stderr, flush=True)
+        elif event["stage"] == "plan":
+            print(
+                f"{event['add']} files to add, {event['update']} to update, "
+                f"{event['delete']} to delete",
+                file=sys.stderr,
+            )
+        elif "seconds" in event:
+            print(f"{event['stage']}: {event['seconds']:.2f}s", file=sys.stderr)
+        else:
+            print(
+                f"\rembedded {event['files']}/{event['files_total']} files, "
+                f"{event['chunks']} chunks",
+                end="\n" if event["files"] == event["files_total"] else "",
+                file=sys.stderr,
+                flush=True,
+            )
+
+    if args.command in ("sync", "rebuild"):
+        start = time.perf_counter()
+        manager.trigger_embedding(
+            rebuild=args.command == "rebuild", progress=None if args.quiet else progress
+        )
+        report = manager.last_sync
+        report["seconds"]["total"] = time.perf_counter() - start
+        output(
+            report,
+            f"Embedded {report['chunks']} chunks of {report['files']['add']} added and "
+            f"{report['files']['update']} updated files, deleted "
+            f"{report['files']['delete']} files, in {report['seconds']['total']:.1f}s. "
+            f"The vector store holds {report['documents']} documents.",
+        )
+    elif args.command == "dry-run":
+        summary = manager.plan().summary()
+        lines = [
+            f"{operation} {file}"
+            for operation in ("add", "update", "delete")
+            for file in summary[operation]
+        ]
+        lines.append(f"{summary['unchanged']} files unchanged")
+        output(summary, "\n".join(lines))
+    elif args.command == "verify":
+        problems = manager.verify()
+        output({"problems": problems}, "\n".join(problems) or "OK")
+        return 1 if problems else 0
+    else:
+        records = manager._load_records().values()
+        stats = {
+            **manager.stats(),
+            "files": len(records),
+            "valid_files": sum(item.is_valid for item in records),
+        }
+        output(stats, "\n".join(f"{key}: {value}" for key, value in stats.items()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,19 @@
 import asyncio
-import re
-
-from typing import Mapping, Protocol, Dict, Any, Optional
-from pydantic import BaseModel, validate_arguments, Field, validator
-from functools import partial
+import copy
+import json
+import logging
+import os
+import threading
+import time
+
+from concurrent.futures import Future
+from typing import Mapping, Protocol, Dict, Any, List, Optional, Awaitable, Callable, Tuple
+from pydantic import BaseModel, validate_arguments, validator, Field
 from langchain.memory.chat_memory import BaseChatMemory
-from langchain.memory import ConversationBufferWindowMemory
+from langchain.memory import ConversationBufferWindowMemory, ChatMessageHistory
 from langchain.schema.language_model import BaseLanguageModel
 from langchain.chat_models import ChatOpenAI
+from langchain.chains.base import Chain
 from langchain.chains import (
     ConversationalRetrievalChain,
     SequentialChain,
@@ -26,14 +32,54 @@ from langchain.chains.question_answering import (
     stuff_prompt,
     map_rerank_prompt,
 )
-from langchain.callbacks.manager import AsyncCallbackManagerForChainRun
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForChainRun,
+    CallbackManagerForChainRun,
+)
 from content_manager import ContentManager
-from chat_history import SqliteChatMessageHistory
-from errors import PolicyViolationError
+from index_snapshots import IndexSnapshots
+from chat_history import SqliteChatMessageHistory, AsyncSqliteChatMessageHistory
+from embedding_batcher import EmbeddingBatcher
+from executors import Executors
+from errors import BaseError, PolicyViolationError, INTERNAL_ERROR_CODE
+from http_pool import HttpClientPool
+from moderation_cache import ModerationCache
+from moderation_tiers import ModerationTiers
+from question import Question
+from retrieval_cache import RetrievalCache
+from session_lock import KeyedLock
+from sqlite_worker import DURABILITY_LEVELS
+from usage import MeteredEmbeddings
+
+logger = logging.getLogger(__name__)
+
+POLICY_VIOLATION_MESSAGE = "Text was found that violates our content policy."
 
 
 class MemoryHandler(BaseModel):
     db_file: str = "./memorystore/chat_message_history.db"
+    # Write-behind settings of the async history, see SqliteWorker.
+    flush_interval: float = 0.005
+    durability: str = "full"
+
+    @validator("durability")
+    def _known_durability(cls, durability: str) -> str:
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(
+                f"durability must be one of {list(DURABILITY_LEVELS)}, got {durability}"
+            )
+        return durability
+
+    @classmethod
+    def from_env(cls) -> "MemoryHandler":
+        values = {}
+        for field, env_name in (
+            ("flush_interval", "CHAT_HISTORY_FLUSH_INTERVAL"),
+            ("durability", "CHAT_HISTORY_DURABILITY"),
+        ):
+            if env_name in os.environ:
+                values[field] = os.environ[env_name]
+        return cls(**values)
 
     @validate_arguments
     def from_session(
@@ -59,17 +105,31 @@ class MemoryHandler(BaseModel):
             return_messages=return_messages,
         )
 
+    @validate_arguments
+    async def afrom_session(
+        self,
+        session_id: str,
+        k: int = 5,  # Number of messages to store in buffer.
+        return_messages: bool = False,
+        input_key: Optional[str] = None,
+    ) -> BaseChatMemory:
+        """Like from_session, but the history is preloaded off the event loop and
+        its writes are handed to a background thread."""
+        chat_history = AsyncSqliteChatMessageHistory(
+            session_id=session_id,
+            db_file=self.db_file,
+            flush_interval=self.flush_interval,
+            durability=self.durability,
+        )
+        await chat_history.aload()
 
-class Question(BaseModel):
-    session_id: str
-    message: str
-
-    @validator("session_id")
-    def validate_session_id(cls, v):
-        pattern = r"^[a-fA-F0-9]{64}$"
-        if not re.match(pattern, v):
-            raise ValueError(f"{v} does not match the required session-id format")
-        return v
+        return ConversationBufferWindowMemory(
+            chat_memory=chat_history,
+            memory_key="chat_history",
+            k=k,
+            input_key=input_key,
+            return_messages=return_messages,
+        )
 
 
 class PromptCallable(Protocol):
@@ -78,24 +138,296 @@ class PromptCallable(Protocol):
 
 
 class KydenModerationChain(OpenAIModerationChain):
+    moderation_tiers: Optional[ModerationTiers] = None
+    """Local patterns that decide obvious messages before the cache and the API."""
+    moderation_cache: Optional[ModerationCache] = None
+    """Verdicts of recently moderated messages; a hit skips the moderation request."""
+
     def _moderate(self, text: str, results: dict) -> str:
         if results["flagged"]:
-            error_str = "Text was found that violates our content policy."
+            error_str = POLICY_VIOLATION_MESSAGE
             if self.error:
                 raise PolicyViolationError(error_str)
             else:
                 return error_str
         return text
 
+    def _call(
+        self,
+        inputs: Dict[str, Any],
+        run_manager: Optional[CallbackManagerForChainRun] = None,
+    ) -> Dict[str, Any]:
+        text = inputs[self.input_key]
+        flagged, tier = self._fast_verdict(text)
+        if flagged is None:
+            start = time.perf_counter()
+            results = self.client.create(text)
+            flagged = self._store_verdict(text, results["results"][0], start)
+        elif run_manager is not None:
+            # No request was made, see UsageRecorder.
+            run_manager.on_text("", moderation_tier=tier)
+        return {self.output_key: self._moderate(text, {"flagged": flagged})}
+
     async def _acall(
         self,
         inputs: Dict[str, Any],
         run_manager: Optional[AsyncCallbackManagerForChainRun] = None,
     ) -> Dict[str, Any]:
-        # This is a temporary workaround to make the _acall function
-        # asynchronous.
-        func = partial(self._call, inputs)
-        return await asyncio.get_event_loop().run_in_executor(None, func)
+        text = inputs[self.input_key]
+        flagged, tier = self._fast_verdict(text)
+        if flagged is None:
+            start = time.perf_counter()
+            if hasattr(self.client, "acreate"):
+                # Native async call, so the request goes through the session bound by
+                # HttpClientPool instead of a blocking request on an executor thread.
+                results = await self.client.acreate(text)
+            else:
+                # Its own pool, so that moderation does not queue behind vector searches.
+                results = await Executors.shared().blocking_io.run(self.client.create, text)
+            flagged = self._store_verdict(text, results["results"][0], start)
+        elif run_manager is not None:
+            await run_manager.on_text("", moderation_tier=tier)
+        return {self.output_key: self._moderate(text, {"flagged": flagged})}
+
+    async def aflagged(self, texts: List[str], chunk_size: int = 32) -> List[bool]:
+        """Moderate many texts with one request per `chunk_size` of the texts
+        the local tier and the cache cannot decide."""
+        flagged = [self._fast_verdict(text)[0] for text in texts]
+        missing = [text for text, verdict in zip(texts, flagged) if verdict is None]
+        chunks = [missing[i : i + chunk_size] for i in range(0, len(missing), chunk_size)]
+        start = time.perf_counter()
+        responses = await asyncio.gather(*(self.client.acreate(chunk) for chunk in chunks))
+        results = iter(
+            result for response in responses for result in response["results"]
+        )
+        return [
+            verdict if verdict is not None else self._store_verdict(text, next(results), start)
+            for text, verdict in zip(texts, flagged)
+        ]
+
+    def _fast_verdict(self, text: str) -> Tuple[Optional[bool], str]:
+        """The verdict of the local tier or the cache, None if only the API can tell,
+        and the tier that decided."""
+        start = time.perf_counter()
+        if self.moderation_tiers is not None:
+            flagged = self.moderation_tiers.classify(text)
+            if flagged is not None:
+                self.moderation_tiers.record("local", flagged, time.perf_counter() - start)
+                return flagged, "local"
+        if self.moderation_cache is None:
+            return None, "remote"
+        flagged = self.moderation_cache.get(text)
+        if flagged is None:
+            return None, "remote"
+        if self.moderation_tiers is not None:
+            self.moderation_tiers.record("cache", flagged, time.perf_counter() - start)
+        return flagged, "cache"
+
+    def _store_verdict(self, text: str, result: dict, start: float) -> bool:
+        flagged = bool(result["flagged"])
+        if self.moderation_tiers is not None:
+            self.moderation_tiers.record("remote", flagged, time.perf_counter() - start)
+        if self.moderation_cache is not None:
+            self.moderation_cache.put(text, flagged)
+        return flagged
+
+
+class ChainFactory:
+    """Builds the chain graph once per configuration and reuses it across requests.
+
+    Only the memory is per-session: `chat_chain` and `moderated_chain` return a
+    shallow copy of the cached graph bound to the given memory, which skips the
+    LLM, retriever, prompt and validation work of building it again.
+    """
+
+    # Replaced, never cleared, when the index is swapped: a chain built from the
+    # previous index lands in the dict it read and is dropped with it.
+    _chat_chains: Dict[tuple, ConversationalRetrievalChain] = {}
+    _moderated_chains: Dict[tuple, SequentialChain] = {}
+    _content_manager: Optional[ContentManager] = None
+    _moderation_cache: Optional[ModerationCache] = None
+    _moderation_tiers: Optional[ModerationTiers] = None
+    _refresh_lock = threading.Lock()  # Held while a new index is opened and swapped in.
+    _schedule_lock = threading.Lock()
+    _refresh_future: Optional["Future[bool]"] = None
+
+    @classmethod
+    def chat_chain(
+        cls,
+        memory: BaseChatMemory,
+        search_type: str = "similarity",
+        search_kwargs: Optional[dict] = None,
+        chain_type: str = "stuff",
+        verbose: bool = False,
+    ) -> ConversationalRetrievalChain:
+        cls._refresh_in_background()
+        chains = cls._chat_chains
+        key = cls._key(search_type, search_kwargs, chain_type, verbose)
+        chain = chains.get(key)
+        if chain is None:
+            chain = chains[key] = cls._build_chat_chain(
+                search_type, search_kwargs or {}, chain_type, verbose
+            )
+        return cls._rebind(chain, memory=memory)
+
+    @classmethod
+    def moderated_chain(
+        cls,
+        memory: BaseChatMemory,
+        search_type: str = "similarity",
+        search_kwargs: Optional[dict] = None,
+        chain_type: str = "stuff",
+        verbose: bool = False,
+    ) -> SequentialChain:
+        cls._refresh_in_background()
+        chains = cls._moderated_chains
+        key = cls._key(search_type, search_kwargs, chain_type, verbose)
+        template = chains.get(key)
+        if template is None:
+            moderation_chain = KydenModerationChain(
+                error=True,
+                output_key=Conversation.prompt_input_key,
+                moderation_tiers=cls.moderation_tiers(),
+                moderation_cache=cls.moderation_cache(),
+            )
+            template = chains[key] = SequentialChain(
+                chains=[
+                    moderation_chain,
+                    cls.chat_chain(
+                        memory=cls._template_memory(),
+                        search_type=search_type,
+                        search_kwargs=search_kwargs,
+                        chain_type=chain_type,
+                        verbose=verbose,
+                    ),
+                ],
+                input_variables=["input"],
+            )
+
+        moderation_chain, chat_chain = template.chains
+        return cls._rebind(
+            template, chains=[moderation_chain, cls._rebind(chat_chain, memory=memory)]
+        )
+
+    @classmethod
+    def content_manager(cls) -> ContentManager:
+        if cls._content_manager is None:
+            snapshot_dir = os.environ.get("INDEX_SNAPSHOT_DIR")
+            cache_size = int(os.environ.get("CHATBOT_RETRIEVAL_CACHE_SIZE", "1024"))
+            cls._content_manager = ContentManager(
+                snapshots=IndexSnapshots(root=snapshot_dir) if snapshot_dir else None,
+                read_only=os.environ.get("INDEX_READ_ONLY") == "1",
+                retrieval_cache=RetrievalCache(max_entries=cache_size) if cache_size > 0 else None,
+            )
+        return cls._content_manager
+
+    @classmethod
+    def moderation_cache(cls) -> Optional[ModerationCache]:
+        if cls._moderation_cache is None:
+            cache_size = int(os.environ.get("CHATBOT_MODERATION_CACHE_SIZE", "10000"))
+            if cache_size <= 0:
+                return None
+            cls._moderation_cache = ModerationCache(
+                max_entries=cache_size,
+                ttl=float(os.environ.get("CHATBOT_MODERATION_CACHE_TTL", "3600")),
+            )
+        return cls._moderation_cache
+
+    @classmethod
+    def moderation_tiers(cls) -> ModerationTiers:
+        if cls._moderation_tiers is None:
+            cls._moderation_tiers = ModerationTiers()
+        return cls._moderation_tiers
+
+    @classmethod
+    def clear(cls) -> None:
+        with cls._refresh_lock:
+            cls._chat_chains = {}
+            cls._moderated_chains = {}
+            cls._content_manager = None
+            cls._moderation_cache = None
+            cls._moderation_tiers = None
+        with cls._schedule_lock:
+            cls._refresh_future = None
+
+    @classmethod
+    def refresh_index(cls) -> bool:
+        """Pick up a newly published index version. Opens the new vector store, so
+        it runs off the event loop: on the index watcher or the cpu pool. Requests
+        already running finish on the chains, and index, they started with."""
+        with cls._refresh_lock:
+            if not cls.content_manager().refresh():
+                return False
+            cls._chat_chains = {}
+            cls._moderated_chains = {}
+            return True
+
+    @classmethod
+    def _refresh_in_background(cls) -> None:
+        """Starts `refresh_index` on the cpu pool when a new version was published,
+        without waiting for it: requests keep the current chains until it is swapped."""
+        if not cls.content_manager().has_new_version():
+            return
+        with cls._schedule_lock:
+            if cls._refresh_future is not None and not cls._refresh_future.done():
+                return
+            future = cls._refresh_future = Executors.shared().cpu.submit(cls.refresh_index)
+        future.add_done_callback(cls._log_refresh_error)
+
+    @staticmethod
+    def _log_refresh_error(future: "Future[bool]") -> None:
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("Failed to refresh the index", exc_info=future.exception())
+
+    @classmethod
+    def _build_chat_chain(
+        cls, search_type: str, search_kwargs: dict, chain_type: str, verbose: bool
+    ) -> ConversationalRetrievalChain:
+        llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0, verbose=verbose)
+        retriever = cls.content_manager().as_self_query_retriever(
+            llm=llm,
+            search_type=search_type,
+            search_kwargs=search_kwargs,
+            verbose=verbose,
+        )
+        # Built with a stand-in memory so that the graph is validated the same
+        # way as with a session's memory.
+        return ConversationalRetrievalChain.from_llm(
+            llm,
+            retriever=retriever,
+            memory=cls._template_memory(),
+            chain_type=chain_type,
+            combine_docs_chain_kwargs=Conversation._prompts(chain_type=chain_type),
+            verbose=verbose,
+        )
+
+    @staticmethod
+    def _rebind(chain: Chain, **values: Any) -> Chain:
+        # Unlike copy(), construct() neither validates nor copies the nested
+        # models, so the copy shares the whole graph except for `values`.
+        return type(chain).construct(
+            _fields_set=chain.__fields_set__, **{**chain.__dict__, **values}
+        )
+
+    @staticmethod
+    def _template_memory() -> BaseChatMemory:
+        return ConversationBufferWindowMemory(
+            chat_memory=ChatMessageHistory(),
+            memory_key="chat_history",
+            input_key=Conversation.prompt_input_key,
+            return_messages=True,
+        )
+
+    @staticmethod
+    def _key(
+        search_type: str, search_kwargs: Optional[dict], chain_type: str, verbose: bool
+    ) -> tuple:
+        return (
+            search_type,
+            json.dumps(search_kwargs or {}, sort_keys=True),
+            chain_type,
+            verbose,
+        )
 
 
 class Conversation:
@@ -110,34 +442,26 @@ class Conversation:
         retriever_search_kwargs: dict = Field(default_factory=dict),
         combine_docs_chain_type: str = "stuff",
         verbose: bool = False,
+        callbacks: Optional[list] = None,
     ) -> dict[str, any]:
-        llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0, verbose=verbose)
-        memory = MemoryHandler().from_session(
+        """`callbacks` receive the events of every step of the chain, see UsageRecorder."""
+        HttpClientPool.shared().bind()
+        memory = await MemoryHandler.from_env().afrom_session(
             session_id=question.session_id,
             return_messages=True,
-            llm=llm,
             input_key=cls.prompt_input_key,
-            verbose=verbose,
         )
-        # retriever = ContentManager().vectordb.as_retriever(
-        #     search_type=retriever_search_type, verbose=verbose
-        # )
-        retriever = ContentManager().as_self_query_retriever(
-            llm=llm,
+        chat_chain = ChainFactory.chat_chain(
+            memory=memory,
             search_type=retriever_search_type,
             search_kwargs=retriever_search_kwargs,
-            verbose=verbose,
-        )
-        chat_chain = ConversationalRetrievalChain.from_llm(
-            llm,
-            retriever=retriever,
-            memory=memory,
             chain_type=combine_docs_chain_type,
-            combine_docs_chain_kwargs=cls._prompts(chain_type=combine_docs_chain_type),
             verbose=verbose,
         )
 
-        return await chat_chain.acall({cls.prompt_input_key: question.message})
+        return await chat_chain.acall(
+            {cls.prompt_input_key: question.message}, callbacks=callbacks
+        )
 
     @classmethod
     @validate_arguments
@@ -148,39 +472,146 @@ class Conversation:
         retriever_search_kwargs: dict = Field(default_factory=dict),
         combine_docs_chain_type: str = "stuff",
         verbose: bool = False,
+        callbacks: Optional[list] = None,
     ) -> dict[str, any]:
-        llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0, verbose=verbose)
-        memory = MemoryHandler().from_session(
+        """`callbacks` receive the events of every step of the chain, see UsageRecorder."""
+        HttpClientPool.shared().bind()
+        memory = await MemoryHandler.from_env().afrom_session(
             session_id=question.session_id,
             return_messages=True,
-            llm=llm,
             input_key=cls.prompt_input_key,
-            verbose=verbose,
         )
-
-        retriever = ContentManager().as_self_query_retriever(
-            llm=llm,
+        chain = ChainFactory.moderated_chain(
+            memory=memory,
             search_type=retriever_search_type,
             search_kwargs=retriever_search_kwargs,
-            verbose=verbose,
-        )
-        chat_chain = ConversationalRetrievalChain.from_llm(
-            llm,
-            retriever=retriever,
-            memory=memory,
             chain_type=combine_docs_chain_type,
-            combine_docs_chain_kwargs=cls._prompts(chain_type=combine_docs_chain_type),
             verbose=verbose,
         )
 
-        moderation_chain = KydenModerationChain(
-            error=True, output_key=cls.prompt_input_key
+        return await chain.acall(question.message, callbacks=callbacks)
+
+    @classmethod
+    @validate_arguments
+    async def chat_batch(
+        cls,
+        questions: List[Question],
+        concurrency: int = 8,
+        retriever_search_type: str = "similarity",
+        retriever_search_kwargs: dict = Field(default_factory=dict),
+        combine_docs_chain_type: str = "stuff",
+        verbose: bool = False,
+        callbacks: Optional[List[Optional[list]]] = None,
+        run_question: Optional[
+            Callable[[Question, Callable[[], Awaitable[Any]]], Awaitable[Any]]
+        ] = None,
+    ) -> List[Dict[str, Any]]:
+        """Answer many questions as chat_with_moderation answers one.
+
+        The messages are moderated in bulk, one by one if that fails, and the chain
+        graph is set up once. At most `concurrency` questions are answered at a
+        time. The messages are embedded up front in one call, and the other
+        queries of their retrievers together, by an EmbeddingBatcher.
+        Questions of the same session are answered in order.
+
+        Returns one {"code", "message"} item per question, in order: the chain
+        output, or the error the question failed with. `callbacks[i]` receive
+        the events of the chain of the i-th question. `run_question(question, call)`,
+        if given, runs the chain of each question, e.g. in its session's turn and
+        with an admission slot, as /chatbot runs a message.
+        """
+        HttpClientPool.shared().bind()
+        moderation = KydenModerationChain(
+            error=True,
+            moderation_tiers=ChainFactory.moderation_tiers(),
+            moderation_cache=ChainFactory.moderation_cache(),
         )
-        chain = SequentialChain(
-            chains=[moderation_chain, chat_chain], input_variables=["input"]
+        flagged: Optional[List[bool]] = None
+        try:
+            flagged = await moderation.aflagged([question.message for question in questions])
+        except Exception:
+            # Each question is moderated on its own instead, and fails on its own.
+            logger.warning("Bulk moderation of the batch failed", exc_info=True)
+
+        template = ChainFactory.chat_chain(
+            memory=ChainFactory._template_memory(),
+            search_type=retriever_search_type,
+            search_kwargs=retriever_search_kwargs,
+            chain_type=combine_docs_chain_type,
+            verbose=verbose,
+        )
+        # The batch searches a copy of the vector store that embeds its queries together.
+        vectorstore = copy.copy(template.retriever.vectorstore)
+        embeddings = vectorstore._embedding_function
+        if isinstance(embeddings, MeteredEmbeddings):
+            # Metered outside of the batcher, so that each query counts for its question.
+            batcher = EmbeddingBatcher(embeddings.embeddings)
+            vectorstore._embedding_function = MeteredEmbeddings(batcher, model=embeddings.model)
+        else:
+            batcher = vectorstore._embedding_function = EmbeddingBatcher(embeddings)
+        retriever = ChainFactory._rebind(template.retriever, vectorstore=vectorstore)
+        try:
+            # A question is often searched as it was asked: embed them all in one call.
+            await Executors.shared().search.run(
+                batcher.prime,
+                [
+                    question.message
+                    for index, question in enumerate(questions)
+                    if flagged is None or not flagged[index]
+                ],
+            )
+        except Exception:
+            # The queries are then embedded as they come, together when they come together.
+            logger.warning("Embedding the questions of the batch failed", exc_info=True)
+
+        slots = asyncio.Semaphore(concurrency)
+        sessions = KeyedLock()
+
+        async def answer(index: int, question: Question) -> dict[str, any]:
+            if flagged is not None and flagged[index]:
+                raise PolicyViolationError(POLICY_VIOLATION_MESSAGE)
+
+            async def call() -> dict[str, any]:
+                memory = await MemoryHandler.from_env().afrom_session(
+                    session_id=question.session_id,
+                    return_messages=True,
+                    input_key=cls.prompt_input_key,
+                )
+                chain = ChainFactory._rebind(template, memory=memory, retriever=retriever)
+                return await chain.acall(
+                    {cls.prompt_input_key: question.message},
+                    callbacks=callbacks[index] if callbacks else None,
+                )
+
+            # The batch's own lock keeps at most one question per session waiting
+            # in `run_question`.
+            async with sessions.hold(question.session_id):
+                async with slots:
+                    if flagged is None and (await moderation.aflagged([question.message]))[0]:
+                        raise PolicyViolationError(POLICY_VIOLATION_MESSAGE)
+                    if run_question is None:
+                        return await call()
+                    return await run_question(question, call)
+
+        results = await asyncio.gather(
+            *(answer(index, question) for index, question in enumerate(questions)),
+            return_exceptions=True,
         )
 
-        return await chain.acall(question.message)
+        items: List[Dict[str, Any]] = []
+        for index, result in enumerate(results):
+            if isinstance(result, BaseError):
+                items.append({"code": result.code, "message": result.message})
+            elif isinstance(result, Exception):
+                logger.warning("Question %d of the batch failed", index, exc_info=result)
+                items.append(
+                    {"code": INTERNAL_ERROR_CODE, "message": f"{type(result).__name__}: {result}"}
+                )
+            elif isinstance(result, BaseException):
+                raise result
+            else:
+                items.append({"code": 0, "message": result})
+        return items
 
     @classmethod
     def _prompts(cls, chain_type: str = "stuff") -> dict[str, ChatPromptTemplate]:
@@ -0,0 +1,124 @@
+import re
+import zlib
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from langchain.vectorstores import Chroma
+
+# Signature value of a text without words; every hash value is below it.
+EMPTY = 1 << 32
+
+
+class MinHasher:
+    """MinHash signatures of the word shingles of a text.
+
+    Permutation `i` maps a 32-bit shingle hash `x` to the high 32 bits of
+    `(a[i] * x + b[i]) mod 2**64` with an odd `a[i]`, which numpy computes with
+    wrapping multiplication instead of a modulo.
+    """
+
+    def __init__(self, num_perm: int = 128, shingle_size: int = 5, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(0, 1 << 63, size=num_perm, dtype=np.uint64) * 2 + 1
+        self.b = rng.randint(0, 1 << 63, size=num_perm, dtype=np.uint64)
+
+    def shingles(self, text: str) -> Set[str]:
+        words = re.findall(r"\w+", text.lower())
+        if len(words) <= self.shingle_size:
+            return {" ".join(words)} if words else set()
+        return {
+            " ".join(words[i : i + self.shingle_size])
+            for i in range(len(words) - self.shingle_size + 1)
+        }
+
+    def signature(self, text: str) -> np.ndarray:
+        shingles = self.shingles(text)
+        if not shingles:
+            return np.full(self.num_perm, EMPTY, dtype=np.uint64)
+        hashes = np.fromiter(
+            map(zlib.crc32, map(str.encode, shingles)), dtype=np.uint64, count=len(shingles)
+        )
+        return ((np.outer(hashes, self.a) + self.b) >> np.uint64(32)).min(axis=0)
+
+    @staticmethod
+    def similarity(first: np.ndarray, second: np.ndarray) -> float:
+        """Estimated Jaccard similarity of the shingles behind two signatures."""
+        return float(np.mean(first == second))
+
+
+class DuplicateIndex:
+    """Finds the near-duplicates of a chunk among the chunks indexed so far.
+
+    Signatures are split into `bands`; chunks that agree on all rows of a band
+    are candidates, and a candidate whose estimated similarity reaches
+    `threshold` is a duplicate. With 32 bands of 4 rows, pairs at a similarity
+    of 0.85 are found with a probability above 99.9%.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.85,
+        bands: int = 32,
+        hasher: Optional[MinHasher] = None,
+    ):
+        self.threshold = threshold
+        self.hasher = hasher or MinHasher()
+        if self.hasher.num_perm % bands:
+            raise ValueError(
+                f"{bands} bands do not divide {self.hasher.num_perm} permutations."
+            )
+        self.bands = bands
+        self.rows = self.hasher.num_perm // bands
+        self.signatures: Dict[str, np.ndarray] = {}
+        self.buckets: Dict[Tuple[int, bytes], List[str]] = {}
+        self.checked = 0
+        self.duplicates = 0
+
+    @classmethod
+    def from_collection(cls, vectordb: Chroma, **kwargs) -> "DuplicateIndex":
+        index = cls(**kwargs)
+        found = vectordb._collection.get(include=["documents"])
+        for id, document in zip(found["ids"], found["documents"]):
+            index.add(id, document)
+        return index
+
+    def __len__(self) -> int:
+        return len(self.signatures)
+
+    def add(self, id: str, text: str, signature: Optional[np.ndarray] = None) -> None:
+        signature = self.hasher.signature(text) if signature is None else signature
+        self.signatures[id] = signature
+        for key in self._band_keys(signature):
+            self.buckets.setdefault(key, []).append(id)
+
+    def find(self, text: str) -> Tuple[Optional[str], np.ndarray]:
+        """The ID of the most similar indexed chunk at or above the threshold, if any,
+        and the signature of `text`, to pass on to `add`."""
+        signature = self.hasher.signature(text)
+        self.checked += 1
+        candidates = {
+            id for key in self._band_keys(signature) for id in self.buckets.get(key, ())
+        }
+        best, best_similarity = None, self.threshold
+        for id in candidates:
+            similarity = MinHasher.similarity(signature, self.signatures[id])
+            if similarity >= best_similarity:
+                best, best_similarity = id, similarity
+        if best is not None:
+            self.duplicates += 1
+        return best, signature
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "chunks": self.checked,
+            "duplicates": self.duplicates,
+            "shrink_rate": self.duplicates / self.checked if self.checked else 0.0,
+        }
+
+    def _band_keys(self, signature: np.ndarray) -> List[Tuple[int, bytes]]:
+        return [
+            (band, signature[band * self.rows : (band + 1) * self.rows].tobytes())
+            for band in range(self.bands)
+        ]
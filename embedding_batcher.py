@@ -0,0 +1,95 @@
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Tuple
+
+from langchain.embeddings.base import Embeddings
+
+
+class EmbeddingBatcher(Embeddings):
+    """Embeds concurrent queries together, in one call of the wrapped embeddings.
+
+    `embed_query` is called from the executor threads of concurrent searches.
+    The first caller that finds no call in flight leads: it waits `window`
+    seconds for more queries, then embeds all pending queries with one
+    `embed_documents` call, and repeats while queries keep arriving, as the
+    group commits of SqliteWorker do. The other callers wait for their vector.
+    Queries known in advance can be embedded up front with one call of
+    `prime`; they are then answered without waiting.
+    """
+
+    def __init__(self, embeddings: Embeddings, window: float = 0.02, max_batch: int = 256):
+        self.embeddings = embeddings
+        self.window = window
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._pending: List[Tuple[str, Future]] = []
+        self._leading = False
+        self._primed: Dict[str, List[float]] = {}
+        self._counters: Dict[str, int] = {"queries": 0, "calls": 0, "primed": 0}
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def prime(self, texts: List[str]) -> None:
+        """Embed `texts` with one call, for the queries expected to ask for them."""
+        with self._lock:
+            texts = [text for text in dict.fromkeys(texts) if text not in self._primed]
+        for start in range(0, len(texts), self.max_batch):
+            chunk = texts[start : start + self.max_batch]
+            vectors = self.embeddings.embed_documents(chunk)
+            with self._lock:
+                self._counters["calls"] += 1
+                self._primed.update(zip(chunk, vectors))
+
+    def embed_query(self, text: str) -> List[float]:
+        future: Future = Future()
+        with self._lock:
+            self._counters["queries"] += 1
+            vector = self._primed.get(text)
+            if vector is not None:
+                self._counters["primed"] += 1
+                return vector
+            self._pending.append((text, future))
+            lead = not self._leading
+            self._leading = True
+        if lead:
+            self._lead()
+        return future.result()
+
+    def metrics(self) -> Dict[str, int]:
+        return dict(self._counters)
+
+    def _lead(self) -> None:
+        batch: List[Tuple[str, Future]] = []
+        try:
+            if self.window > 0:
+                time.sleep(self.window)
+            while True:
+                with self._lock:
+                    batch = self._pending[: self.max_batch]
+                    del self._pending[: self.max_batch]
+                    if not batch:
+                        self._leading = False
+                        return
+                    self._counters["calls"] += 1
+                try:
+                    vectors = self.embeddings.embed_documents([text for text, _ in batch])
+                except Exception as e:
+                    for _, future in batch:
+                        future.set_exception(e)
+                else:
+                    for (_, future), vector in zip(batch, vectors):
+                        future.set_result(vector)
+                batch = []
+        except BaseException as e:
+            # E.g. KeyboardInterrupt: fail every waiting query and step down, so
+            # that the next query leads instead of waiting for this leader forever.
+            with self._lock:
+                outstanding = batch + self._pending
+                self._pending = []
+                self._leading = False
+            for _, future in outstanding:
+                if not future.done():
+                    future.set_exception(e)
+            raise
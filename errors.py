@@ -1,6 +1,10 @@
 from typing import Optional, Any
 
 POLICY_VIOLATION_ERROR_CODE: int = 10001
+OVERLOADED_ERROR_CODE: int = 10002
+SESSION_BUSY_ERROR_CODE: int = 10003
+# Reported for the questions of a batch that failed unexpectedly.
+INTERNAL_ERROR_CODE: int = 10004
 
 
 class BaseError(Exception):
@@ -18,3 +22,17 @@ class PolicyViolationError(BaseError):
 
     def __init__(self, message):
         super().__init__(message=message, code=POLICY_VIOLATION_ERROR_CODE)
+
+
+class OverloadedError(BaseError):
+    """Raised when a request is shed because the service is at capacity."""
+
+    def __init__(self, message):
+        super().__init__(message=message, code=OVERLOADED_ERROR_CODE)
+
+
+class SessionBusyError(BaseError):
+    """Raised when a session sends a message while its previous one is still running."""
+
+    def __init__(self, message):
+        super().__init__(message=message, code=SESSION_BUSY_ERROR_CODE)
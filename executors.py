@@ -0,0 +1,160 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+from pydantic import BaseModel
+
+T = TypeVar("T")
+
+SEARCH = "search"
+BLOCKING_IO = "blocking_io"
+CPU = "cpu"
+
+
+class ExecutorSettings(BaseModel):
+    """Threads of the named pools blocking work of a worker process runs on."""
+
+    search_threads: int = 16  # Vector searches, including their query embedding.
+    blocking_io_threads: int = 8  # Moderation and other HTTP fallbacks.
+    cpu_threads: int = os.cpu_count() or 2  # Opening indexes, imports, splitting.
+
+    @classmethod
+    def from_env(cls) -> "ExecutorSettings":
+        settings = cls()
+        for field, env_name in (
+            ("search_threads", "CHATBOT_SEARCH_THREADS"),
+            ("blocking_io_threads", "CHATBOT_BLOCKING_IO_THREADS"),
+            ("cpu_threads", "CHATBOT_CPU_THREADS"),
+        ):
+            if env_name in os.environ:
+                setattr(
+                    settings,
+                    field,
+                    type(getattr(settings, field))(os.environ[env_name]),
+                )
+        return settings
+
+
+class BoundedExecutor:
+    """A named pool of `max_workers` threads that reports its queue.
+
+    `metrics()` counts the jobs waiting for a thread and running, and the time
+    jobs waited from submission until a thread picked them up, so a pool that
+    is too small shows up as wait time rather than as slow requests elsewhere.
+    """
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._counters: Dict[str, Any] = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "max_queue_depth": 0,
+            "wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+            "run_seconds": 0.0,
+        }
+
+    def submit(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> "Future[T]":
+        submitted = time.perf_counter()
+        with self._lock:
+            self._queued += 1
+            self._counters["submitted"] += 1
+            self._counters["max_queue_depth"] = max(
+                self._counters["max_queue_depth"], self._queued
+            )
+        try:
+            return self._executor.submit(self._timed, submitted, partial(fn, *args, **kwargs))
+        except BaseException:
+            with self._lock:
+                self._queued -= 1
+            raise
+
+    async def run(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Run `fn` on the pool and wait for it without blocking the event loop."""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def _timed(self, submitted: float, fn: Callable[[], T]) -> T:
+        started = time.perf_counter()
+        wait = started - submitted
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+            self._counters["wait_seconds"] += wait
+            self._counters["max_wait_seconds"] = max(self._counters["max_wait_seconds"], wait)
+        failed = True
+        try:
+            result = fn()
+            failed = False
+            return result
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._counters["failed" if failed else "completed"] += 1
+                self._counters["run_seconds"] += time.perf_counter() - started
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+            started = counters["submitted"] - self._queued
+            return {
+                "max_workers": self.max_workers,
+                "queue_depth": self._queued,
+                "running": self._running,
+                **counters,
+                "mean_wait_ms": round(counters["wait_seconds"] / started * 1000, 3)
+                if started
+                else 0.0,
+            }
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+
+
+class Executors:
+    """The pools of a worker process, so that slow work of one kind, e.g.
+    vector searches, cannot starve another, e.g. moderation, as it does on
+    asyncio's shared default executor."""
+
+    _shared: Optional["Executors"] = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, settings: Optional[ExecutorSettings] = None):
+        self.settings = settings or ExecutorSettings.from_env()
+        self.search = BoundedExecutor(SEARCH, self.settings.search_threads)
+        self.blocking_io = BoundedExecutor(BLOCKING_IO, self.settings.blocking_io_threads)
+        self.cpu = BoundedExecutor(CPU, self.settings.cpu_threads)
+
+    @classmethod
+    def shared(cls) -> "Executors":
+        # Any thread may ask for it first, not only the event loop's.
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    @classmethod
+    def close_shared(cls) -> None:
+        with cls._shared_lock:
+            executors, cls._shared = cls._shared, None
+        if executors is not None:
+            executors.shutdown(wait=False)
+
+    def pools(self) -> Dict[str, BoundedExecutor]:
+        return {pool.name: pool for pool in (self.search, self.blocking_io, self.cpu)}
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        return {name: pool.metrics() for name, pool in self.pools().items()}
+
+    def shutdown(self, wait: bool = True) -> None:
+        for pool in self.pools().values():
+            pool.shutdown(wait=wait)
@@ -0,0 +1,203 @@
+import asyncio
+import os
+import threading
+from typing import Any, Dict, Optional
+
+import aiohttp
+import openai
+import requests
+from pydantic import BaseModel
+from requests.adapters import HTTPAdapter
+
+
+class HttpPoolSettings(BaseModel):
+    """Connection settings shared by every OpenAI call of the process."""
+
+    max_connections: int = 100
+    max_connections_per_host: int = 0  # 0 means only max_connections applies.
+    keepalive_timeout: float = 30.0
+    connect_timeout: float = 10.0
+
+    @classmethod
+    def from_env(cls) -> "HttpPoolSettings":
+        settings = cls()
+        for field, env_name in (
+            ("max_connections", "OPENAI_HTTP_MAX_CONNECTIONS"),
+            ("max_connections_per_host", "OPENAI_HTTP_MAX_CONNECTIONS_PER_HOST"),
+            ("keepalive_timeout", "OPENAI_HTTP_KEEPALIVE_TIMEOUT"),
+            ("connect_timeout", "OPENAI_HTTP_CONNECT_TIMEOUT"),
+        ):
+            if env_name in os.environ:
+                setattr(
+                    settings,
+                    field,
+                    type(getattr(settings, field))(os.environ[env_name]),
+                )
+        return settings
+
+
+class _PooledRequestsSession(requests.Session):
+    # openai closes its per-thread session every few minutes; as the session is
+    # shared that would only drop every warm connection, so close() is a no-op
+    # and the pool calls shutdown() instead.
+    def close(self) -> None:
+        pass
+
+    def shutdown(self) -> None:
+        super().close()
+
+
+class HttpClientPool:
+    """One keep-alive connection pool for all model traffic.
+
+    openai reads its async session from the `openai.aiosession` context variable
+    and otherwise opens a new aiohttp session, and a new TLS connection, per
+    call; `bind` points it to the shared session. Sync calls, e.g. embeddings
+    made from Chroma's executor threads, go through `openai.requestssession`,
+    which is installed once. Both are capped at `max_connections`.
+
+    Neither aiohttp nor requests speak HTTP/2, so connections are HTTP/1.1 with
+    keep-alive; `metrics()` reports this as `http2: False`.
+    """
+
+    _shared: Optional["HttpClientPool"] = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, settings: Optional[HttpPoolSettings] = None):
+        self.settings = settings or HttpPoolSettings.from_env()
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._session_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._requests_session: Optional[_PooledRequestsSession] = None
+        self._counters: Dict[str, int] = {
+            "requests": 0,
+            "in_flight": 0,
+            "errors": 0,
+            "connections_created": 0,
+            "connections_reused": 0,
+            "connection_waits": 0,
+        }
+
+    @classmethod
+    def shared(cls) -> "HttpClientPool":
+        """Return the process-wide pool, installing it into openai on first use."""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+                cls._shared.install()
+            return cls._shared
+
+    @classmethod
+    async def close_shared(cls) -> None:
+        with cls._shared_lock:
+            pool, cls._shared = cls._shared, None
+        if pool is not None:
+            await pool.aclose()
+
+    def install(self) -> None:
+        """Route openai's synchronous calls through the pool."""
+        openai.requestssession = self.requests_session()
+
+    def bind(self) -> aiohttp.ClientSession:
+        """Route openai's async calls made from the current context, and the
+        tasks it spawns, through the pool. Must be called on the event loop."""
+        session = self.session()
+        openai.aiosession.set(session)
+        return session
+
+    def session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        if (
+            self._session is None
+            or self._session.closed
+            or self._session_loop is not loop
+        ):
+            connector = aiohttp.TCPConnector(
+                limit=self.settings.max_connections,
+                limit_per_host=self.settings.max_connections_per_host,
+                keepalive_timeout=self.settings.keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(
+                    sock_connect=self.settings.connect_timeout
+                ),
+                trace_configs=[self._trace_config()],
+            )
+            self._session_loop = loop
+        return self._session
+
+    def requests_session(self) -> requests.Session:
+        if self._requests_session is None:
+            session = _PooledRequestsSession()
+            adapter = HTTPAdapter(
+                pool_connections=10,
+                pool_maxsize=self.settings.max_connections,
+                pool_block=True,
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            self._requests_session = session
+        return self._requests_session
+
+    async def aclose(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        if self._requests_session is not None:
+            if openai.requestssession is self._requests_session:
+                openai.requestssession = None
+            self._requests_session.shutdown()
+            self._requests_session = None
+
+    def metrics(self) -> Dict[str, Any]:
+        metrics: Dict[str, Any] = {
+            "http2": False,
+            "max_connections": self.settings.max_connections,
+            "async": dict(self._counters),
+        }
+
+        connector = self._session.connector if self._session else None
+        if connector is not None and not connector.closed:
+            metrics["async"]["active_connections"] = len(
+                getattr(connector, "_acquired", ())
+            )
+            metrics["async"]["idle_connections"] = sum(
+                len(conns) for conns in getattr(connector, "_conns", {}).values()
+            )
+
+        sync = {"requests": 0, "connections_created": 0}
+        if self._requests_session is not None:
+            # The same adapter is mounted for http:// and https://.
+            adapters = self._requests_session.adapters.values()
+            for adapter in {id(item): item for item in adapters}.values():
+                pools = adapter.poolmanager.pools
+                for key in pools.keys():
+                    pool = pools.get(key)
+                    if pool is not None:
+                        sync["requests"] += pool.num_requests
+                        sync["connections_created"] += pool.num_connections
+        metrics["sync"] = sync
+        return metrics
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        counters = self._counters
+
+        def counting(*names: str, delta: int = 1):
+            async def handler(session, context, params):
+                for name in names:
+                    counters[name] += delta
+
+            return handler
+
+        async def on_request_exception(session, context, params):
+            counters["in_flight"] -= 1
+            counters["errors"] += 1
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(counting("requests", "in_flight"))
+        trace_config.on_request_end.append(counting("in_flight", delta=-1))
+        trace_config.on_request_exception.append(on_request_exception)
+        trace_config.on_connection_create_end.append(counting("connections_created"))
+        trace_config.on_connection_reuseconn.append(counting("connections_reused"))
+        trace_config.on_connection_queued_start.append(counting("connection_waits"))
+        return trace_config
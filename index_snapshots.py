@@ -0,0 +1,126 @@
+import json
+import os
+import shutil
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+
+class IndexSnapshots(BaseModel):
+    """Versioned, immutable builds of the vector store kept under one directory.
+
+    Layout:
+        <root>/versions/<version>/    Chroma files and the embedding record file
+        <root>/versions/<version>/SNAPSHOT    written once the version is complete
+        <root>/CURRENT                name of the version being served
+
+    A sync builds a new version next to the live one and publishes it by
+    atomically replacing CURRENT, so readers never see a half-synced index and
+    the previous `keep - 1` versions stay available for rollback.
+    """
+
+    root: str = "./vectorstore/snapshots/"
+    keep: int = 3
+
+    marker_file: str = "SNAPSHOT"
+    pointer_file: str = "CURRENT"
+
+    def current_version(self) -> Optional[str]:
+        try:
+            with open(os.path.join(self.root, self.pointer_file), "r") as file:
+                return file.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def pointer_mtime(self) -> Optional[int]:
+        """A cheap change token for CURRENT, for readers polling for new versions."""
+        try:
+            return os.stat(os.path.join(self.root, self.pointer_file)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def version_path(self, version: str) -> str:
+        return os.path.join(self.root, "versions", version, "")
+
+    def versions(self) -> List[str]:
+        """Complete versions, oldest first."""
+        versions_dir = os.path.join(self.root, "versions")
+        if not os.path.isdir(versions_dir):
+            return []
+        return sorted(
+            name
+            for name in os.listdir(versions_dir)
+            if os.path.exists(os.path.join(versions_dir, name, self.marker_file))
+        )
+
+    def info(self, version: str) -> dict:
+        with open(os.path.join(self.version_path(version), self.marker_file)) as file:
+            return json.load(file)
+
+    def begin(self) -> str:
+        """Create the directory of a new version, seeded with a copy of the
+        current one so that the sync can be incremental. Returns the version."""
+        version = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+        path = self.version_path(version)
+        current = self.current_version()
+        if current:
+            shutil.copytree(
+                self.version_path(current),
+                path,
+                ignore=shutil.ignore_patterns(self.marker_file),
+            )
+        else:
+            os.makedirs(path)
+        return version
+
+    def publish(self, version: str, **info) -> None:
+        """Mark a built version complete and atomically make it the current one."""
+        marker = os.path.join(self.version_path(version), self.marker_file)
+        published_at = datetime.now(timezone.utc).isoformat()
+        with open(marker, "w") as file:
+            json.dump({"version": version, "published_at": published_at, **info}, file)
+        self._point_to(version)
+        self.prune()
+
+    def discard(self, version: str) -> None:
+        if version != self.current_version():
+            shutil.rmtree(self.version_path(version), ignore_errors=True)
+
+    def rollback(self, version: Optional[str] = None) -> str:
+        """Serve `version`, by default the one published before the current one."""
+        versions = self.versions()
+        if version is None:
+            current = self.current_version()
+            older = [item for item in versions if current is None or item < current]
+            if not older:
+                raise ValueError("There is no older version to roll back to.")
+            version = older[-1]
+        elif version not in versions:
+            raise ValueError(f"Unknown or incomplete index version: {version}")
+
+        self._point_to(version)
+        return version
+
+    def prune(self) -> None:
+        """Delete incomplete builds and all but the newest `keep` versions.
+        The current version is never deleted."""
+        current = self.current_version()
+        versions_dir = os.path.join(self.root, "versions")
+        complete = self.versions()
+        stale = set(complete[: max(len(complete) - self.keep, 0)])
+        for name in os.listdir(versions_dir):
+            if name == current:
+                continue
+            if name in stale or name not in complete:
+                shutil.rmtree(os.path.join(versions_dir, name), ignore_errors=True)
+
+    def _point_to(self, version: str) -> None:
+        os.makedirs(self.root, exist_ok=True)
+        pointer = os.path.join(self.root, self.pointer_file)
+        temp = f"{pointer}.{os.getpid()}.tmp"
+        with open(temp, "w") as file:
+            file.write(version)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp, pointer)
@@ -0,0 +1,180 @@
+"""Replay multi-turn conversations against the chatbot API at rising concurrency.
+
+Run from the repository root, against an app whose OpenAI traffic goes to the
+stub server (see loadtest/stub_server.py):
+
+    python -m loadtest.load_generator --url http://127.0.0.1:8000 \\
+        --concurrency 10 50 100 200 --duration 60
+
+Each virtual user starts a new session with a random 64-hex session_id, plays
+one conversation script turn by turn, waits `--think-time` seconds between
+turns and starts over with a new session. For every concurrency level the
+report gives throughput, latency percentiles and error rates; policy
+violations (code 10001) are expected answers to flagged turns and are counted
+apart from errors. `--json` prints the report as JSON.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import secrets
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+import aiohttp
+
+from errors import POLICY_VIOLATION_ERROR_CODE
+
+DEFAULT_SCRIPTS = os.path.join(os.path.dirname(__file__), "conversations.json")
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+class LevelResult:
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self.latencies: List[float] = []
+        self.outcomes: Counter = Counter()
+        self.elapsed = 0.0
+
+    def record(self, outcome: str, latency: float) -> None:
+        self.outcomes[outcome] += 1
+        if outcome in ("ok", "policy_violation"):
+            self.latencies.append(latency)
+
+    def summary(self) -> Dict:
+        requests = sum(self.outcomes.values())
+        errors = requests - self.outcomes["ok"] - self.outcomes["policy_violation"]
+        return {
+            "concurrency": self.concurrency,
+            "requests": requests,
+            "throughput_rps": requests / self.elapsed if self.elapsed else 0.0,
+            "latency_p50_ms": self._ms(percentile(self.latencies, 0.50)),
+            "latency_p95_ms": self._ms(percentile(self.latencies, 0.95)),
+            "latency_p99_ms": self._ms(percentile(self.latencies, 0.99)),
+            "error_rate": errors / requests if requests else 0.0,
+            "outcomes": dict(self.outcomes),
+        }
+
+    @staticmethod
+    def _ms(seconds: Optional[float]) -> Optional[float]:
+        return None if seconds is None else round(seconds * 1000, 1)
+
+
+async def ask(
+    session: aiohttp.ClientSession, url: str, token: str, session_id: str, message: str
+) -> str:
+    """Send one turn and classify its outcome."""
+    try:
+        async with session.post(
+            f"{url}/chatbot",
+            json={"session_id": session_id, "message": message},
+            headers={"X-Token": token},
+        ) as response:
+            if response.status != 200:
+                return f"http_{response.status}"
+            body = await response.json()
+    except asyncio.TimeoutError:
+        return "timeout"
+    except aiohttp.ClientError as e:
+        return type(e).__name__
+    if body.get("code") == 0:
+        return "ok"
+    if body.get("code") == POLICY_VIOLATION_ERROR_CODE:
+        return "policy_violation"
+    return f"code_{body.get('code')}"
+
+
+async def virtual_user(
+    session: aiohttp.ClientSession,
+    args: argparse.Namespace,
+    scripts: List[List[str]],
+    result: LevelResult,
+    deadline: float,
+) -> None:
+    rng = random.Random()
+    while time.monotonic() < deadline:
+        session_id = secrets.token_hex(32)
+        for message in rng.choice(scripts):
+            if time.monotonic() >= deadline:
+                return
+            start = time.perf_counter()
+            outcome = await ask(session, args.url, args.token, session_id, message)
+            result.record(outcome, time.perf_counter() - start)
+            if args.think_time:
+                await asyncio.sleep(rng.uniform(0, 2 * args.think_time))
+
+
+async def run_level(
+    args: argparse.Namespace, scripts: List[List[str]], concurrency: int
+) -> LevelResult:
+    result = LevelResult(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        start = time.monotonic()
+        deadline = start + args.duration
+        await asyncio.gather(
+            *(
+                virtual_user(session, args, scripts, result, deadline)
+                for _ in range(concurrency)
+            )
+        )
+        result.elapsed = time.monotonic() - start
+    return result
+
+
+def print_table(summaries: List[Dict]) -> None:
+    print(
+        f"{'users':>6} {'requests':>9} {'req/s':>8} {'p50 ms':>9} "
+        f"{'p95 ms':>9} {'p99 ms':>9} {'errors':>7}"
+    )
+    for item in summaries:
+        print(
+            f"{item['concurrency']:>6} {item['requests']:>9} "
+            f"{item['throughput_rps']:>8.1f} {item['latency_p50_ms'] or 0:>9.1f} "
+            f"{item['latency_p95_ms'] or 0:>9.1f} {item['latency_p99_ms'] or 0:>9.1f} "
+            f"{item['error_rate']:>7.2%}"
+        )
+
+
+async def main_async(args: argparse.Namespace) -> None:
+    with open(args.scripts) as file:
+        scripts = json.load(file)
+
+    summaries = []
+    for concurrency in args.concurrency:
+        result = await run_level(args, scripts, concurrency)
+        summaries.append(result.summary())
+        if args.pause:
+            await asyncio.sleep(args.pause)
+
+    if args.json:
+        print(json.dumps(summaries, indent=4))
+    else:
+        print_table(summaries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--token", default=os.environ.get("ACCESS_TOKEN", ""))
+    parser.add_argument("--scripts", default=DEFAULT_SCRIPTS, help="JSON list of conversations, each a list of turns.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50, 100])
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds per concurrency level.")
+    parser.add_argument("--think-time", type=float, default=1.0, help="Mean seconds between turns.")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Seconds before a request counts as timed out.")
+    parser.add_argument("--pause", type=float, default=2.0, help="Seconds between levels.")
+    parser.add_argument("--json", action="store_true")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""A local stand-in for the OpenAI endpoints the chatbot calls.
+
+Serves /v1/chat/completions (plain and streamed), /v1/embeddings and
+/v1/moderations with configurable latency, so the real app can be load
+tested without OpenAI traffic:
+
+    python -m loadtest.stub_server --port 8100 --latency 0.4 --jitter 0.1
+    OPENAI_API_BASE=http://127.0.0.1:8100/v1 uvicorn main:app
+
+Chat completions recognise the self-query and condense-question prompts and
+answer them in the format the chains parse. GET /stub/stats returns the
+request counts per endpoint.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+import uuid
+from typing import Any, List
+
+from aiohttp import web
+
+ANSWER = (
+    "Kyden is a software engineer who writes about backend systems, "
+    "machine learning and the projects listed on the portfolio website. "
+)
+
+
+class StubSettings:
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        chunk_delay: float = 0.02,
+        answer_words: int = 60,
+        embedding_size: int = 1536,
+        error_rate: float = 0.0,
+        flag_marker: str = "[flag]",
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.chunk_delay = chunk_delay
+        self.answer_words = answer_words
+        self.embedding_size = embedding_size
+        self.error_rate = error_rate
+        self.flag_marker = flag_marker
+
+
+def _tokens(text: str) -> int:
+    return max(len(text) // 4, 1)
+
+
+def _vector(text: Any, size: int) -> List[float]:
+    # Deterministic per input, so identical texts embed identically.
+    seed = hashlib.sha256(json.dumps(text).encode()).digest()
+    rng = random.Random(seed)
+    return [rng.uniform(-1, 1) for _ in range(size)]
+
+
+def _reply(messages: List[dict], answer_words: int) -> str:
+    prompt = (messages[-1].get("content") or "") if messages else ""
+    if prompt.rstrip().endswith("Structured Request:"):
+        query = prompt.rsplit("User Query:", 1)[-1].rsplit("Structured Request:", 1)[0]
+        structured = {"query": query.strip(), "filter": "NO_FILTER"}
+        return f"```json\n{json.dumps(structured)}\n```"
+    follow_up = re.search(r"Follow Up Input:(.*)\n", prompt)
+    if follow_up:
+        return follow_up.group(1).strip()
+    words = (ANSWER * (answer_words // len(ANSWER.split()) + 1)).split()
+    return " ".join(words[:answer_words])
+
+
+def create_app(settings: StubSettings) -> web.Application:
+    stats = {"chat_completions": 0, "embeddings": 0, "moderations": 0, "errors": 0}
+
+    async def delay():
+        await asyncio.sleep(
+            max(settings.latency + random.uniform(-1, 1) * settings.jitter, 0)
+        )
+
+    def maybe_fail():
+        if settings.error_rate and random.random() < settings.error_rate:
+            stats["errors"] += 1
+            raise web.HTTPServiceUnavailable(
+                text=json.dumps({"error": {"message": "Injected failure", "type": "server_error"}}),
+                content_type="application/json",
+            )
+
+    async def chat_completions(request: web.Request) -> web.StreamResponse:
+        stats["chat_completions"] += 1
+        body = await request.json()
+        await delay()
+        maybe_fail()
+
+        model = body.get("model", "gpt-3.5-turbo")
+        messages = body.get("messages", [])
+        content = _reply(messages, settings.answer_words)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+
+        if not body.get("stream"):
+            prompt_tokens = sum(_tokens(m.get("content") or "") for m in messages)
+            return web.json_response(
+                {
+                    "id": completion_id,
+                    "object": "chat.completion",
+                    "created": created,
+                    "model": model,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": content},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": _tokens(content),
+                        "total_tokens": prompt_tokens + _tokens(content),
+                    },
+                }
+            )
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        async def send(delta: dict, finish_reason=None):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+
+        await send({"role": "assistant", "content": ""})
+        for i, word in enumerate(content.split(" ")):
+            await send({"content": word if i == 0 else f" {word}"})
+            await asyncio.sleep(settings.chunk_delay)
+        await send({}, finish_reason="stop")
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def embeddings(request: web.Request) -> web.Response:
+        stats["embeddings"] += 1
+        body = await request.json()
+        await delay()
+        maybe_fail()
+
+        inputs = body["input"]
+        # A single string, or a single list of token IDs, is one input.
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        tokens = sum(len(item) if isinstance(item, list) else _tokens(item) for item in inputs)
+        return web.json_response(
+            {
+                "object": "list",
+                "data": [
+                    {
+                        "object": "embedding",
+                        "index": i,
+                        "embedding": _vector(item, settings.embedding_size),
+                    }
+                    for i, item in enumerate(inputs)
+                ],
+                "model": body.get("model", "text-embedding-ada-002"),
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+            }
+        )
+
+    async def moderations(request: web.Request) -> web.Response:
+        stats["moderations"] += 1
+        body = await request.json()
+        await delay()
+        maybe_fail()
+
+        inputs = body["input"]
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        results = []
+        for text in inputs:
+            flagged = settings.flag_marker in text
+            results.append(
+                {
+                    "flagged": flagged,
+                    "categories": {"harassment": flagged},
+                    "category_scores": {"harassment": 0.99 if flagged else 0.0001},
+                }
+            )
+        return web.json_response(
+            {"id": f"modr-{uuid.uuid4().hex}", "model": "text-moderation-stable", "results": results}
+        )
+
+    async def stub_stats(request: web.Request) -> web.Response:
+        return web.json_response(stats)
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    app.router.add_post("/v1/embeddings", embeddings)
+    app.router.add_post("/v1/moderations", moderations)
+    app.router.add_get("/stub/stats", stub_stats)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds before each response starts.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Uniform +/- seconds added to the latency.")
+    parser.add_argument("--chunk-delay", type=float, default=0.02, help="Seconds between streamed chunks.")
+    parser.add_argument("--answer-words", type=int, default=60)
+    parser.add_argument("--embedding-size", type=int, default=1536)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 503.")
+    parser.add_argument("--flag-marker", default="[flag]", help="Inputs containing it are flagged by moderation.")
+    args = parser.parse_args()
+
+    settings = StubSettings(
+        latency=args.latency,
+        jitter=args.jitter,
+        chunk_delay=args.chunk_delay,
+        answer_words=args.answer_words,
+        embedding_size=args.embedding_size,
+        error_rate=args.error_rate,
+        flag_marker=args.flag_marker,
+    )
+    web.run_app(create_app(settings), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
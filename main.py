@@ -1,4 +1,6 @@
 import os
+import asyncio
+import json
 from fastapi import (
     FastAPI,
     Path,
@@ -16,10 +18,19 @@ from fastapi import (
 )
 from enum import Enum
 from pydantic import BaseModel, Required, Field, HttpUrl
-from typing import Annotated, Union, Any, Optional
+from typing import Annotated, Awaitable, Callable, Union, Any, List, Optional
 from fastapi.responses import JSONResponse, RedirectResponse
-from conversation import Question, Conversation
-from errors import PolicyViolationError
+from question import Question
+from errors import PolicyViolationError, OverloadedError, SessionBusyError
+from admission import AdmissionController
+from session_lock import SessionSerializer
+from sqlite_worker import SqliteWorker
+from http_pool import HttpClientPool
+from executors import Executors
+from warmup import WarmUp
+
+# Modules that import langchain (conversation, usage) are imported by the
+# warm-up after startup, or lazily below, so that the server starts quickly.
 
 # OpenAI Configuration
 import openai
@@ -30,6 +41,7 @@ openai.api_key = os.environ["OPENAI_API_KEY"]
 # OpenAI Configuration
 
 app = FastAPI()
+warm_up = WarmUp()
 
 
 class ResponseContent(BaseModel):
@@ -50,8 +62,207 @@ async def policy_violation_error_handler(request: Request, exc: PolicyViolationE
     )
 
 
+@app.exception_handler(OverloadedError)
+async def overloaded_error_handler(request: Request, exc: OverloadedError):
+    retry_after = max(int(AdmissionController.shared().settings.queue_timeout), 1)
+    return JSONResponse(
+        status_code=503,
+        content=ResponseContent(code=exc.code, message=exc.message).dict(),
+        headers={"Retry-After": str(retry_after)},
+    )
+
+
+@app.exception_handler(SessionBusyError)
+async def session_busy_error_handler(request: Request, exc: SessionBusyError):
+    return JSONResponse(
+        status_code=429,
+        content=ResponseContent(code=exc.code, message=exc.message).dict(),
+    )
+
+
+async def watch_index_versions(interval: float):
+    # Swap to new index versions, or a store synced by another process, in the
+    # background. Requests only compare a file's mtime and hand a change to the cpu
+    # pool as well, so none of them waits for the new version to be opened.
+    await warm_up.wait()
+    from conversation import ChainFactory
+
+    while True:
+        await asyncio.sleep(interval)
+        await Executors.shared().cpu.run(ChainFactory.refresh_index)
+
+
+@app.on_event("startup")
+async def start_warm_up():
+    warm_up.start()
+
+
+@app.on_event("startup")
+async def start_index_watcher():
+    # Without snapshots, this picks up syncs of the shared store by another process.
+    interval = float(os.environ.get("INDEX_RELOAD_INTERVAL", "5"))
+    if interval > 0:
+        app.state.index_watcher = asyncio.create_task(watch_index_versions(interval))
+
+
+@app.on_event("shutdown")
+def close_chat_history():
+    SqliteWorker.close_all()
+
+
+@app.on_event("shutdown")
+async def close_http_pool():
+    await HttpClientPool.close_shared()
+
+
+@app.on_event("shutdown")
+def close_executors():
+    Executors.close_shared()
+
+
 @app.post("/chatbot", dependencies=[Depends(verify_token)])
-async def chat(question: Question):
+async def chat(
+    question: Question,
+    response: Response,
+    x_include_usage: Annotated[bool, Header()] = False,
+):
+    await warm_up.wait()
+    from conversation import Conversation
+    from usage import UsageRecorder, UsageStore
+
+    recorder = UsageRecorder(session_id=question.session_id, message=question.message)
+
+    async def answer():
+        # Waiting for the session's previous message does not take a slot.
+        async with AdmissionController.shared().admit():
+            try:
+                return await Conversation.chat_with_moderation(
+                    question=question, callbacks=[recorder]
+                )
+            finally:
+                UsageStore.shared().record(recorder)
+
+    message = await SessionSerializer.shared().run(
+        question.session_id, question.message, answer
+    )
+    if x_include_usage:
+        # A deduplicated message made no model calls of its own.
+        response.headers["X-Usage"] = json.dumps(
+            recorder.summary(), separators=(",", ":")
+        )
+    return ResponseContent(message=message)
+
+
+@app.post("/chatbot/batch", dependencies=[Depends(verify_token)])
+async def chat_batch(questions: List[Question]):
+    max_batch = int(os.environ.get("CHATBOT_MAX_BATCH", "500"))
+    if len(questions) > max_batch:
+        raise HTTPException(
+            status_code=413, detail=f"A batch holds at most {max_batch} questions"
+        )
+    await warm_up.wait()
+    from conversation import Conversation
+    from usage import UsageRecorder, UsageStore
+
+    recorders = [
+        UsageRecorder(session_id=question.session_id, message=question.message)
+        for question in questions
+    ]
+
+    async def run_question(question: Question, call: Callable[[], Awaitable[Any]]) -> Any:
+        # Each question takes its turn in its session and its own slot, as on /chatbot.
+        async def admitted():
+            async with AdmissionController.shared().admit():
+                return await call()
+
+        return await SessionSerializer.shared().run(
+            question.session_id, question.message, admitted
+        )
+
+    try:
+        items = await Conversation.chat_batch(
+            questions=questions,
+            concurrency=int(os.environ.get("CHATBOT_BATCH_CONCURRENCY", "8")),
+            callbacks=[[recorder] for recorder in recorders],
+            run_question=run_question,
+        )
+    finally:
+        for recorder in recorders:
+            UsageStore.shared().record(recorder)
+    return ResponseContent(message=[ResponseContent(**item) for item in items])
+
+
+# The probes are not token protected, load balancers call them without headers.
+@app.get("/healthz")
+async def healthz():
+    # Answering at all shows that the event loop is responsive.
+    return ResponseContent(message={"alive": True})
+
+
+@app.get("/readyz")
+async def readyz():
+    status = warm_up.status()
+    if warm_up.ready:
+        from conversation import ChainFactory
+
+        # The index may have been swapped to a newer version since the warm-up.
+        status["index"] = await Executors.shared().search.run(
+            ChainFactory.content_manager().stats
+        )
+    return JSONResponse(
+        status_code=200 if warm_up.ready else 503,
+        content=ResponseContent(message=status).dict(),
+    )
+
+
+@app.get("/metrics", dependencies=[Depends(verify_token)])
+async def metrics():
+    retrieval_cache = moderation_cache = moderation_tiers = None
+    if warm_up.ready:
+        from conversation import ChainFactory
+
+        cache = ChainFactory.content_manager().retrieval_cache
+        retrieval_cache = cache.stats() if cache is not None else None
+        verdicts = ChainFactory.moderation_cache()
+        moderation_cache = verdicts.stats() if verdicts is not None else None
+        moderation_tiers = ChainFactory.moderation_tiers().stats()
     return ResponseContent(
-        message=await Conversation.chat_with_moderation(question=question)
+        message={
+            "http_pool": HttpClientPool.shared().metrics(),
+            "admission": AdmissionController.shared().metrics(),
+            "sessions": SessionSerializer.shared().metrics(),
+            "executors": Executors.shared().metrics(),
+            "warm_up": warm_up.status(),
+            "retrieval_cache": retrieval_cache,
+            "moderation_cache": moderation_cache,
+            "moderation_tiers": moderation_tiers,
+        }
     )
+
+
+@app.get("/usage/sessions", dependencies=[Depends(verify_token)])
+async def heaviest_sessions(limit: int = 10):
+    from usage import UsageStore
+
+    return ResponseContent(message=await UsageStore.shared().heaviest_sessions(limit))
+
+
+@app.get("/usage/sessions/{session_id}", dependencies=[Depends(verify_token)])
+async def session_usage(session_id: str):
+    from usage import UsageStore
+
+    return ResponseContent(message=await UsageStore.shared().session_usage(session_id))
+
+
+@app.get("/usage/prompts", dependencies=[Depends(verify_token)])
+async def heaviest_prompts(limit: int = 10):
+    from usage import UsageStore
+
+    return ResponseContent(message=await UsageStore.shared().heaviest_prompts(limit))
+
+
+@app.get("/usage/requests", dependencies=[Depends(verify_token)])
+async def heaviest_requests(limit: int = 10):
+    from usage import UsageStore
+
+    return ResponseContent(message=await UsageStore.shared().heaviest_requests(limit))
@@ -0,0 +1,169 @@
+import copy
+import re
+from typing import Any, List, Optional, Tuple
+
+from langchain.docstore.document import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter, TextSplitter
+
+HEADING_PATTERN = re.compile(r"^(#{1,6})\s+(.*?)(?:\s+#+)?\s*$")
+FENCE_PATTERN = re.compile(r"^\s*(```|~~~)")
+HEADING_SEPARATOR = " > "
+
+# (heading path, text) of a section or a chunk
+Section = Tuple[List[str], str]
+
+
+class MarkdownHeadingSplitter(TextSplitter):
+    """Splits markdown at its headings and records the heading path of every chunk.
+
+    Each section, a heading and the text up to the next heading, becomes a chunk
+    of its own; headings without text of their own go with the next section. Consecutive sections are merged while they fit in `chunk_size`;
+    the chunk then gets the heading path they share. Longer sections are split at
+    blank lines, with `chunk_overlap`, and fenced code blocks are never cut: a
+    block longer than `chunk_size` becomes a chunk of its own. Front matter is
+    dropped from the text, ContentLoader already keeps it as metadata.
+
+    The heading path, e.g. "Content of Each Page > About Page > Skills", is stored
+    in the `headings` metadata field.
+    """
+
+    def __init__(self, metadata_key: str = "headings", **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self._metadata_key = metadata_key
+        # For paragraphs longer than a chunk.
+        self._paragraph_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=self._chunk_size,
+            chunk_overlap=self._chunk_overlap,
+            separators=["\n", ". ", " ", ""],
+            length_function=self._length_function,
+        )
+
+    def split_text(self, text: str) -> List[str]:
+        return [chunk for _, chunk in self._split(text)]
+
+    def create_documents(
+        self, texts: List[str], metadatas: Optional[List[dict]] = None
+    ) -> List[Document]:
+        _metadatas = metadatas or [{}] * len(texts)
+        documents = []
+        for text, metadata in zip(texts, _metadatas):
+            for headings, chunk in self._split(text):
+                chunk_metadata = copy.deepcopy(metadata)
+                chunk_metadata[self._metadata_key] = HEADING_SEPARATOR.join(headings)
+                documents.append(Document(page_content=chunk, metadata=chunk_metadata))
+        return documents
+
+    def _split(self, text: str) -> List[Section]:
+        chunks: List[Section] = []
+        merged: List[Section] = []
+        merged_length = 0
+        for headings, section in self._sections(text):
+            length = self._length_function(section)
+            if length > self._chunk_size:
+                chunks.extend(self._merge_sections(merged))
+                merged, merged_length = [], 0
+                units = self._units(section)
+                if len(units) > 1 and all(
+                    HEADING_PATTERN.match(line) for line in units[0].split("\n")
+                ):
+                    # Keep the headings with the text that follows them.
+                    units[:2] = [f"{units[0]}\n{units[1]}"]
+                chunks.extend(
+                    (headings, chunk) for chunk in self._merge_splits(units, "\n\n")
+                )
+                continue
+            if merged and merged_length + 2 + length > self._chunk_size:
+                chunks.extend(self._merge_sections(merged))
+                merged, merged_length = [], 0
+            merged_length += length + (2 if merged else 0)
+            merged.append((headings, section))
+        chunks.extend(self._merge_sections(merged))
+        return chunks
+
+    @staticmethod
+    def _merge_sections(sections: List[Section]) -> List[Section]:
+        if not sections:
+            return []
+        shared = sections[0][0]
+        for headings, _ in sections[1:]:
+            common = 0
+            limit = min(len(shared), len(headings))
+            while common < limit and shared[common] == headings[common]:
+                common += 1
+            shared = shared[:common]
+        return [(shared, "\n\n".join(section for _, section in sections))]
+
+    @staticmethod
+    def _sections(text: str) -> List[Section]:
+        lines = text.split("\n")
+        start = 0
+        if lines and lines[0].strip() == "---":
+            for index in range(1, len(lines)):
+                if lines[index].strip() == "---":
+                    start = index + 1
+                    break
+
+        sections: List[Section] = []
+        path: List[Tuple[int, str]] = []
+        current: List[str] = []
+        fence: Optional[str] = None
+
+        def close():
+            section = "\n".join(current).strip()
+            if section:
+                sections.append(([title for _, title in path], section))
+
+        for line in lines[start:]:
+            fence_match = FENCE_PATTERN.match(line)
+            if fence_match:
+                if fence is None:
+                    fence = fence_match.group(1)
+                elif fence_match.group(1) == fence:
+                    fence = None
+            elif fence is None and (heading := HEADING_PATTERN.match(line)):
+                # A heading directly followed by a subheading stays with it.
+                if any(line.strip() and not HEADING_PATTERN.match(line) for line in current):
+                    close()
+                    current = []
+                level = len(heading.group(1))
+                while path and path[-1][0] >= level:
+                    path.pop()
+                path.append((level, heading.group(2)))
+            current.append(line)
+        close()
+        return sections
+
+    def _units(self, section: str) -> List[str]:
+        """Paragraphs and fenced code blocks of a section. Paragraphs longer
+        than a chunk are split, code blocks never are."""
+        units: List[str] = []
+        current: List[str] = []
+        fence: Optional[str] = None
+
+        def close():
+            unit = "\n".join(current).strip("\n")
+            if unit.strip():
+                if fence is None and self._length_function(unit) > self._chunk_size:
+                    units.extend(self._paragraph_splitter.split_text(unit))
+                else:
+                    units.append(unit)
+
+        for line in section.split("\n"):
+            fence_match = FENCE_PATTERN.match(line)
+            if fence is None and fence_match:
+                close()
+                current = [line]
+                fence = fence_match.group(1)
+            elif fence is not None:
+                current.append(line)
+                if fence_match and fence_match.group(1) == fence:
+                    close()
+                    current = []
+                    fence = None
+            elif not line.strip():
+                close()
+                current = []
+            else:
+                current.append(line)
+        close()
+        return units
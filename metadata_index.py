@@ -0,0 +1,300 @@
+import bisect
+import json
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+from langchain.schema import Document
+from langchain.vectorstores import Chroma
+from pydantic import BaseModel
+
+# Chroma only compares numbers with $gt, $gte, $lt and $lte, so date fields are
+# also stored as a numeric "<field>_ts" metadata field at ingestion.
+TIMESTAMP_SUFFIX = "_ts"
+
+_RANGE_OPERATORS = {"$gt", "$gte", "$lt", "$lte"}
+
+
+def to_timestamp(value: Any) -> Optional[float]:
+    """Parse an ISO 8601 date, as used in the front matter, to a UTC timestamp."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, datetime):
+        date = value
+    elif isinstance(value, str):
+        try:
+            date = datetime.fromisoformat(value.strip().rstrip("Z"))
+        except ValueError:
+            return None
+    else:
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date.timestamp()
+
+
+class MetadataIndex(BaseModel):
+    """Precomputed postings over the chunk metadata that self-query filters use.
+
+    Categorical fields map each value to the IDs carrying it, and date fields
+    keep their IDs sorted by timestamp, so the candidates of a translated Chroma
+    `where` filter are found with set operations and binary searches. `search`
+    then ranks only those candidates instead of filtering the whole collection.
+    """
+
+    categorical_fields: List[str] = ["category", "author"]
+    date_fields: List[str] = ["date"]
+    max_candidates: int = 2000
+
+    postings: Dict[str, Dict[str, Set[str]]] = {}
+    timestamps: Dict[str, List[float]] = {}
+    timestamp_ids: Dict[str, List[str]] = {}
+    ids: Set[str] = set()
+
+    @classmethod
+    def build(
+        cls, ids: Iterable[str], metadatas: Iterable[Optional[dict]], **kwargs: Any
+    ) -> "MetadataIndex":
+        index = cls(**kwargs)
+        index.reindex(ids, metadatas)
+        return index
+
+    @classmethod
+    def load(cls, path: str) -> Optional["MetadataIndex"]:
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as file:
+            data = json.load(file)
+        index = cls(
+            categorical_fields=data["categorical_fields"],
+            date_fields=data["date_fields"],
+        )
+        index.postings = {
+            field: {value: set(ids) for value, ids in values.items()}
+            for field, values in data["postings"].items()
+        }
+        index.timestamps = data["timestamps"]
+        index.timestamp_ids = data["timestamp_ids"]
+        index.ids = set(data["ids"])
+        return index
+
+    def save(self, path: str) -> None:
+        data = {
+            "categorical_fields": self.categorical_fields,
+            "date_fields": self.date_fields,
+            "postings": {
+                field: {value: sorted(ids) for value, ids in values.items()}
+                for field, values in self.postings.items()
+            },
+            "timestamps": self.timestamps,
+            "timestamp_ids": self.timestamp_ids,
+            "ids": sorted(self.ids),
+        }
+        temp = f"{path}.{os.getpid()}.tmp"
+        with open(temp, "w") as file:
+            json.dump(data, file)
+        os.replace(temp, path)
+
+    def reindex(self, ids: Iterable[str], metadatas: Iterable[Optional[dict]]) -> None:
+        """Rebuild the postings in place, so retrievers holding the index see the new data."""
+        postings: Dict[str, Dict[str, Set[str]]] = {
+            field: {} for field in self.categorical_fields
+        }
+        dated: Dict[str, List[tuple]] = {field: [] for field in self.date_fields}
+        all_ids: Set[str] = set()
+        for id, metadata in zip(ids, metadatas):
+            metadata = metadata or {}
+            all_ids.add(id)
+            for field in self.categorical_fields:
+                if field in metadata:
+                    postings[field].setdefault(str(metadata[field]), set()).add(id)
+            for field in self.date_fields:
+                timestamp = to_timestamp(metadata.get(field))
+                if timestamp is not None:
+                    dated[field].append((timestamp, id))
+
+        for pairs in dated.values():
+            pairs.sort()
+        self.postings = postings
+        self.timestamps = {field: [ts for ts, _ in pairs] for field, pairs in dated.items()}
+        self.timestamp_ids = {field: [id for _, id in pairs] for field, pairs in dated.items()}
+        self.ids = all_ids
+
+    def index_collection(self, vectordb: Chroma) -> None:
+        found = vectordb._collection.get(include=["metadatas"])
+        self.reindex(found["ids"], found["metadatas"])
+
+    def candidates(self, where: dict) -> Optional[Set[str]]:
+        """IDs that may match `where`, a superset of the exact result.
+        Returns None if the filter uses a field that is not indexed."""
+        result: Optional[Set[str]] = None
+        for key, value in where.items():
+            if key == "$and":
+                found = [self.candidates(item) for item in value]
+                known = [item for item in found if item is not None]
+                ids = set.intersection(*known) if known else None
+            elif key == "$or":
+                found = [self.candidates(item) for item in value]
+                if any(item is None for item in found):
+                    return None
+                ids = set.union(set(), *found)
+            else:
+                ids = self._field_candidates(key, value)
+            if ids is not None:
+                result = ids if result is None else result & ids
+        return result
+
+    def matches(self, where: dict, metadata: dict) -> bool:
+        """Evaluate a Chroma `where` filter against one chunk's metadata."""
+        for key, value in where.items():
+            if key == "$and":
+                if not all(self.matches(item, metadata) for item in value):
+                    return False
+            elif key == "$or":
+                if not any(self.matches(item, metadata) for item in value):
+                    return False
+            else:
+                if not isinstance(value, dict):
+                    value = {"$eq": value}
+                for operator, operand in value.items():
+                    if not self._compare(key, metadata.get(key), operator, operand):
+                        return False
+        return True
+
+    def chroma_where(self, where: dict) -> dict:
+        """Rewrite date range comparisons to the numeric timestamp fields,
+        the only form Chroma can evaluate them in."""
+        typed: dict = {}
+        for key, value in where.items():
+            if key in ("$and", "$or"):
+                typed[key] = [self.chroma_where(item) for item in value]
+            elif key in self.date_fields and isinstance(value, dict):
+                ranges = {
+                    op: to_timestamp(operand)
+                    for op, operand in value.items()
+                    if op in _RANGE_OPERATORS
+                }
+                rest = {op: operand for op, operand in value.items() if op not in ranges}
+                if rest:
+                    typed[key] = rest
+                if ranges:
+                    typed[f"{key}{TIMESTAMP_SUFFIX}"] = ranges
+            else:
+                typed[key] = value
+        return typed
+
+    def search(
+        self, vectordb: Chroma, query: str, where: dict, k: int = 4
+    ) -> Optional[List[Document]]:
+        """Similarity search restricted to the candidates of `where`.
+        Returns None if the candidates cannot be narrowed down to at most
+        `max_candidates`, in which case Chroma's own filtering should be used."""
+        found = self.search_with_ids(vectordb, query, where, k)
+        return None if found is None else [document for _, document in found]
+
+    def search_with_ids(
+        self, vectordb: Chroma, query: str, where: dict, k: int = 4
+    ) -> Optional[List[Tuple[str, Document]]]:
+        """`search`, with the IDs of the documents."""
+        candidates = self.candidates(where)
+        if candidates is None or len(candidates) > self.max_candidates:
+            return None
+        if not candidates:
+            return []
+
+        collection = vectordb._collection
+        found = collection.get(
+            ids=sorted(candidates), include=["embeddings", "documents", "metadatas"]
+        )
+        keep = [
+            i
+            for i, metadata in enumerate(found["metadatas"])
+            if self.matches(where, metadata or {})
+        ]
+        if not keep:
+            return []
+
+        vectors = np.asarray([found["embeddings"][i] for i in keep], dtype=np.float32)
+        vector = np.asarray(vectordb._embedding_function.embed_query(query), dtype=np.float32)
+        space = (collection.metadata or {}).get("hnsw:space", "l2")
+        if space == "cosine":
+            norms = np.linalg.norm(vectors, axis=1) * np.linalg.norm(vector)
+            distances = 1.0 - (vectors @ vector) / np.maximum(norms, 1e-12)
+        elif space == "ip":
+            distances = 1.0 - vectors @ vector
+        else:
+            distances = np.square(vectors - vector).sum(axis=1)
+
+        return [
+            (
+                found["ids"][keep[i]],
+                Document(
+                    page_content=found["documents"][keep[i]],
+                    metadata=found["metadatas"][keep[i]] or {},
+                ),
+            )
+            for i in np.argsort(distances, kind="stable")[:k]
+        ]
+
+    def _field_candidates(self, field: str, condition: Any) -> Optional[Set[str]]:
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        if field in self.categorical_fields:
+            values = self.postings.get(field, {})
+            ids: Optional[Set[str]] = None
+            for operator, operand in condition.items():
+                if operator == "$eq":
+                    found = set(values.get(str(operand), ()))
+                elif operator == "$ne":
+                    # Chunks without the field also match $ne.
+                    found = self.ids - values.get(str(operand), set())
+                else:
+                    return None
+                ids = found if ids is None else ids & found
+            return ids
+        if field in self.date_fields:
+            timestamps = self.timestamps.get(field, [])
+            timestamp_ids = self.timestamp_ids.get(field, [])
+            low, high = 0, len(timestamps)
+            for operator, operand in condition.items():
+                timestamp = to_timestamp(operand)
+                if timestamp is None:
+                    return None
+                if operator == "$gt":
+                    low = max(low, bisect.bisect_right(timestamps, timestamp))
+                elif operator == "$gte":
+                    low = max(low, bisect.bisect_left(timestamps, timestamp))
+                elif operator == "$lt":
+                    high = min(high, bisect.bisect_left(timestamps, timestamp))
+                elif operator == "$lte":
+                    high = min(high, bisect.bisect_right(timestamps, timestamp))
+                elif operator == "$eq":
+                    low = max(low, bisect.bisect_left(timestamps, timestamp))
+                    high = min(high, bisect.bisect_right(timestamps, timestamp))
+                else:
+                    return None
+            return set(timestamp_ids[low:high])
+        return None
+
+    def _compare(self, field: str, value: Any, operator: str, operand: Any) -> bool:
+        if field in self.date_fields:
+            value, operand = to_timestamp(value), to_timestamp(operand)
+        if operator == "$ne":
+            return value != operand
+        if value is None or operand is None:
+            return False
+        try:
+            if operator == "$eq":
+                return value == operand
+            if operator == "$gt":
+                return value > operand
+            if operator == "$gte":
+                return value >= operand
+            if operator == "$lt":
+                return value < operand
+            if operator == "$lte":
+                return value <= operand
+        except TypeError:
+            return False
+        return False
@@ -0,0 +1,78 @@
+import hashlib
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+def normalize(text: str) -> str:
+    """The form of a message its verdict is cached by: "Hi ", "hi" and "HI"
+    share one entry."""
+    return " ".join(unicodedata.normalize("NFKC", text).casefold().split())
+
+
+class ModerationCache:
+    """Moderation verdicts of recent messages, by the SHA-256 of their normalized text.
+
+    Greetings, thanks and the suggested questions are sent by many visitors, and
+    their verdict does not change from one to the next. At most `max_entries`
+    verdicts are kept, the least recently used are evicted first, and each for
+    `ttl` seconds, so that a change of the moderation model is picked up.
+    Flagged verdicts are cached too, a repeated violation is rejected without
+    a request.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 10000,
+        ttl: float = 3600.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        # key -> (flagged, expiry)
+        self._verdicts: "OrderedDict[bytes, Tuple[bool, float]]" = OrderedDict()
+        self._counters = {"hits": 0, "misses": 0, "expirations": 0, "evictions": 0}
+
+    @staticmethod
+    def key(text: str) -> bytes:
+        return hashlib.sha256(normalize(text).encode()).digest()
+
+    def get(self, text: str) -> Optional[bool]:
+        """Whether `text` was flagged, None if its verdict is not cached."""
+        key = self.key(text)
+        with self._lock:
+            verdict = self._verdicts.get(key)
+            if verdict is not None and verdict[1] <= self._clock():
+                del self._verdicts[key]
+                self._counters["expirations"] += 1
+                verdict = None
+            if verdict is None:
+                self._counters["misses"] += 1
+                return None
+            self._verdicts.move_to_end(key)
+            self._counters["hits"] += 1
+            return verdict[0]
+
+    def put(self, text: str, flagged: bool) -> None:
+        if self.max_entries <= 0:
+            return
+        key = self.key(text)
+        with self._lock:
+            self._verdicts[key] = (flagged, self._clock() + self.ttl)
+            self._verdicts.move_to_end(key)
+            while len(self._verdicts) > self.max_entries:
+                self._verdicts.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                **self._counters,
+                "entries": len(self._verdicts),
+                "hit_rate": self._counters["hits"] / lookups if lookups else 0.0,
+            }
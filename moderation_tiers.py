@@ -0,0 +1,130 @@
+import json
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel
+
+from moderation_cache import normalize
+
+# Patterns match the normalized message, see moderation_cache.normalize, without
+# the punctuation around it. An allow pattern must match all of it.
+DEFAULT_ALLOW = [
+    r"(hi|hello|hey|hiya|howdy|yo)( there)?",
+    r"good (morning|afternoon|evening)",
+    r"(many )?(thanks|thank you|thx|ty)( (so|very) much)?( for (your|the) help)?",
+    r"(ok|okay|cool|great|nice|awesome|perfect|got it|sounds good|i see)",
+    r"(yes|yeah|yep|no|nope|sure|of course)",
+    r"(bye|goodbye|see you|see ya|have a nice day)",
+    r"how are you( doing| today)?",
+    r"(who|what) are you",
+    r"what can you (do|help me with)",
+]
+# A block pattern may match anywhere in the message.
+DEFAULT_BLOCK = [
+    r"\b(kill|hang) yourself\b",
+    r"\bkys\b",
+    r"\bi(?: will| am going to|['’]m going to) (kill|murder|rape) you\b",
+]
+PUNCTUATION = " .,!?~:;'\"()-"
+
+TIERS = ("local", "cache", "remote")
+
+
+class ModerationTierSettings(BaseModel):
+    """Patterns of the local tier in front of the moderation API."""
+
+    enabled: bool = True
+    allow: List[str] = DEFAULT_ALLOW
+    block: List[str] = DEFAULT_BLOCK
+    max_allow_length: int = 64  # Longer messages are never allowed locally.
+
+    @classmethod
+    def from_env(cls) -> "ModerationTierSettings":
+        settings = cls()
+        if "CHATBOT_LOCAL_MODERATION" in os.environ:
+            settings.enabled = os.environ["CHATBOT_LOCAL_MODERATION"] == "1"
+        if "CHATBOT_LOCAL_MODERATION_MAX_LENGTH" in os.environ:
+            settings.max_allow_length = int(os.environ["CHATBOT_LOCAL_MODERATION_MAX_LENGTH"])
+        rules = os.environ.get("CHATBOT_LOCAL_MODERATION_RULES")
+        if rules:
+            # {"allow": [...], "block": [...]}, added to the defaults.
+            with open(rules) as file:
+                extra = json.load(file)
+            settings.allow = [*settings.allow, *extra.get("allow", [])]
+            settings.block = [*settings.block, *extra.get("block", [])]
+        return settings
+
+
+def _compile(patterns: List[str]) -> Optional["re.Pattern[str]"]:
+    if not patterns:
+        return None
+    return re.compile("|".join(f"(?:{pattern})" for pattern in patterns))
+
+
+class ModerationTiers:
+    """Decides the moderation verdict of a message by the cheapest tier that can.
+
+    The local tier matches compiled patterns: a message matching a block pattern
+    is flagged, a short one matching an allow pattern, small talk, is not, and
+    anything else is ambiguous and left to the moderation cache and then the
+    moderation API. KydenModerationChain records which tier resolved each
+    message and how long it took; `stats()` estimates the time saved from the
+    mean latency of the API.
+    """
+
+    def __init__(self, settings: Optional[ModerationTierSettings] = None):
+        self.settings = settings or ModerationTierSettings.from_env()
+        self._allow = _compile(self.settings.allow)
+        self._block = _compile(self.settings.block)
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[str, Any]] = {
+            tier: {"resolved": 0, "flagged": 0, "seconds": 0.0} for tier in TIERS
+        }
+
+    def classify(self, text: str) -> Optional[bool]:
+        """Whether the local tier flags `text`, None if it cannot tell."""
+        if not self.settings.enabled:
+            return None
+        normalized = normalize(text).strip(PUNCTUATION)
+        if self._block is not None and self._block.search(normalized):
+            return True
+        if (
+            self._allow is not None
+            and len(normalized) <= self.settings.max_allow_length
+            and self._allow.fullmatch(normalized)
+        ):
+            return False
+        return None
+
+    def record(self, tier: str, flagged: bool, seconds: float) -> None:
+        with self._lock:
+            counters = self._counters[tier]
+            counters["resolved"] += 1
+            counters["flagged"] += flagged
+            counters["seconds"] += seconds
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = {tier: dict(values) for tier, values in self._counters.items()}
+        for values in counters.values():
+            values["mean_ms"] = (
+                round(values["seconds"] / values["resolved"] * 1000, 3)
+                if values["resolved"]
+                else 0.0
+            )
+        remote = counters["remote"]
+        mean_remote = remote["seconds"] / remote["resolved"] if remote["resolved"] else 0.0
+        fast = [counters["local"], counters["cache"]]
+        total = sum(values["resolved"] for values in counters.values())
+        return {
+            "enabled": self.settings.enabled,
+            **counters,
+            "resolved_without_request": (
+                sum(values["resolved"] for values in fast) / total if total else 0.0
+            ),
+            "estimated_seconds_saved": sum(
+                values["resolved"] * mean_remote - values["seconds"] for values in fast
+            ),
+        }
@@ -0,0 +1,15 @@
+import re
+
+from pydantic import BaseModel, validator
+
+
+class Question(BaseModel):
+    session_id: str
+    message: str
+
+    @validator("session_id")
+    def validate_session_id(cls, v):
+        pattern = r"^[a-fA-F0-9]{64}$"
+        if not re.match(pattern, v):
+            raise ValueError(f"{v} does not match the required session-id format")
+        return v
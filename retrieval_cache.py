@@ -0,0 +1,95 @@
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain.schema import Document
+
+
+class RetrievalCache:
+    """Results of similarity searches, by query, search type, filter, k and the
+    index version searched.
+
+    A result is kept as the IDs of its documents, and the documents in a store
+    shared by all results, so a document found by many queries is held once.
+    At most `max_entries` results are kept, the least recently used are evicted
+    first. `bump` is called whenever the index changes, by ContentManager, and
+    drops all results; a search that was running meanwhile is not stored.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self.version = 0
+        self._lock = threading.Lock()
+        self._results: "OrderedDict[tuple, Tuple[str, ...]]" = OrderedDict()
+        # ID -> [document, number of results holding it]
+        self._documents: Dict[str, list] = {}
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    @staticmethod
+    def key(
+        query: str,
+        search_type: str,
+        where: Optional[dict],
+        k: int,
+        index_version: Optional[str] = None,
+    ) -> tuple:
+        where_key = json.dumps(where or {}, sort_keys=True, default=str)
+        return (query, search_type, where_key, k, index_version)
+
+    def get(self, key: tuple) -> Optional[List[Document]]:
+        """Copies of the documents of a cached result, None on a miss."""
+        with self._lock:
+            ids = self._results.get(key)
+            if ids is None:
+                self._counters["misses"] += 1
+                return None
+            self._results.move_to_end(key)
+            self._counters["hits"] += 1
+            documents = [self._documents[id][0] for id in ids]
+        return [
+            Document(page_content=document.page_content, metadata=dict(document.metadata))
+            for document in documents
+        ]
+
+    def put(self, key: tuple, found: List[Tuple[str, Document]], version: int) -> None:
+        """Store the result of a search started at `version`, unless the index
+        changed since."""
+        with self._lock:
+            if version != self.version or self.max_entries <= 0:
+                return
+            if key in self._results:
+                self._release(self._results.pop(key))
+            for id, document in found:
+                entry = self._documents.setdefault(id, [document, 0])
+                entry[1] += 1
+            self._results[key] = tuple(id for id, _ in found)
+            while len(self._results) > self.max_entries:
+                _, ids = self._results.popitem(last=False)
+                self._release(ids)
+                self._counters["evictions"] += 1
+
+    def bump(self) -> int:
+        """Invalidate all results. Returns the new version."""
+        with self._lock:
+            self.version += 1
+            self._results.clear()
+            self._documents.clear()
+            self._counters["invalidations"] += 1
+            return self.version
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self._counters,
+                "version": self.version,
+                "entries": len(self._results),
+                "documents": len(self._documents),
+            }
+
+    def _release(self, ids: Tuple[str, ...]) -> None:
+        for id in ids:
+            entry = self._documents[id]
+            entry[1] -= 1
+            if not entry[1]:
+                del self._documents[id]
@@ -0,0 +1,143 @@
+"""Serve the chatbot from several worker processes sharing one vector index.
+
+    python serve.py --workers 4 --snapshot-dir ./vectorstore/snapshots/ --sync-interval 600
+
+The supervisor starts one ingestion process, the only writer of the index. It
+syncs "original_content_path" into a new snapshot version (see IndexSnapshots)
+every --sync-interval seconds, or right away on SIGHUP, and publishes it by
+replacing the CURRENT pointer. The uvicorn workers open the published versions
+read-only, never write them, and switch to a new version when CURRENT changes.
+
+Published versions are immutable, so the workers' reads of the Chroma SQLite
+files are served from the shared OS page cache. The HNSW graph is loaded into
+each worker's memory by hnswlib and is not shared.
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import threading
+import time
+
+import uvicorn
+from dotenv import load_dotenv, find_dotenv
+
+from index_snapshots import IndexSnapshots
+
+
+def ingest(snapshot_dir: str, interval: float, options: dict, ready, stop) -> None:
+    """Body of the ingestion process. `options` are passed on to ContentManager,
+    "split_cache" as the path of its SplitCache."""
+    from content_manager import ContentManager
+    from split_cache import SplitCache
+
+    wakeup = threading.Event()
+    signal.signal(signal.SIGHUP, lambda signum, frame: wakeup.set())
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    if options.get("split_cache"):
+        options = {**options, "split_cache": SplitCache(options["split_cache"])}
+    manager = ContentManager(snapshots=IndexSnapshots(root=snapshot_dir), **options)
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            duplicates = manager.trigger_embedding()
+            print(
+                f"Published index version {manager.index_version} "
+                f"in {time.perf_counter() - start:.1f}s"
+            )
+            if duplicates and duplicates["chunks"]:
+                print(
+                    f"Skipped {duplicates['duplicates']} of {duplicates['chunks']} new chunks "
+                    f"as near-duplicates ({duplicates['shrink_rate']:.1%})"
+                )
+        except Exception as e:
+            print(f"Index sync failed, still serving {manager.index_version}: {e}")
+        ready.set()
+
+        wakeup.wait(interval)
+        wakeup.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--snapshot-dir", default="./vectorstore/snapshots/")
+    parser.add_argument(
+        "--sync-interval",
+        type=float,
+        default=600,
+        help="Seconds between syncs of the original content.",
+    )
+    parser.add_argument(
+        "--reload-interval",
+        type=float,
+        default=5,
+        help="Seconds between the workers' checks for a new index version.",
+    )
+    parser.add_argument(
+        "--markdown-headings",
+        action="store_true",
+        help="Split the content at markdown headings, see MarkdownHeadingSplitter.",
+    )
+    parser.add_argument(
+        "--deduplicate",
+        action="store_true",
+        help="Skip near-duplicate chunks when syncing, see DuplicateIndex.",
+    )
+    parser.add_argument(
+        "--split-cache",
+        default="./vectorstore/split_cache.db",
+        metavar="PATH",
+        help="SQLite file caching split files across syncs, see SplitCache. Empty to disable.",
+    )
+    args = parser.parse_args()
+
+    _ = load_dotenv(find_dotenv())
+    # Inherited by the workers, see ChainFactory.content_manager.
+    os.environ["INDEX_SNAPSHOT_DIR"] = args.snapshot_dir
+    os.environ["INDEX_READ_ONLY"] = "1"
+    os.environ["INDEX_RELOAD_INTERVAL"] = str(args.reload_interval)
+    # Serialize each session across the workers, see SessionSerializer.
+    os.environ.setdefault(
+        "CHATBOT_SESSION_LEASE_DB", "./memorystore/chat_message_history.db"
+    )
+
+    context = multiprocessing.get_context("spawn")
+    ready, stop = context.Event(), context.Event()
+    ingestion = context.Process(
+        target=ingest,
+        args=(
+            args.snapshot_dir,
+            args.sync_interval,
+            {
+                "markdown_headings": args.markdown_headings,
+                "deduplicate": args.deduplicate,
+                "split_cache": args.split_cache,
+            },
+            ready,
+            stop,
+        ),
+        name="kyden-ingestion",
+    )
+    ingestion.start()
+
+    # The workers need a published version to open.
+    while not ready.wait(1):
+        if not ingestion.is_alive():
+            raise SystemExit("The ingestion process exited before publishing an index.")
+        if IndexSnapshots(root=args.snapshot_dir).current_version():
+            break
+
+    try:
+        uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers)
+    finally:
+        stop.set()
+        os.kill(ingestion.pid, signal.SIGHUP)
+        ingestion.join()
+
+
+if __name__ == "__main__":
+    main()
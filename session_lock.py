@@ -0,0 +1,297 @@
+import asyncio
+import os
+import sqlite3
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from sqlite_worker import SqliteWorker
+from errors import SessionBusyError
+
+
+class KeyedLock:
+    """One asyncio lock per key, created on first use and dropped once unused.
+    Waiters acquire a key's lock in arrival order."""
+
+    def __init__(self):
+        self._locks: Dict[str, List[Any]] = {}  # key -> [lock, holders and waiters]
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    def locked(self, key: str) -> bool:
+        entry = self._locks.get(key)
+        return entry is not None and entry[0].locked()
+
+    def waiters(self, key: Optional[str] = None) -> int:
+        """Callers waiting for the lock of `key`, or of any key."""
+        entries = self._locks.values() if key is None else [self._locks.get(key)]
+        return sum(entry[1] - entry[0].locked() for entry in entries if entry is not None)
+
+    @asynccontextmanager
+    async def hold(self, key: str, timeout: Optional[float] = None) -> AsyncIterator[None]:
+        """Raises asyncio.TimeoutError if the lock is not acquired within `timeout` seconds."""
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            if entry[1] == 1:
+                # Nobody else holds or waits for it: acquired right away, where
+                # wait_for would first schedule a task.
+                await entry[0].acquire()
+            else:
+                await asyncio.wait_for(entry[0].acquire(), timeout)
+            try:
+                yield
+            finally:
+                entry[0].release()
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+
+def _create_lease_table(conn: sqlite3.Connection, table_name: str) -> None:
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {table_name} (
+            session_id TEXT PRIMARY KEY,
+            token TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    """
+    )
+
+
+def _try_acquire_lease(
+    conn: sqlite3.Connection,
+    table_name: str,
+    session_id: str,
+    token: str,
+    ttl: float,
+) -> bool:
+    now = time.time()
+    cursor = conn.execute(
+        f"""
+        INSERT INTO {table_name} (session_id, token, expires_at) VALUES (?, ?, ?)
+        ON CONFLICT(session_id) DO UPDATE
+        SET token = excluded.token, expires_at = excluded.expires_at
+        WHERE {table_name}.expires_at < ?
+    """,
+        (session_id, token, now + ttl, now),
+    )
+    return cursor.rowcount == 1
+
+
+def _release_lease(
+    conn: sqlite3.Connection, table_name: str, session_id: str, token: str
+) -> None:
+    conn.execute(
+        f"DELETE FROM {table_name} WHERE session_id = ? AND token = ?",
+        (session_id, token),
+    )
+
+
+class SqliteLease:
+    """A per-session lease in a table of the chat history database, for
+    serializing a session across worker processes.
+
+    The lease statements run on the database's SqliteWorker, after the turn's
+    history writes, so the next holder always reads the committed history.
+    A lease expires after `ttl` seconds, so a crashed worker cannot block its
+    sessions for longer than that.
+    """
+
+    def __init__(
+        self,
+        db_file: str = "./memorystore/chat_message_history.db",
+        table_name: str = "session_leases",
+        ttl: float = 120.0,
+        timeout: float = 30.0,
+        poll_interval: float = 0.02,
+    ):
+        self.table_name = table_name
+        self.ttl = ttl
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.worker = SqliteWorker.for_file(db_file)
+        self.worker.submit(partial(_create_lease_table, table_name=table_name))
+
+    @asynccontextmanager
+    async def hold(self, session_id: str) -> AsyncIterator[None]:
+        token = uuid.uuid4().hex
+        acquire = partial(
+            _try_acquire_lease,
+            table_name=self.table_name,
+            session_id=session_id,
+            token=token,
+            ttl=self.ttl,
+        )
+        deadline = time.monotonic() + self.timeout
+        delay = self.poll_interval
+        while not await self.worker.run(acquire):
+            if time.monotonic() >= deadline:
+                raise SessionBusyError(
+                    "A previous message of this session is still being answered."
+                )
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.5)
+        try:
+            yield
+        finally:
+            await self.worker.run(
+                partial(
+                    _release_lease,
+                    table_name=self.table_name,
+                    session_id=session_id,
+                    token=token,
+                )
+            )
+
+
+class SessionSerializer:
+    """Runs the requests of a session one at a time, in arrival order.
+
+    Requests of different sessions run concurrently. With a `lease` the order
+    also holds across worker processes. A message identical to one the session
+    sent less than `dedupe_window` seconds earlier, or that is still being
+    answered, is not run again: it gets the first call's result. Deduplication
+    only covers requests received by this process.
+
+    Waiting for a session's previous message takes no admission slot, so it is
+    bounded here: at most `max_waiters` requests of a session wait, each for at
+    most `wait_timeout` seconds; others are rejected with SessionBusyError.
+    """
+
+    _shared: Optional["SessionSerializer"] = None
+
+    def __init__(
+        self,
+        lease: Optional[SqliteLease] = None,
+        dedupe_window: float = 10.0,
+        max_waiters: int = 8,
+        wait_timeout: float = 30.0,
+    ):
+        self.lease = lease
+        self.dedupe_window = dedupe_window
+        self.max_waiters = max_waiters
+        self.wait_timeout = wait_timeout
+        self._locks = KeyedLock()
+        # (session_id, message) -> (arrival time, future of the first call)
+        self._recent: "OrderedDict[Tuple[str, str], Tuple[float, asyncio.Future]]" = (
+            OrderedDict()
+        )
+        self._counters: Dict[str, Any] = {
+            "requests": 0,
+            "deduplicated": 0,
+            "waited": 0,
+            "shed_waiters": 0,
+            "shed_timeout": 0,
+            "wait_seconds": 0.0,
+        }
+
+    @classmethod
+    def shared(cls) -> "SessionSerializer":
+        if cls._shared is None:
+            lease_db = os.environ.get("CHATBOT_SESSION_LEASE_DB")
+            cls._shared = cls(
+                lease=SqliteLease(db_file=lease_db) if lease_db else None,
+                dedupe_window=float(os.environ.get("CHATBOT_DEDUPE_WINDOW", "10")),
+                max_waiters=int(os.environ.get("CHATBOT_SESSION_MAX_WAITERS", "8")),
+                wait_timeout=float(os.environ.get("CHATBOT_SESSION_WAIT_TIMEOUT", "30")),
+            )
+        return cls._shared
+
+    async def run(
+        self, session_id: str, message: str, call: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        self._counters["requests"] += 1
+        key = (session_id, message.strip())
+        while True:
+            now = time.monotonic()
+            self._forget_expired(now)
+            recent = self._recent.get(key)
+            # An in-flight entry older than the window may keep others alive, its age counts.
+            if recent is None or (recent[1].done() and now - recent[0] >= self.dedupe_window):
+                break
+            self._counters["deduplicated"] += 1
+            # Unlike shield, wait raises CancelledError only if this request is cancelled.
+            await asyncio.wait((recent[1],))
+            if not recent[1].cancelled():
+                return recent[1].result()
+            # The first call was cancelled, e.g. its client went away: answer this
+            # one after all, or share the call of another duplicate that does.
+            self._counters["deduplicated"] -= 1
+
+        if self._locks.waiters(session_id) >= self.max_waiters:
+            self._counters["shed_waiters"] += 1
+            raise SessionBusyError("Too many messages of this session are waiting to be answered.")
+
+        future = asyncio.get_running_loop().create_future()
+        # Duplicates may have stopped waiting, the failure must not be logged as unhandled.
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        if self.dedupe_window > 0:
+            self._recent[key] = (now, future)
+
+        if self._locks.locked(session_id):
+            self._counters["waited"] += 1
+        try:
+            result = await self._call_in_turn(session_id, call)
+        except BaseException as e:
+            # A failed message may be retried right away.
+            if self._recent.get(key, (None, None))[1] is future:
+                del self._recent[key]
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+            raise
+        future.set_result(result)
+        return result
+
+    async def _call_in_turn(self, session_id: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        start = time.monotonic()
+        acquired = False
+        try:
+            async with self._locks.hold(session_id, timeout=self.wait_timeout):
+                acquired = True
+                self._counters["wait_seconds"] += time.monotonic() - start
+                if self.lease is not None:
+                    async with self.lease.hold(session_id):
+                        return await call()
+                return await call()
+        except asyncio.TimeoutError:
+            if acquired:
+                raise
+            self._counters["shed_timeout"] += 1
+            self._counters["wait_seconds"] += time.monotonic() - start
+            raise SessionBusyError(
+                "A previous message of this session is still being answered."
+            ) from None
+
+    def _forget_expired(self, now: float) -> None:
+        # Entries are in arrival order: stop at the first one inside the window, and
+        # skip, rather than stop at, the messages still being answered before it.
+        expired = []
+        for key, (arrival, future) in self._recent.items():
+            if now - arrival < self.dedupe_window:
+                break
+            if future.done():
+                expired.append(key)
+        for key in expired:
+            del self._recent[key]
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            **self._counters,
+            "active_sessions": len(self._locks),
+            "waiting": self._locks.waiters(),
+            "max_waiters": self.max_waiters,
+            "wait_timeout": self.wait_timeout,
+            "lease": self.lease is not None,
+            "dedupe_window": self.dedupe_window,
+        }
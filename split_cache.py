@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain.text_splitter import TextSplitter
+
+# Bump when the stored format or the splitting of ContentLoader changes.
+FORMAT_VERSION = 2
+
+# (text, metadata, start) of a chunk: the metadata without the "source" field, the
+# offset of the chunk in the file's text, see ContentLoader.chunk_offsets
+Chunk = Tuple[str, Dict[str, Any], Optional[int]]
+
+
+def splitter_key(splitter: TextSplitter) -> str:
+    """Identifies the chunks a splitter makes from a text: its class and settings."""
+    settings = {}
+    for name, value in sorted(vars(splitter).items()):
+        if isinstance(value, (str, int, float, bool, type(None))):
+            settings[name] = value
+        elif isinstance(value, (list, tuple)) and all(isinstance(item, str) for item in value):
+            settings[name] = list(value)
+        elif callable(value):
+            settings[name] = getattr(value, "__qualname__", repr(value))
+    cls = type(splitter)
+    return json.dumps(
+        [FORMAT_VERSION, f"{cls.__module__}.{cls.__qualname__}", settings], sort_keys=True
+    )
+
+
+class SplitCache:
+    """Chunks of split files in an SQLite file, shared by syncs and ContentManagers.
+
+    Entries are keyed by the SHA-256 of a file's text and the splitter's settings,
+    see splitter_key, so an unchanged file is not split again, wherever it lives,
+    and a splitter change misses. Chunks are stored as zlib-compressed JSON; once
+    they take more than `max_bytes`, the least recently used entries are evicted.
+    The total is kept in the file, so the cap holds for all processes sharing it.
+
+    The front matter fields a sync plans with are cached too, keyed by the file
+    and its mtime and size, or the checksum of an archive member.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 256 << 20):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        # Losing the last writes of a cache on a power failure is fine, a commit per
+        # file waiting for the disk is not.
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS splits "
+                "(key TEXT PRIMARY KEY, chunks BLOB NOT NULL, size INTEGER NOT NULL, used REAL NOT NULL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS splits_used ON splits (used)")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS front_matter "
+                "(file TEXT PRIMARY KEY, version TEXT NOT NULL, fields TEXT NOT NULL)"
+            )
+            # The total size of the chunks, one row.
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS split_bytes (bytes INTEGER NOT NULL)"
+            )
+            self._connection.execute("BEGIN IMMEDIATE")
+            self._connection.execute(
+                "INSERT INTO split_bytes SELECT COALESCE(SUM(size), 0) FROM splits "
+                "WHERE NOT EXISTS (SELECT 1 FROM split_bytes)"
+            )
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0}
+
+    @staticmethod
+    def key(splitter: TextSplitter, digest: str) -> str:
+        return hashlib.sha256(f"{splitter_key(splitter)}\n{digest}".encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[List[Chunk]]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT chunks FROM splits WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self._counters["misses"] += 1
+                return None
+            self._counters["hits"] += 1
+            with self._connection:
+                self._connection.execute(
+                    "UPDATE splits SET used = ? WHERE key = ?", (time.time(), key)
+                )
+        return [
+            (text, metadata, start)
+            for text, metadata, start in json.loads(zlib.decompress(row[0]))
+        ]
+
+    def put(self, key: str, chunks: List[Chunk]) -> None:
+        data = zlib.compress(json.dumps(chunks).encode())
+        if len(data) > self.max_bytes:
+            return
+        with self._lock, self._connection:
+            # Other processes' writes wait, the total read here stays right.
+            self._connection.execute("BEGIN IMMEDIATE")
+            old = self._connection.execute(
+                "SELECT size FROM splits WHERE key = ?", (key,)
+            ).fetchone()
+            self._connection.execute(
+                "INSERT OR REPLACE INTO splits (key, chunks, size, used) VALUES (?, ?, ?, ?)",
+                (key, data, len(data), time.time()),
+            )
+            self._connection.execute(
+                "UPDATE split_bytes SET bytes = bytes + ?", (len(data) - (old[0] if old else 0),)
+            )
+            self._evict()
+
+    def front_matter(self, file: str, version: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT fields FROM front_matter WHERE file = ? AND version = ?", (file, version)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_front_matter(self, file: str, version: str, fields: Dict[str, Any]) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO front_matter (file, version, fields) VALUES (?, ?, ?)",
+                (file, version, json.dumps(fields)),
+            )
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            entries = self._connection.execute("SELECT COUNT(*) FROM splits").fetchone()[0]
+            return {**self._counters, "entries": entries, "bytes": self._bytes()}
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def _bytes(self) -> int:
+        return self._connection.execute("SELECT bytes FROM split_bytes").fetchone()[0]
+
+    def _evict(self) -> None:
+        total = self._bytes()
+        while total > self.max_bytes:
+            rows = self._connection.execute(
+                "SELECT key, size FROM splits ORDER BY used LIMIT 64"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                self._connection.execute("DELETE FROM splits WHERE key = ?", (key,))
+                self._connection.execute("UPDATE split_bytes SET bytes = bytes - ?", (size,))
+                total -= size
+                self._counters["evictions"] += 1
@@ -0,0 +1,192 @@
+import asyncio
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Optional
+
+
+_STOP = object()
+
+# Maps a durability setting to SQLite's "synchronous" pragma.
+DURABILITY_LEVELS = {"off": "OFF", "normal": "NORMAL", "full": "FULL"}
+
+
+class SqliteWorker:
+    """Owns the SQLite connection of one database file on a dedicated thread.
+
+    Jobs are callables taking the connection; they run one at a time in
+    submission order, so a read submitted after a write always sees it.
+    Writes are committed write-behind: the thread waits up to `flush_interval`
+    seconds for more writes, from any session, and commits them together in
+    one transaction, so one fsync covers many turns.
+    """
+
+    _workers: dict[str, "SqliteWorker"] = {}
+    _workers_lock = threading.Lock()
+
+    def __init__(
+        self,
+        db_file: str,
+        flush_interval: float = 0.005,
+        durability: str = "full",
+        max_batch_size: int = 512,
+    ):
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(
+                f"durability must be one of {list(DURABILITY_LEVELS)}, got {durability}"
+            )
+        self.db_file = db_file
+        self.flush_interval = flush_interval
+        self.durability = durability
+        self.max_batch_size = max_batch_size
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run, name=f"sqlite-worker:{db_file}", daemon=True
+        )
+        self._thread.start()
+
+    @classmethod
+    def for_file(cls, db_file: str, **kwargs: Any) -> "SqliteWorker":
+        """Return the shared worker of a database file, starting it if needed.
+        Settings in kwargs only apply when the worker is started by this call."""
+        key = os.path.abspath(db_file)
+        with cls._workers_lock:
+            worker = cls._workers.get(key)
+            if worker is None or not worker._thread.is_alive():
+                worker = cls._workers[key] = cls(db_file, **kwargs)
+            return worker
+
+    @classmethod
+    def close_all(cls) -> None:
+        """Flush and stop every shared worker."""
+        with cls._workers_lock:
+            workers = list(cls._workers.values())
+            cls._workers.clear()
+        for worker in workers:
+            worker.close()
+
+    def submit(self, func: Callable[[sqlite3.Connection], Any]) -> Future:
+        """Run a job that reads, or must commit on its own, e.g. schema changes."""
+        return self._put(func, is_write=False)
+
+    def submit_write(self, func: Callable[[sqlite3.Connection], Any]) -> Future:
+        """Run a write job as part of the next group commit.
+        The future resolves once the transaction holding it has committed."""
+        return self._put(func, is_write=True)
+
+    async def run(self, func: Callable[[sqlite3.Connection], Any]) -> Any:
+        """Run a job on the worker thread without blocking the event loop."""
+        return await asyncio.wrap_future(self.submit(func))
+
+    def flush(self) -> None:
+        """Block until every job submitted so far has run and been committed."""
+        self.submit(lambda conn: None).result()
+
+    async def aflush(self) -> None:
+        await self.run(lambda conn: None)
+
+    def close(self) -> None:
+        """Stop the worker once every job submitted so far has run."""
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _put(self, func: Callable[[sqlite3.Connection], Any], is_write: bool):
+        future: Future = Future()
+        self._queue.put((func, future, is_write))
+        return future
+
+    def _connect(self) -> sqlite3.Connection:
+        # Transactions are managed explicitly in _run_writes.
+        conn = sqlite3.connect(self.db_file, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={DURABILITY_LEVELS[self.durability]}")
+        return conn
+
+    def _run(self) -> None:
+        conn: Optional[sqlite3.Connection] = None
+        item = None
+        while True:
+            if item is None:
+                item = self._queue.get()
+            if item is _STOP:
+                break
+
+            func, future, is_write = item
+            item = None
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except BaseException as e:
+                    if future.set_running_or_notify_cancel():
+                        future.set_exception(e)
+                    continue
+
+            if not is_write:
+                self._run_job(conn, func, future)
+                continue
+
+            # Collect more writes until the flush interval elapses, the batch is
+            # full, or a read or shutdown arrives, which must see them committed.
+            batch = [(func, future)]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.max_batch_size:
+                try:
+                    next_item = self._queue.get(
+                        timeout=max(deadline - time.monotonic(), 0)
+                    )
+                except queue.Empty:
+                    break
+                if next_item is _STOP or not next_item[2]:
+                    item = next_item
+                    break
+                batch.append(next_item[:2])
+            self._run_writes(conn, batch)
+
+        if conn is not None:
+            conn.close()
+
+    @staticmethod
+    def _run_job(conn: sqlite3.Connection, func, future: Future) -> None:
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(func(conn))
+        except BaseException as e:
+            future.set_exception(e)
+
+    @staticmethod
+    def _run_writes(conn: sqlite3.Connection, batch: list) -> None:
+        done = []
+        try:
+            conn.execute("BEGIN")
+            for func, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                # A savepoint per job keeps one failing write from
+                # discarding the rest of the batch.
+                conn.execute("SAVEPOINT job")
+                try:
+                    result = func(conn)
+                except BaseException as e:
+                    conn.execute("ROLLBACK TO job")
+                    conn.execute("RELEASE job")
+                    future.set_exception(e)
+                    continue
+                conn.execute("RELEASE job")
+                done.append((future, result))
+            conn.execute("COMMIT")
+        except BaseException as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for future, _ in done:
+                future.set_exception(e)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for future, result in done:
+            future.set_result(result)
@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, AdmissionSettings
+from errors import OverloadedError, OVERLOADED_ERROR_CODE
+
+
+@pytest.mark.asyncio
+async def test_in_flight_limit_and_queue_order():
+    controller = AdmissionController(
+        AdmissionSettings(max_in_flight=2, max_queue=10, queue_timeout=5)
+    )
+    release = asyncio.Event()
+    order = []
+
+    async def request(i: int):
+        async with controller.admit():
+            order.append(i)
+            await release.wait()
+
+    tasks = [asyncio.create_task(request(i)) for i in range(5)]
+    await asyncio.sleep(0.01)
+    assert [0, 1] == order
+    assert 2 == controller.metrics()["in_flight"]
+    assert 3 == controller.metrics()["queue_depth"]
+
+    release.set()
+    await asyncio.gather(*tasks)
+    assert [0, 1, 2, 3, 4] == order
+
+    metrics = controller.metrics()
+    assert 0 == metrics["in_flight"]
+    assert 0 == metrics["queue_depth"]
+    assert 5 == metrics["admitted"]
+    assert 0.0 == metrics["shed_rate"]
+
+
+@pytest.mark.asyncio
+async def test_shedding():
+    controller = AdmissionController(
+        AdmissionSettings(max_in_flight=1, max_queue=1, queue_timeout=0.05)
+    )
+    release = asyncio.Event()
+
+    async def request():
+        async with controller.admit():
+            await release.wait()
+
+    running = asyncio.create_task(request())
+    await asyncio.sleep(0)
+    queued = asyncio.create_task(request())
+    await asyncio.sleep(0)
+
+    # The queue is full, the third request is shed right away.
+    with pytest.raises(OverloadedError) as error:
+        await request()
+    assert OVERLOADED_ERROR_CODE == error.value.code
+
+    # The queued request is shed once its deadline passes.
+    with pytest.raises(OverloadedError):
+        await queued
+
+    release.set()
+    await running
+    metrics = controller.metrics()
+    assert 1 == metrics["shed_queue_full"]
+    assert 1 == metrics["shed_timeout"]
+    assert 0 == metrics["in_flight"]
+    assert 0 == metrics["queue_depth"]
+
+    # Capacity is available again.
+    async with controller.admit():
+        assert 1 == controller.metrics()["in_flight"]
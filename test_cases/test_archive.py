@@ -0,0 +1,101 @@
+import os
+import tarfile
+import zipfile
+
+from archive import Archive, split_member_path
+from content_loader import ContentLoader
+from content_manager import ContentManager
+from langchain.embeddings import FakeEmbeddings
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+GENERAL = "./test_cases/materials/general/"
+NAMES = ["content01.md", "content02.md", "content03.md"]
+
+
+def write_zip(path: str, texts: dict[str, str]) -> None:
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, text in texts.items():
+            archive.writestr(name, text)
+
+
+def general_texts(prefix: str = "") -> dict[str, str]:
+    texts = {}
+    for name in NAMES:
+        with open(f"{GENERAL}{name}") as file:
+            texts[f"{prefix}{name}"] = file.read()
+    return texts
+
+
+def test_Archive_members(tmp_path):
+    write_zip(f"{tmp_path}/site.zip", {**general_texts("docs/"), "docs/notes.txt": "skipped"})
+    with tarfile.open(f"{tmp_path}/site.tar.gz", "w:gz") as archive:
+        for name in NAMES:
+            archive.add(f"{GENERAL}{name}", arcname=name)
+
+    with Archive(f"{tmp_path}/site.zip") as archive:
+        members = list(archive.members())
+        assert [f"{tmp_path}/site.zip/docs/{name}" for name in NAMES] == [
+            path for path, _ in members
+        ]
+        assert all(checksum.startswith("crc32:") for _, checksum in members)
+        with archive.open(members[0][0]) as file:
+            assert general_texts()["content01.md"] == file.read()
+
+    with Archive(f"{tmp_path}/site.tar.gz") as archive:
+        members = list(archive.members())
+        assert [f"{tmp_path}/site.tar.gz/{name}" for name in NAMES] == [
+            path for path, _ in members
+        ]
+        assert all(checksum.startswith("mtime:") for _, checksum in members)
+
+    assert (f"{tmp_path}/site.zip", "docs/content01.md") == split_member_path(
+        f"{tmp_path}/site.zip/docs/content01.md"
+    )
+    assert split_member_path(f"{GENERAL}content01.md") is None
+
+
+def test_ContentLoader_reads_archive_members(tmp_path):
+    write_zip(f"{tmp_path}/site.zip", general_texts())
+    splitter = RecursiveCharacterTextSplitter(chunk_size=200, chunk_overlap=20)
+    for name in NAMES:
+        member = f"{tmp_path}/site.zip/{name}"
+        expected = ContentLoader(f"{GENERAL}{name}")
+        archive = Archive(f"{tmp_path}/site.zip")
+        for loader in (ContentLoader(member), ContentLoader(member, archive=archive)):
+            assert expected.load()[0].page_content == loader.load()[0].page_content
+            assert {**expected.load_metadata(), "source": member} == loader.load_metadata()
+            assert [split.page_content for split in splitter.split_documents(expected.load())] == [
+                split.page_content for split in loader.lazy_load_and_split(splitter)
+            ]
+        archive.close()
+
+
+def test_trigger_embedding_from_archive(tmp_path):
+    content = f"{tmp_path}/content/"
+    os.makedirs(content)
+    texts = general_texts()
+    write_zip(f"{content}site.zip", texts)
+
+    manager = ContentManager(
+        original_content_path=content,
+        persist_directory=f"{tmp_path}/chroma/",
+        collection_name="archive-test",
+    )
+    manager.embedding = FakeEmbeddings(size=8)
+    manager.vectordb = manager._open_vectordb()
+
+    manager.trigger_embedding()
+    assert 9 == manager.vectordb._collection.count()
+    assert [] == manager.verify()
+    records = manager._load_records()
+    assert [f"{content}site.zip/{name}" for name in NAMES] == sorted(records)
+    assert all(record.checksum.startswith("crc32:") for record in records.values())
+
+    # An edit without a new date is found by the member's checksum.
+    texts["content03.md"] = texts["content03.md"].replace("# Overview", "# Introduction", 1)
+    write_zip(f"{content}site.zip", texts)
+    assert [f"{content}site.zip/content03.md"] == manager.plan().summary()["update"]
+    manager.trigger_embedding()
+    assert [] == manager.verify()
+    assert {"add": 0, "update": 1, "delete": 0, "unchanged": 2} == manager.last_sync["files"]
+    assert [] == manager.plan().summary()["update"]
@@ -1,5 +1,20 @@
 from langchain.memory import ChatMessageHistory
-from chat_history import SqliteChatMessageHistory
+from langchain.schema.messages import (
+    AIMessage,
+    ChatMessage,
+    FunctionMessage,
+    HumanMessage,
+    SystemMessage,
+    _message_to_dict,
+)
+from chat_history import (
+    SqliteChatMessageHistory,
+    AsyncSqliteChatMessageHistory,
+    SqliteWorker,
+    _decode_message,
+    _encode_message,
+)
+import json
 import sqlite3
 from test_cases.toolkits import delete_file_and_dir
 import pytest
@@ -103,3 +118,157 @@ def test_SqliteChatMessageHistory(chatHistory: SqliteChatMessageHistory):
     chatHistory.clear()
     assert 0 == len(chatHistory.messages)
     assert 0 == len(chatHistory_2.messages)
+
+
+@pytest.mark.asyncio
+async def test_AsyncSqliteChatMessageHistory():
+    db_file = MEMORY_DB_FILE_DIR + MEMORY_DB_FILE_NAME
+    session_id = str(uuid.uuid1())
+    chatHistory = AsyncSqliteChatMessageHistory(session_id=session_id, db_file=db_file)
+    assert chatHistory.worker is SqliteWorker.for_file(db_file)
+    assert 0 == len(await chatHistory.aload())
+
+    chatHistory.add_user_message("Hi!")
+    chatHistory.add_ai_message("What's up?")
+
+    # Writes are visible to the session before they are committed.
+    messages = chatHistory.messages
+    assert 2 == len(messages)
+    assert "human" == messages[0].type
+    assert "ai" == messages[1].type
+
+    await chatHistory.aflush()
+    syncHistory = SqliteChatMessageHistory(session_id=session_id, db_file=db_file)
+    assert ["Hi!", "What's up?"] == [item.content for item in syncHistory.messages]
+
+    chatHistory_2 = AsyncSqliteChatMessageHistory(
+        session_id=session_id, db_file=db_file
+    )
+    assert 2 == len(await chatHistory_2.aload())
+
+    await chatHistory_2.aclear()
+    assert 0 == len(chatHistory_2.messages)
+    assert 0 == len(syncHistory.messages)
+
+    SqliteWorker.close_all()
+    delete_file_and_dir(MEMORY_DB_FILE_DIR)
+
+
+def test_SqliteWorker_group_commit():
+    db_file = MEMORY_DB_FILE_DIR + MEMORY_DB_FILE_NAME
+    worker = SqliteWorker(db_file, flush_interval=0.05)
+    worker.submit(
+        lambda conn: conn.execute("CREATE TABLE IF NOT EXISTS items (value TEXT)")
+    )
+
+    def insert(value):
+        return lambda conn: conn.execute("INSERT INTO items VALUES (?)", (value,))
+
+    def fail(conn):
+        raise RuntimeError("broken write")
+
+    futures = [worker.submit_write(insert(str(i))) for i in range(10)]
+    failed = worker.submit_write(fail)
+    futures.append(worker.submit_write(insert("10")))
+    count = worker.submit(
+        lambda conn: conn.execute("SELECT count(*) FROM items").fetchone()[0]
+    )
+
+    # The read is queued behind the writes, so it sees all of them committed,
+    # and a failing write only loses itself.
+    assert 11 == count.result()
+    assert all(future.done() and future.exception() is None for future in futures)
+    with pytest.raises(RuntimeError):
+        failed.result()
+
+    worker.submit_write(insert("11"))
+    worker.close()
+    conn = sqlite3.connect(db_file)
+    assert 12 == conn.execute("SELECT count(*) FROM items").fetchone()[0]
+    conn.close()
+    delete_file_and_dir(MEMORY_DB_FILE_DIR)
+
+
+def test_messages_round_trip_and_compression(tmp_path):
+    history = SqliteChatMessageHistory(
+        session_id="round-trip", db_file=f"{tmp_path}/history.db"
+    )
+    long_answer = "Kyden writes about Python and Rust. " * 100
+    messages = [
+        HumanMessage(content="Hi!", example=True),
+        AIMessage(content=long_answer, additional_kwargs={"function_call": {"name": "f"}}),
+        SystemMessage(content="Be brief."),
+        ChatMessage(content="Hello", role="moderator"),
+        FunctionMessage(content="{}", name="search"),
+    ]
+    for message in messages:
+        history.add_message(message)
+
+    assert messages == history.messages
+    rows = history.conn.execute(
+        "SELECT role, typeof(content), extra FROM memory_store ORDER BY id"
+    ).fetchall()
+    assert [
+        (1, "text", '{"example":true}'),
+        (2, "blob", '{"additional_kwargs":{"function_call":{"name":"f"}}}'),
+        (3, "text", None),
+        (4, "text", '{"role":"moderator"}'),
+        (5, "text", '{"name":"search"}'),
+    ] == rows
+
+
+class RankedMessage(HumanMessage):
+    rank: int = 1
+
+
+def test_encode_message_keeps_zero_values():
+    role, content, extra = _encode_message(RankedMessage(content="Hi!", rank=0))
+    assert '{"rank":0}' == extra
+    assert 0 == _decode_message(role, content, extra).rank
+
+
+def test_migrate_json_messages(tmp_path):
+    db_file = f"{tmp_path}/history.db"
+    conn = sqlite3.connect(db_file)
+    conn.execute(
+        """
+        CREATE TABLE memory_store (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            message TEXT,
+            updated_time TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """
+    )
+    legacy = [
+        ("a", HumanMessage(content="Hi!")),
+        ("b", AIMessage(content="Hello")),
+        ("a", AIMessage(content="What's up?")),
+    ]
+    conn.executemany(
+        "INSERT INTO memory_store (session_id, message, updated_time) VALUES (?, ?, ?)",
+        [
+            (session_id, json.dumps(_message_to_dict(message)), "2023-09-01 12:00:00")
+            for session_id, message in legacy
+        ],
+    )
+    conn.commit()
+    conn.close()
+
+    history = SqliteChatMessageHistory(session_id="a", db_file=db_file)
+    assert [legacy[0][1], legacy[2][1]] == history.messages
+    assert {"id", "session_id", "role", "content", "extra", "created_at"} == {
+        row[1] for row in history.conn.execute("PRAGMA table_info(memory_store)")
+    }
+    assert [(1, 1693569600), (3, 1693569600)] == history.conn.execute(
+        "SELECT id, created_at FROM memory_store WHERE session_id = 'a'"
+    ).fetchall()
+    assert not table_exists(history.conn, "memory_store_json")
+
+    # New messages continue after the migrated ones.
+    history.add_ai_message("Bye")
+    assert 4 == history.conn.execute("SELECT max(id) FROM memory_store").fetchone()[0]
+    assert ["Hi!", "What's up?", "Bye"] == [
+        message.content
+        for message in SqliteChatMessageHistory(session_id="a", db_file=db_file).messages
+    ]
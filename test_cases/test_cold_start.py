@@ -0,0 +1,23 @@
+import json
+import os
+import subprocess
+import sys
+
+# Loaded by the warm-up after startup, never by importing main.
+HEAVY_MODULES = ["langchain", "chromadb", "conversation", "content_manager", "usage"]
+
+
+def test_main_import_stays_light():
+    code = (
+        "import json, sys; import main; "
+        f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+    )
+    env = {**os.environ, "OPENAI_API_KEY": "sk-dummy", "ACCESS_TOKEN": "token"}
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    assert [] == json.loads(output.strip().splitlines()[-1])
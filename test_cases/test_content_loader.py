@@ -1,5 +1,7 @@
 from content_loader import ContentLoader
+from langchain.text_splitter import RecursiveCharacterTextSplitter
 import pytest
+import random
 
 # from datetime import date
 
@@ -53,3 +55,42 @@ Here's the content of the blog post."""
     assert metadata["date"] == "2023-05-23T14:57:07.322Z"
     assert metadata["author"] == "John Doe"
     assert metadata["isValid"] == 1
+
+
+def test_load_metadata():
+    loader = ContentLoader(CONTENT_01_PATH)
+    assert loader.load()[0].metadata == loader.load_metadata()
+
+
+def random_markdown(rng: random.Random) -> str:
+    words = ["kyden", "writes", "about", "python.", "Tests", "---", "a" * 30]
+    paragraphs = []
+    for _ in range(rng.randint(0, 40)):
+        lines = [
+            " ".join(rng.choice(words) for _ in range(rng.randint(1, 12)))
+            for _ in range(rng.randint(1, 4))
+        ]
+        paragraphs.append("\n".join(lines))
+    text = "\n\n".join(paragraphs)
+    if rng.random() < 0.5:
+        return "---\ntitle: 'T'\ndate: '2023-05-23T14:57:07.322Z'\n---\n\n" + text
+    return "# Title\n\n" + text
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_lazy_load_and_split(tmp_path, seed):
+    rng = random.Random(seed)
+    path = tmp_path / "content.md"
+    path.write_text(random_markdown(rng))
+    chunk_size = rng.randint(20, 200)
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=rng.randint(0, chunk_size // 2),
+        separators=["\n\n", "\n", "(?<=\\. )", " ", ""],
+    )
+    loader = ContentLoader(str(path))
+
+    expected = splitter.split_documents(loader.load())
+    assert expected == list(
+        loader.lazy_load_and_split(splitter, block_size=rng.randint(1, 64))
+    )
@@ -1,5 +1,9 @@
 import pytest
+import shutil
+import content_manager
 from content_manager import ContentManager, FileForEmbedding, ContentLoader
+from index_snapshots import IndexSnapshots
+from langchain.embeddings import FakeEmbeddings
 from test_cases.toolkits import delete_file_and_dir
 import os
 import zipfile
@@ -17,6 +21,7 @@ ORIGINAL_CONTENT_PATH_GENERAL = "./test_cases/materials/general/"
 ORIGINAL_CONTENT_PATH_SPECIFICS = "./test_cases/materials/specifics/"
 PERSIST_DIRECTORY = "./test_cases/vectorstore/chroma/"
 PERSIST_DIRECTORY_FOR_DEL = "./test_cases/vectorstore/chroma_for_del/"
+SNAPSHOT_DIRECTORY = "./test_cases/vectorstore/snapshots/"
 COLLECTION_NAME = "content-manager-test"
 
 
@@ -164,7 +169,9 @@ def manager_for_trigger() -> ContentManager:
 
 
 def test_trigger_embedding(manager_for_trigger: ContentManager):
-    def _embedding(self, all_files: list[FileForEmbedding]) -> list[FileForEmbedding]:
+    def _embedding(
+        self, all_files: list[FileForEmbedding], **kwargs
+    ) -> list[FileForEmbedding]:
         for item in all_files:
             splits = self.splitter.split_documents(
                 ContentLoader(file_path=item.file).load()
@@ -174,7 +181,7 @@ def test_trigger_embedding(manager_for_trigger: ContentManager):
         return all_files
 
     def _delete_embedding(
-        self, all_files: list[FileForEmbedding]
+        self, all_files: list[FileForEmbedding], **kwargs
     ) -> list[FileForEmbedding]:
         for item in all_files:
             item.IDs.clear()
@@ -344,3 +351,201 @@ def test_trigger_embedding(manager_for_trigger: ContentManager):
             assert len(item.IDs) == 2
             assert item.is_valid
     END(test_06)
+
+
+def test_trigger_embedding_with_snapshots():
+    os.makedirs(SNAPSHOT_DIRECTORY, exist_ok=True)
+    delete_file_and_dir(SNAPSHOT_DIRECTORY)
+    snapshots = IndexSnapshots(root=SNAPSHOT_DIRECTORY, keep=2)
+
+    def open_manager() -> ContentManager:
+        manager = ContentManager(
+            original_content_path=ORIGINAL_CONTENT_PATH_GENERAL,
+            collection_name=f"{COLLECTION_NAME}-snapshots",
+            snapshots=snapshots,
+        )
+        manager.embedding = FakeEmbeddings(size=8)
+        manager.vectordb = manager._open_vectordb()
+        return manager
+
+    manager = open_manager()
+    reader = open_manager()
+    first_version = manager.index_version
+    assert first_version == reader.index_version
+    assert [first_version] == snapshots.versions()
+    assert 0 == reader.vectordb._collection.count()
+    assert {"index_version": first_version, "documents": 0} == reader.probe()
+    assert not reader.refresh()
+
+    manager.trigger_embedding()
+    second_version = manager.index_version
+    assert second_version != first_version
+    assert 9 == manager.vectordb._collection.count()
+    assert [] == manager.verify()
+    assert {"index_version": second_version, "documents": 9} == manager.probe()
+    assert os.path.exists(f"{snapshots.version_path(second_version)}embedding.json")
+    assert not os.path.exists(
+        f"{ORIGINAL_CONTENT_PATH_GENERAL}{manager.embedding_record_file}"
+    )
+
+    # The reader keeps serving its version until it refreshes.
+    assert 0 == reader.vectordb._collection.count()
+    assert reader.refresh()
+    assert second_version == reader.index_version
+    assert 9 == reader.vectordb._collection.count()
+
+    assert first_version == reader.rollback()
+    assert 0 == reader.vectordb._collection.count()
+    assert manager.refresh()
+    assert first_version == manager.index_version
+
+    worker = ContentManager(
+        original_content_path=ORIGINAL_CONTENT_PATH_GENERAL,
+        collection_name=f"{COLLECTION_NAME}-snapshots",
+        snapshots=snapshots,
+        read_only=True,
+    )
+    assert first_version == worker.index_version
+    with pytest.raises(ValueError):
+        worker.trigger_embedding()
+
+    manager.trigger_embedding()
+    manager.trigger_embedding()
+    assert 2 == len(snapshots.versions())
+    assert manager.index_version == snapshots.versions()[-1]
+    assert 9 == manager.vectordb._collection.count()
+
+    assert worker.refresh()
+    assert manager.index_version == worker.index_version
+
+    delete_file_and_dir(SNAPSHOT_DIRECTORY)
+    with pytest.raises(ValueError):
+        ContentManager(snapshots=snapshots, read_only=True)
+
+
+def test_refresh_without_snapshots(tmp_path):
+    content = f"{tmp_path}/content/"
+    shutil.copytree(ORIGINAL_CONTENT_PATH_GENERAL, content)
+
+    def open_manager() -> ContentManager:
+        manager = ContentManager(
+            original_content_path=content,
+            persist_directory=f"{tmp_path}/chroma/",
+            collection_name=f"{COLLECTION_NAME}-shared",
+        )
+        manager.embedding = FakeEmbeddings(size=8)
+        manager.vectordb = manager._open_vectordb()
+        return manager
+
+    writer = open_manager()
+    reader = open_manager()
+    assert not reader.has_new_version()
+    assert not reader.refresh()
+
+    # Another process syncs into the store the reader serves.
+    serving = reader.vectordb
+    writer.trigger_embedding()
+    assert not writer.has_new_version()
+    assert reader.has_new_version()
+    assert reader.refresh()
+    assert reader.vectordb is not serving
+    assert 9 == reader.vectordb._collection.count()
+    assert 4 == len(reader.vectordb.similarity_search("chatbot", k=4))
+    assert not reader.has_new_version()
+    assert not reader.refresh()
+
+
+def test_plan_and_parallel_sync(tmp_path):
+    content = f"{tmp_path}/content/"
+    shutil.copytree(ORIGINAL_CONTENT_PATH_GENERAL, content)
+    manager = ContentManager(
+        original_content_path=content,
+        persist_directory=f"{tmp_path}/chroma/",
+        collection_name=f"{COLLECTION_NAME}-parallel",
+        embedding_workers=3,
+        embedding_batch_size=2,
+    )
+    manager.embedding = FakeEmbeddings(size=8)
+    manager.vectordb = manager._open_vectordb()
+
+    files = sorted(f"{content}content0{number}.md" for number in (1, 2, 3))
+    summary = manager.plan().summary()
+    assert files == summary["add"]
+    assert ([], [], 0) == (summary["update"], summary["delete"], summary["unchanged"])
+
+    events = []
+    manager.trigger_embedding(progress=events.append)
+    assert [] == manager.verify()
+    assert {"add": 3, "update": 0, "delete": 0, "unchanged": 0} == manager.last_sync["files"]
+    assert 9 == manager.last_sync["chunks"] == manager.last_sync["documents"]
+    assert {"plan", "delete", "embed", "index"} == set(manager.last_sync["seconds"])
+    embedded = [event for event in events if event["stage"] == "embed" and "seconds" not in event]
+    assert {"files": 3, "files_total": 3, "chunks": 9} == {
+        key: embedded[-1][key] for key in ("files", "files_total", "chunks")
+    }
+    records = manager._load_records()
+    ids = [id for item in records.values() for id in item.IDs]
+    assert 9 == len(set(ids))
+    assert {"plan", "delete", "embed", "index"} <= {event["stage"] for event in events}
+
+    with open(files[0]) as file:
+        text = file.read()
+    with open(files[0], "w") as file:
+        file.write(text.replace("2023-", "2024-", 1))
+    assert [files[0]] == manager.plan().summary()["update"]
+    manager.trigger_embedding()
+    assert [] == manager.verify()
+    assert {"add": 0, "update": 1, "delete": 0, "unchanged": 2} == manager.last_sync["files"]
+    assert 9 == manager.vectordb._collection.count()
+    assert set(manager._load_records()[files[1]].IDs) <= set(ids)
+
+    manager.trigger_embedding(rebuild=True)
+    assert [] == manager.verify()
+    assert {"add": 3, "update": 0, "delete": 0, "unchanged": 0} == manager.last_sync["files"]
+    assert 9 == manager.vectordb._collection.count()
+    assert not set(manager._load_records()[files[1]].IDs) & set(ids)
+
+
+def test_command_line(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(content_manager, "OpenAIEmbeddings", lambda: FakeEmbeddings(size=8))
+    content = f"{tmp_path}/content/"
+    shutil.copytree(ORIGINAL_CONTENT_PATH_GENERAL, content)
+    options = [
+        f"--original-content-path={content}",
+        f"--snapshot-dir={tmp_path}/snapshots/",
+        f"--collection-name={COLLECTION_NAME}-cli",
+        "--workers=2",
+        "--json",
+    ]
+
+    def run(command: str, expected_code: int = 0):
+        assert expected_code == content_manager.main([command, *options])
+        out, err = capsys.readouterr()
+        return json.loads(out), [json.loads(line) for line in err.splitlines()]
+
+    # Nothing is published yet, and inspecting must not bootstrap a version.
+    for command in ("dry-run", "verify", "stats"):
+        with pytest.raises(SystemExit) as exit:
+            content_manager.main([command, *options])
+        assert 2 == exit.value.code
+        assert "No index version is published" in capsys.readouterr().err
+    assert not os.path.exists(f"{tmp_path}/snapshots/")
+
+    report, events = run("sync")
+    assert {"add": 3, "update": 0, "delete": 0, "unchanged": 0} == report["files"]
+    assert 9 == report["documents"]
+    assert {"plan", "delete", "embed", "index", "verify", "publish", "total"} == set(
+        report["seconds"]
+    )
+    assert "plan" == events[0]["stage"]
+
+    plan, _ = run("dry-run")
+    assert ([], [], [], 3) == (plan["add"], plan["update"], plan["delete"], plan["unchanged"])
+    assert {"problems": []} == run("verify")[0]
+    stats, _ = run("stats")
+    assert (report["index_version"], 9, 3, 3) == (
+        stats["index_version"],
+        stats["documents"],
+        stats["files"],
+        stats["valid_files"],
+    )
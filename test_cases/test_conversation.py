@@ -1,6 +1,9 @@
 import pytest
 import asyncio
-from conversation import MemoryHandler, Question, Conversation
+from conversation import MemoryHandler, Question, Conversation, ChainFactory
+from content_manager import ContentManager
+from index_snapshots import IndexSnapshots
+from langchain.embeddings import FakeEmbeddings
 from test_cases.toolkits import delete_file_and_dir
 from langchain.memory import ConversationEntityMemory
 import os
@@ -14,6 +17,8 @@ openai.api_key = os.environ["OPENAI_API_KEY"]
 
 MEMORY_DB_FILE_DIR = "./test_cases/memorystore/sqlite/"
 MEMORY_DB_FILE_NAME = "chat_message_history.db"
+PERSIST_DIRECTORY = "./test_cases/vectorstore/chroma/"
+SNAPSHOT_DIRECTORY = "./test_cases/vectorstore/chain-factory-snapshots/"
 
 
 def test_MemoryHandler_from_session():
@@ -42,6 +47,20 @@ def test_MemoryHandler_from_session():
     delete_file_and_dir(directory_path=MEMORY_DB_FILE_DIR)
 
 
+def test_MemoryHandler_from_env(monkeypatch):
+    monkeypatch.delenv("CHAT_HISTORY_DURABILITY", raising=False)
+    monkeypatch.delenv("CHAT_HISTORY_FLUSH_INTERVAL", raising=False)
+    handler = MemoryHandler.from_env()
+    assert ("full", 0.005) == (handler.durability, handler.flush_interval)
+    monkeypatch.setenv("CHAT_HISTORY_DURABILITY", "normal")
+    monkeypatch.setenv("CHAT_HISTORY_FLUSH_INTERVAL", "0.05")
+    handler = MemoryHandler.from_env()
+    assert ("normal", 0.05) == (handler.durability, handler.flush_interval)
+    monkeypatch.setenv("CHAT_HISTORY_DURABILITY", "sometimes")
+    with pytest.raises(ValueError):
+        MemoryHandler.from_env()
+
+
 BASE_SYSTEM_MESSAGE = """"""
 STUFF_PROMPTS = [
     {
@@ -203,3 +222,72 @@ def test_Conversation_prompts():
     for item in MAP_RERANK_PROMPTS:
         assert prompts[item["key"]]
         assert item["result"] == prompts[item["key"]].format(**item["variables"])
+
+
+def test_ChainFactory():
+    ChainFactory.clear()
+    ChainFactory._content_manager = ContentManager(
+        persist_directory=PERSIST_DIRECTORY, collection_name="chain-factory-test"
+    )
+    handler = MemoryHandler(db_file=MEMORY_DB_FILE_DIR + MEMORY_DB_FILE_NAME)
+    memory_1 = handler.from_session(session_id=str(uuid.uuid1()), return_messages=True)
+    memory_2 = handler.from_session(session_id=str(uuid.uuid1()), return_messages=True)
+
+    chain_1 = ChainFactory.chat_chain(memory=memory_1)
+    chain_2 = ChainFactory.chat_chain(memory=memory_2)
+    assert chain_1 is not chain_2
+    assert chain_1.memory is memory_1
+    assert chain_2.memory is memory_2
+    assert chain_1.retriever is chain_2.retriever
+    assert chain_1.combine_docs_chain is chain_2.combine_docs_chain
+
+    chain_3 = ChainFactory.chat_chain(memory=memory_1, chain_type="refine")
+    assert chain_3.retriever is not chain_1.retriever
+    assert 2 == len(ChainFactory._chat_chains)
+
+    moderated_1 = ChainFactory.moderated_chain(memory=memory_1)
+    moderated_2 = ChainFactory.moderated_chain(memory=memory_2)
+    assert moderated_1.chains[0] is moderated_2.chains[0]
+    assert moderated_1.chains[1].memory is memory_1
+    assert moderated_2.chains[1].memory is memory_2
+
+    ChainFactory.clear()
+    delete_file_and_dir(directory_path=MEMORY_DB_FILE_DIR)
+    delete_file_and_dir(directory_path=PERSIST_DIRECTORY)
+
+
+def test_ChainFactory_swaps_index_in_background():
+    ChainFactory.clear()
+    os.makedirs(SNAPSHOT_DIRECTORY, exist_ok=True)
+    delete_file_and_dir(SNAPSHOT_DIRECTORY)
+    snapshots = IndexSnapshots(root=SNAPSHOT_DIRECTORY)
+    manager = ContentManager(collection_name="chain-factory-test", snapshots=snapshots)
+    manager.embedding = FakeEmbeddings(size=8)
+    manager.vectordb = manager._open_vectordb()
+    ChainFactory._content_manager = manager
+    handler = MemoryHandler(db_file=MEMORY_DB_FILE_DIR + MEMORY_DB_FILE_NAME)
+    memory = handler.from_session(session_id=str(uuid.uuid1()), return_messages=True)
+
+    first_version = manager.index_version
+    chain_1 = ChainFactory.chat_chain(memory=memory)
+    assert first_version == chain_1.retriever.index_version
+
+    second_version = snapshots.begin()
+    snapshots.publish(second_version, documents=0)
+    assert manager.has_new_version()
+    # The request is not held up by opening the new version.
+    chain_2 = ChainFactory.chat_chain(memory=memory)
+    assert first_version == chain_2.retriever.index_version
+    assert ChainFactory._refresh_future.result(timeout=30)
+    assert not manager.has_new_version()
+    assert second_version == manager.index_version
+
+    chain_3 = ChainFactory.chat_chain(memory=memory)
+    assert second_version == chain_3.retriever.index_version
+    assert chain_3.retriever.vectorstore is manager.vectordb
+    assert 1 == len(ChainFactory._chat_chains)
+    assert not ChainFactory.refresh_index()
+
+    ChainFactory.clear()
+    delete_file_and_dir(directory_path=MEMORY_DB_FILE_DIR)
+    delete_file_and_dir(SNAPSHOT_DIRECTORY)
@@ -0,0 +1,93 @@
+import os
+import random
+
+from dedup import DuplicateIndex, MinHasher
+from content_manager import ContentManager
+from langchain.embeddings import FakeEmbeddings
+
+WORDS = "kyden builds websites with prompts python vector stores and video tutorials".split()
+
+
+def paragraph(seed: int, length: int = 300) -> str:
+    rng = random.Random(seed)
+    return " ".join(rng.choice(WORDS) + str(rng.randrange(50)) for _ in range(length))
+
+
+def test_MinHasher_estimates_similarity():
+    hasher = MinHasher()
+    text = paragraph(1)
+    assert 1.0 == hasher.similarity(hasher.signature(text), hasher.signature(text))
+
+    edited = text.replace(text.split()[150], "changed", 1)
+    assert hasher.similarity(hasher.signature(text), hasher.signature(edited)) > 0.9
+    assert hasher.similarity(hasher.signature(text), hasher.signature(paragraph(2))) < 0.1
+
+
+def test_DuplicateIndex_find():
+    index = DuplicateIndex(threshold=0.85)
+    index.add("a", paragraph(1))
+    index.add("b", paragraph(2))
+
+    match, signature = index.find(paragraph(1) + " one more sentence")
+    assert "a" == match
+    assert "a" == index.find(paragraph(1))[0]
+    assert index.find(paragraph(3))[0] is None
+    index.add("c", paragraph(3), signature=index.hasher.signature(paragraph(3)))
+    assert 3 == len(index)
+    assert {"chunks": 3, "duplicates": 2, "shrink_rate": 2 / 3} == index.stats()
+
+
+def write(path: str, title: str, body: str, date: str, valid: int = 1) -> None:
+    with open(path, "w") as file:
+        file.write(
+            f"---\ncategory: 'Article'\ntitle: '{title}'\ndate: '{date}'\n"
+            f"author: 'Kyden'\nisValid: {valid}\n---\n\n{body}"
+        )
+
+
+def test_trigger_embedding_with_deduplication(tmp_path):
+    content = f"{tmp_path}/content/"
+    os.makedirs(content)
+    bio = paragraph(1)
+    write(f"{content}a.md", "About", bio, "2023-05-23T14:57:07.322Z")
+    write(f"{content}b.md", "Profile", bio, "2023-05-23T14:57:07.322Z")
+    write(f"{content}c.md", "Projects", paragraph(2), "2023-05-23T14:57:07.322Z")
+
+    def open_manager() -> ContentManager:
+        manager = ContentManager(
+            original_content_path=content,
+            persist_directory=f"{tmp_path}/chroma/",
+            collection_name="dedup-test",
+            chunk_size=4000,
+            deduplicate=True,
+        )
+        manager.embedding = FakeEmbeddings(size=8)
+        manager.vectordb = manager._open_vectordb()
+        return manager
+
+    manager = open_manager()
+    assert {"chunks": 3, "duplicates": 1, "shrink_rate": 1 / 3} == manager.trigger_embedding()
+    records = manager._load_records()
+    assert 2 == manager.vectordb._collection.count()
+    assert records[f"{content}a.md"].IDs == records[f"{content}b.md"].IDs
+    shared = manager.vectordb._collection.get(ids=records[f"{content}a.md"].IDs)
+    assert f"{content}a.md\n{content}b.md" == shared["metadatas"][0]["sources"]
+    assert [] == manager.verify()
+
+    # The shared chunk stays while another file still has it, and names that one
+    # as its source instead of the one that embedded it.
+    titles = {f"{content}a.md": "About", f"{content}b.md": "Profile"}
+    owner = shared["metadatas"][0]["source"]
+    (other,) = set(titles) - {owner}
+    write(owner, titles[owner], bio, "2023-06-01T00:00:00.000Z", valid=0)
+    assert {"chunks": 0, "duplicates": 0, "shrink_rate": 0.0} == manager.trigger_embedding()
+    assert 2 == manager.vectordb._collection.count()
+    shared = manager.vectordb._collection.get(ids=records[other].IDs)
+    assert other == shared["metadatas"][0]["sources"]
+    assert other == shared["metadatas"][0]["source"]
+    assert [] == manager.verify()
+
+    write(other, titles[other], bio, "2023-06-01T00:00:00.000Z", valid=0)
+    manager.trigger_embedding()
+    assert 1 == manager.vectordb._collection.count()
+    assert [] == manager.verify()
@@ -0,0 +1,87 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import pytest
+
+from embedding_batcher import EmbeddingBatcher
+from langchain.embeddings.base import Embeddings
+
+
+class Abort(BaseException):
+    pass
+
+
+class CountingEmbeddings(Embeddings):
+    def __init__(self):
+        self.calls: List[List[str]] = []
+        self.lock = threading.Lock()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with self.lock:
+            self.calls.append(list(texts))
+        if "boom" in texts:
+            raise RuntimeError("boom")
+        if "abort" in texts:
+            raise Abort()
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def test_EmbeddingBatcher_coalesces_queries():
+    embeddings = CountingEmbeddings()
+    batcher = EmbeddingBatcher(embeddings, window=0.05)
+    texts = [f"query {'x' * i}" for i in range(16)]
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        vectors = list(pool.map(batcher.embed_query, texts))
+
+    assert [[float(len(text)), 1.0] for text in texts] == vectors
+    assert 1 == len(embeddings.calls)
+    assert sorted(texts) == sorted(embeddings.calls[0])
+    assert {"queries": 16, "calls": 1, "primed": 0} == batcher.metrics()
+
+    # A query arriving alone is embedded on its own.
+    assert [1.0, 1.0] == batcher.embed_query("a")
+    assert 2 == len(embeddings.calls)
+
+
+def test_EmbeddingBatcher_max_batch_and_errors():
+    embeddings = CountingEmbeddings()
+    batcher = EmbeddingBatcher(embeddings, window=0.05, max_batch=4)
+
+    with ThreadPoolExecutor(max_workers=10) as pool:
+        list(pool.map(batcher.embed_query, [str(i) for i in range(10)]))
+    assert all(len(call) <= 4 for call in embeddings.calls)
+    assert 10 == sum(len(call) for call in embeddings.calls)
+
+    with pytest.raises(RuntimeError):
+        batcher.embed_query("boom")
+    # The failure does not leave the batcher without a leader.
+    assert [2.0, 1.0] == batcher.embed_query("ok")
+
+
+def test_EmbeddingBatcher_recovers_from_BaseException():
+    batcher = EmbeddingBatcher(CountingEmbeddings(), window=0)
+    with pytest.raises(Abort):
+        batcher.embed_query("abort")
+    # The leader stepped down; a later query leads instead of waiting forever.
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        assert [2.0, 1.0] == pool.submit(batcher.embed_query, "ok").result(timeout=5)
+
+
+def test_EmbeddingBatcher_prime():
+    embeddings = CountingEmbeddings()
+    batcher = EmbeddingBatcher(embeddings, window=0.05, max_batch=4)
+    texts = [f"question {i}" for i in range(6)]
+    batcher.prime(texts + texts[:2])
+    assert [texts[:4], texts[4:]] == embeddings.calls
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        vectors = list(pool.map(batcher.embed_query, texts + ["rewritten query"]))
+    assert [[float(len(text)), 1.0] for text in texts + ["rewritten query"]] == vectors
+    # Only the query that was not primed was embedded again.
+    assert [["rewritten query"]] == embeddings.calls[2:]
+    assert {"queries": 7, "calls": 3, "primed": 6} == batcher.metrics()
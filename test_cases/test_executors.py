@@ -0,0 +1,69 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from executors import BoundedExecutor, ExecutorSettings, Executors
+
+
+@pytest.mark.asyncio
+async def test_BoundedExecutor_metrics():
+    pool = BoundedExecutor("test", max_workers=2)
+    release = threading.Event()
+
+    def job(i: int) -> int:
+        release.wait(5)
+        return i
+
+    futures = [pool.submit(job, i) for i in range(5)]
+    submitted = time.perf_counter()
+    await asyncio.sleep(0.01)
+    metrics = pool.metrics()
+    assert 2 == metrics["running"]
+    assert 3 == metrics["queue_depth"]
+    assert 3 == metrics["max_queue_depth"]
+
+    # Hold the queued jobs for at least 50 ms after they were all submitted.
+    while time.perf_counter() < submitted + 0.05:
+        await asyncio.sleep(0.005)
+    release.set()
+    assert [0, 1, 2, 3, 4] == [future.result(timeout=5) for future in futures]
+    with pytest.raises(ZeroDivisionError):
+        await pool.run(lambda: 1 / 0)
+
+    metrics = pool.metrics()
+    assert {"queue_depth": 0, "running": 0, "submitted": 6, "completed": 5, "failed": 1} == {
+        name: metrics[name] for name in ("queue_depth", "running", "submitted", "completed", "failed")
+    }
+    # The queued jobs waited for the first two to finish.
+    assert metrics["max_wait_seconds"] >= 0.05
+    assert metrics["mean_wait_ms"] > 0
+    pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_pools_do_not_starve_each_other():
+    executors = Executors(ExecutorSettings(search_threads=1, blocking_io_threads=1, cpu_threads=1))
+    release = threading.Event()
+    search = asyncio.ensure_future(executors.search.run(release.wait, 5))
+    await asyncio.sleep(0.01)
+
+    # The search pool is busy, moderation still runs right away.
+    names = await executors.blocking_io.run(lambda: threading.current_thread().name)
+    assert names.startswith("blocking_io")
+    assert 1 == executors.metrics()["search"]["running"]
+
+    release.set()
+    assert await search
+    executors.shutdown()
+
+
+def test_ExecutorSettings_from_env(monkeypatch):
+    monkeypatch.setenv("CHATBOT_SEARCH_THREADS", "3")
+    monkeypatch.setenv("CHATBOT_CPU_THREADS", "2")
+    executors = Executors()
+    assert {"search": 3, "blocking_io": 8, "cpu": 2} == {
+        name: pool.max_workers for name, pool in executors.pools().items()
+    }
+    executors.shutdown()
@@ -0,0 +1,61 @@
+import asyncio
+import openai
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from http_pool import HttpClientPool, HttpPoolSettings
+
+
+async def moderations(request: web.Request) -> web.Response:
+    await asyncio.sleep(0.01)
+    return web.json_response(
+        {
+            "id": "modr-test",
+            "model": "text-moderation-stub",
+            "results": [{"flagged": False, "categories": {}, "category_scores": {}}],
+        }
+    )
+
+
+@pytest_asyncio.fixture
+async def stub_server():
+    app = web.Application()
+    app.router.add_post("/v1/moderations", moderations)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    api_base, api_key = openai.api_base, openai.api_key
+    openai.api_base = f"http://127.0.0.1:{port}/v1"
+    openai.api_key = "sk-test"
+    yield
+    openai.api_base, openai.api_key = api_base, api_key
+    await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_HttpClientPool_reuses_connections(stub_server):
+    pool = HttpClientPool(HttpPoolSettings(max_connections=1))
+    pool.bind()
+
+    for _ in range(3):
+        await openai.Moderation.acreate("hi")
+    await asyncio.gather(*(openai.Moderation.acreate("hi") for _ in range(3)))
+
+    metrics = pool.metrics()["async"]
+    assert 6 == metrics["requests"]
+    assert 0 == metrics["in_flight"]
+    assert 1 == metrics["connections_created"]
+    assert 5 == metrics["connections_reused"]
+    assert metrics["connection_waits"] > 0
+
+    pool.install()
+    await asyncio.get_running_loop().run_in_executor(
+        None, lambda: [openai.Moderation.create("hi") for _ in range(3)]
+    )
+    assert {"requests": 3, "connections_created": 1} == pool.metrics()["sync"]
+
+    await pool.aclose()
+    assert openai.requestssession is None
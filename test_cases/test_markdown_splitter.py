@@ -0,0 +1,79 @@
+from markdown_splitter import MarkdownHeadingSplitter
+from langchain.docstore.document import Document
+
+TEXT = """---
+title: 'Guide'
+---
+
+# Guide
+## Install
+Run the installer.
+
+## Usage
+### Python
+```python
+# Not a heading
+
+print("kyden")
+```
+
+### Shell
+Call it from the shell.
+
+# FAQ
+Short answer.
+"""
+
+
+def test_sections_and_heading_paths():
+    splitter = MarkdownHeadingSplitter(chunk_size=40, chunk_overlap=0)
+    documents = splitter.split_documents(
+        [Document(page_content=TEXT, metadata={"source": "guide.md"})]
+    )
+
+    assert [
+        ("Guide > Install", "# Guide\n## Install\nRun the installer."),
+        (
+            "Guide > Usage > Python",
+            '## Usage\n### Python\n```python\n# Not a heading\n\nprint("kyden")\n```',
+        ),
+        ("Guide > Usage > Shell", "### Shell\nCall it from the shell."),
+        ("FAQ", "# FAQ\nShort answer."),
+    ] == [
+        (document.metadata["headings"], document.page_content) for document in documents
+    ]
+    assert all(document.metadata["source"] == "guide.md" for document in documents)
+
+
+def test_tiny_sections_are_merged():
+    splitter = MarkdownHeadingSplitter(chunk_size=200, chunk_overlap=0)
+    chunks = splitter._split(TEXT)
+
+    assert 1 == len(chunks)
+    headings, text = chunks[0]
+    assert [] == headings
+    assert text.startswith("# Guide\n## Install") and text.endswith("Short answer.")
+    assert "title: 'Guide'" not in text
+
+    # Sections of one subtree keep their shared path.
+    headings, _ = splitter._split(TEXT.split("# FAQ")[0])[0]
+    assert ["Guide"] == headings
+
+
+def test_long_sections_are_split_at_paragraphs():
+    paragraphs = [f"Paragraph {i} " + " ".join(["word"] * 4) for i in range(6)]
+    code = "```\n" + "\n".join(f"line {i}" for i in range(30)) + "\n```"
+    text = "# Long\n" + "\n\n".join(paragraphs + [code])
+    splitter = MarkdownHeadingSplitter(chunk_size=120, chunk_overlap=60)
+    chunks = splitter._split(text)
+
+    assert all(["Long"] == headings for headings, _ in chunks)
+    # The code block is longer than a chunk, but is not cut.
+    assert [code] == [chunk for _, chunk in chunks if "line 0" in chunk]
+    for _, chunk in chunks:
+        assert len(chunk) <= 120 or chunk == code
+    # Consecutive chunks overlap.
+    assert any(
+        chunks[i][1].split("\n\n")[-1] == chunks[i + 1][1].split("\n\n")[0]
+        for i in range(len(chunks) - 1)
+    )
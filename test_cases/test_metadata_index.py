@@ -0,0 +1,106 @@
+from typing import List
+
+from langchain.embeddings.base import Embeddings
+from langchain.schema import Document
+from langchain.vectorstores import Chroma
+
+from metadata_index import MetadataIndex, to_timestamp
+
+IDS = ["a", "b", "c", "d"]
+METADATAS = [
+    {"category": "Article", "author": "John Doe", "date": "2023-01-10T00:00:00.000Z"},
+    {"category": "Article", "author": "Jane Doe", "date": "2023-05-23T14:57:07.322Z"},
+    {"category": "Project", "author": "John Doe", "date": "2023-08-01T00:00:00.000Z"},
+    {"title": "No category", "date": "2022-12-31T23:59:59.999Z"},
+]
+
+
+class KeywordEmbeddings(Embeddings):
+    """Embeds a text by counting a few keywords, so distances are predictable."""
+
+    keywords = ["python", "rust", "chatbot"]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return [float(text.lower().count(word)) for word in self.keywords]
+
+
+def test_candidates():
+    index = MetadataIndex.build(IDS, METADATAS)
+
+    assert {"a", "b"} == index.candidates({"category": {"$eq": "Article"}})
+    assert {"c", "d"} == index.candidates({"category": {"$ne": "Article"}})
+    assert {"a"} == index.candidates(
+        {"$and": [{"category": {"$eq": "Article"}}, {"author": {"$eq": "John Doe"}}]}
+    )
+    assert {"a", "c"} == index.candidates(
+        {"$or": [{"author": {"$eq": "John Doe"}}, {"category": {"$eq": "Project"}}]}
+    )
+    assert {"b", "c"} == index.candidates({"date": {"$gt": "2023-01-10T00:00:00Z"}})
+    assert {"a", "d"} == index.candidates({"date": {"$lte": "2023-01-10"}})
+    assert set() == index.candidates({"category": {"$eq": "Video"}})
+
+    # Unindexed fields narrow nothing down.
+    assert index.candidates({"title": {"$eq": "No category"}}) is None
+    assert {"a", "b"} == index.candidates(
+        {"$and": [{"category": {"$eq": "Article"}}, {"title": {"$eq": "x"}}]}
+    )
+    assert index.candidates(
+        {"$or": [{"category": {"$eq": "Article"}}, {"title": {"$eq": "x"}}]}
+    ) is None
+
+
+def test_matches_and_chroma_where():
+    index = MetadataIndex.build(IDS, METADATAS)
+
+    where = {"$and": [{"category": {"$eq": "Article"}}, {"date": {"$gte": "2023-05-01"}}]}
+    assert [False, True, False, False] == [index.matches(where, m) for m in METADATAS]
+    assert index.matches({"title": {"$eq": "No category"}}, METADATAS[3])
+
+    assert {
+        "$and": [
+            {"category": {"$eq": "Article"}},
+            {"date_ts": {"$gte": to_timestamp("2023-05-01")}},
+        ]
+    } == index.chroma_where(where)
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / "metadata_index.json")
+    assert MetadataIndex.load(path) is None
+
+    MetadataIndex.build(IDS, METADATAS).save(path)
+    index = MetadataIndex.load(path)
+    assert {"a", "c"} == index.candidates({"author": {"$eq": "John Doe"}})
+    assert {"b"} == index.candidates(
+        {"date": {"$gt": "2023-01-10T00:00:00Z", "$lt": "2023-08-01"}}
+    )
+
+
+def test_search(tmp_path):
+    vectordb = Chroma(
+        collection_name="metadata-index-test",
+        embedding_function=KeywordEmbeddings(),
+        persist_directory=str(tmp_path),
+    )
+    texts = ["python chatbot", "rust rust", "python", "chatbot"]
+    vectordb.add_texts(texts, metadatas=METADATAS, ids=IDS)
+
+    index = MetadataIndex()
+    index.index_collection(vectordb)
+    assert set(IDS) == index.ids
+
+    docs = index.search(vectordb, "python", {"category": {"$eq": "Article"}}, k=4)
+    assert ["python chatbot", "rust rust"] == [doc.page_content for doc in docs]
+    assert all(isinstance(doc, Document) for doc in docs)
+
+    docs = index.search(vectordb, "python", {"author": {"$eq": "John Doe"}}, k=1)
+    assert ["python"] == [doc.page_content for doc in docs]
+
+    assert [] == index.search(vectordb, "python", {"category": {"$eq": "Video"}})
+    assert index.search(vectordb, "python", {"title": {"$eq": "x"}}) is None
+
+    index.max_candidates = 1
+    assert index.search(vectordb, "python", {"category": {"$eq": "Article"}}) is None
@@ -0,0 +1,73 @@
+import pytest
+
+from conversation import KydenModerationChain
+from errors import PolicyViolationError
+from moderation_cache import ModerationCache
+
+
+class Clock:
+    now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeModeration:
+    """Flags texts containing "bad" and counts the texts sent."""
+
+    def __init__(self):
+        self.texts = []
+
+    def _results(self, input) -> dict:
+        texts = [input] if isinstance(input, str) else input
+        self.texts.extend(texts)
+        return {"results": [{"flagged": "bad" in text} for text in texts]}
+
+    def create(self, input) -> dict:
+        return self._results(input)
+
+    async def acreate(self, input) -> dict:
+        return self._results(input)
+
+
+def test_ModerationCache():
+    clock = Clock()
+    cache = ModerationCache(max_entries=2, ttl=10, clock=clock)
+    assert cache.get("hi") is None
+    cache.put("Hi ", False)
+    assert cache.get("hi") is False
+    assert cache.get("  HI") is False
+    cache.put("bad words", True)
+    assert cache.get("bad  words") is True
+
+    cache.get("hi")
+    cache.put("thanks", False)
+    assert cache.get("bad words") is None
+    assert cache.get("hi") is False
+
+    clock.now = 10
+    assert cache.get("hi") is None
+    stats = cache.stats()
+    assert {"hits": 5, "misses": 3, "expirations": 1, "evictions": 1, "entries": 1} == {
+        name: stats[name] for name in ("hits", "misses", "expirations", "evictions", "entries")
+    }
+    assert 5 / 8 == stats["hit_rate"]
+
+
+@pytest.mark.asyncio
+async def test_KydenModerationChain_caches_verdicts():
+    chain = KydenModerationChain(error=True, moderation_cache=ModerationCache())
+    client = chain.client = FakeModeration()
+
+    for _ in range(3):
+        assert "hi" == (await chain.acall("hi"))["output"]
+        with pytest.raises(PolicyViolationError):
+            await chain.acall("bad words")
+    assert "Hi" == chain("Hi")["output"]
+    assert ["hi", "bad words"] == client.texts
+
+    assert [False, True, False] == await chain.aflagged(["HI", "more bad words", "thanks"])
+    assert ["hi", "bad words", "more bad words", "thanks"] == client.texts
+    assert [True, False] == await chain.aflagged(["more bad words", "thanks"])
+    assert 4 == len(client.texts)
+    assert 8 == chain.moderation_cache.stats()["hits"]
@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+from conversation import KydenModerationChain
+from errors import PolicyViolationError
+from moderation_cache import ModerationCache
+from moderation_tiers import ModerationTierSettings, ModerationTiers
+from test_cases.test_moderation_cache import FakeModeration
+
+
+def test_ModerationTiers_classify():
+    tiers = ModerationTiers(ModerationTierSettings())
+    for text in ["Hi!", "  hello there ", "Thank you so much!!", "OK", "What can you do?"]:
+        assert tiers.classify(text) is False, text
+    for text in ["kys", "Hi, I will kill you.", "I'm going to kill you", "I’m going to kill you"]:
+        assert tiers.classify(text) is True, text
+    for text in ["hi, what did Kyden write about Rust?", "hi " * 30, "killing processes"]:
+        assert tiers.classify(text) is None, text
+
+    assert ModerationTiers(ModerationTierSettings(enabled=False)).classify("hi") is None
+
+
+def test_ModerationTierSettings_from_env(tmp_path, monkeypatch):
+    rules = tmp_path / "rules.json"
+    rules.write_text(json.dumps({"allow": ["what did kyden write about rust"], "block": ["spam"]}))
+    monkeypatch.setenv("CHATBOT_LOCAL_MODERATION_RULES", str(rules))
+    tiers = ModerationTiers()
+    assert tiers.classify("What did Kyden write about Rust?") is False
+    assert tiers.classify("buy spam now") is True
+    assert tiers.classify("hello") is False
+
+    monkeypatch.setenv("CHATBOT_LOCAL_MODERATION", "0")
+    assert ModerationTiers().classify("hello") is None
+
+
+@pytest.mark.asyncio
+async def test_KydenModerationChain_tiers():
+    tiers = ModerationTiers(ModerationTierSettings())
+    chain = KydenModerationChain(
+        error=True, moderation_tiers=tiers, moderation_cache=ModerationCache()
+    )
+    client = chain.client = FakeModeration()
+
+    assert "Hello!" == (await chain.acall("Hello!"))["output"]
+    with pytest.raises(PolicyViolationError):
+        await chain.acall("kys")
+    for _ in range(2):
+        await chain.acall("What did Kyden write?")
+    with pytest.raises(PolicyViolationError):
+        await chain.acall("a bad question")
+    assert [False, True] == await chain.aflagged(["thanks", "another bad question"])
+    assert ["what did kyden write?", "a bad question", "another bad question"] == [
+        text.lower() for text in client.texts
+    ]
+
+    stats = tiers.stats()
+    assert {"local": (3, 1), "cache": (1, 0), "remote": (3, 2)} == {
+        tier: (stats[tier]["resolved"], stats[tier]["flagged"])
+        for tier in ("local", "cache", "remote")
+    }
+    assert 4 / 7 == stats["resolved_without_request"]
@@ -0,0 +1,141 @@
+import asyncio
+import shutil
+from typing import List
+
+from langchain.schema import Document
+from langchain.vectorstores import Chroma
+
+from content_manager import AsyncSelfQueryRetriever, ContentManager
+from metadata_index import MetadataIndex
+from retrieval_cache import RetrievalCache
+from test_cases.test_metadata_index import IDS, METADATAS, KeywordEmbeddings
+
+
+class CountingEmbeddings(KeywordEmbeddings):
+    queries = 0
+
+    def embed_query(self, text: str) -> List[float]:
+        CountingEmbeddings.queries += 1
+        return super().embed_query(text)
+
+
+def test_RetrievalCache():
+    cache = RetrievalCache(max_entries=2)
+    docs = {id: Document(page_content=id, metadata={"id": id}) for id in "abc"}
+    key = RetrievalCache.key("python", "similarity", None, 2)
+    assert key == RetrievalCache.key("python", "similarity", {}, 2)
+    assert cache.get(key) is None
+
+    cache.put(key, [("a", docs["a"]), ("b", docs["b"])], cache.version)
+    found = cache.get(key)
+    assert [docs["a"], docs["b"]] == found
+    found[0].metadata["id"] = "changed"
+    assert "a" == cache.get(key)[0].metadata["id"]
+
+    other = RetrievalCache.key("rust", "similarity", None, 2)
+    cache.put(other, [("b", docs["b"]), ("c", docs["c"])], cache.version)
+    assert 3 == cache.stats()["documents"]
+    cache.get(key)
+    cache.put(RetrievalCache.key("chatbot", "similarity", None, 2), [], cache.version)
+    assert cache.get(other) is None
+    assert {"a", "b"} == {doc.page_content for doc in cache.get(key)}
+    assert 2 == cache.stats()["documents"]
+
+    # A search that started before the index changed is not stored.
+    version = cache.version
+    assert version + 1 == cache.bump()
+    assert cache.get(key) is None
+    cache.put(key, [("a", docs["a"])], version)
+    assert cache.get(key) is None
+    assert {"entries": 0, "documents": 0, "evictions": 1, "invalidations": 1} == {
+        name: cache.stats()[name] for name in ("entries", "documents", "evictions", "invalidations")
+    }
+
+
+def test_cached_similarity_search(tmp_path):
+    vectordb = Chroma(
+        collection_name="retrieval-cache-test",
+        embedding_function=CountingEmbeddings(),
+        persist_directory=str(tmp_path),
+    )
+    texts = ["python chatbot", "rust rust", "python", "chatbot"]
+    vectordb.add_texts(texts, metadatas=METADATAS, ids=IDS)
+    metadata_index = MetadataIndex()
+    metadata_index.index_collection(vectordb)
+    retriever = AsyncSelfQueryRetriever.construct(
+        vectorstore=vectordb,
+        search_type="similarity",
+        metadata_index=metadata_index,
+        retrieval_cache=RetrievalCache(),
+    )
+
+    def search(**search_kwargs) -> List[str]:
+        docs = asyncio.run(retriever._cached_similarity_search("python", search_kwargs))
+        return [doc.page_content for doc in docs]
+
+    CountingEmbeddings.queries = 0
+    expected = [doc.page_content for doc in vectordb.similarity_search("python", k=2)]
+    assert expected == search(k=2) == search(k=2)
+    assert 2 == CountingEmbeddings.queries
+
+    where = {"category": {"$eq": "Article"}}
+    assert ["python chatbot", "rust rust"] == search(k=4, filter=where) == search(k=4, filter=where)
+    assert 3 == CountingEmbeddings.queries
+    assert {"hits": 2, "misses": 2} == {
+        name: retriever.retrieval_cache.stats()[name] for name in ("hits", "misses")
+    }
+
+    # A search that started before the index changed, e.g. while the self-query
+    # LLM call was running, ran on the old store: its result is not stored.
+    cache = retriever.retrieval_cache
+    started = cache.version
+    cache.bump()
+    asyncio.run(retriever._cached_similarity_search("python", {"k": 2}, started))
+    assert 0 == cache.stats()["entries"]
+
+    # Retrievers of different index versions do not share results.
+    old = AsyncSelfQueryRetriever.construct(**{**retriever.__dict__, "index_version": "v1"})
+    new = AsyncSelfQueryRetriever.construct(**{**retriever.__dict__, "index_version": "v2"})
+    asyncio.run(old._cached_similarity_search("python", {"k": 2}))
+    asyncio.run(new._cached_similarity_search("python", {"k": 2}))
+    assert 2 == cache.stats()["entries"]
+
+
+def test_trigger_embedding_invalidates_retrieval_cache(tmp_path):
+    content = f"{tmp_path}/content/"
+    shutil.copytree("./test_cases/materials/general/", content)
+    cache = RetrievalCache()
+    manager = ContentManager(
+        original_content_path=content,
+        persist_directory=f"{tmp_path}/chroma/",
+        collection_name="retrieval-cache-sync-test",
+        retrieval_cache=cache,
+    )
+    manager.embedding = KeywordEmbeddings()
+    manager.vectordb = manager._open_vectordb()
+    manager.trigger_embedding()
+    retriever = AsyncSelfQueryRetriever.construct(
+        vectorstore=manager.vectordb,
+        search_type="similarity",
+        metadata_index=manager.metadata_index,
+        retrieval_cache=cache,
+    )
+
+    def search() -> List[Document]:
+        return asyncio.run(retriever._cached_similarity_search("chatbot", {"k": 9}))
+
+    before = search()
+    assert before == search()
+    assert 1 == cache.stats()["hits"]
+
+    section = "A chatbot chatbot chatbot chatbot section."
+    with open(f"{content}content02.md") as file:
+        text = file.read()
+    with open(f"{content}content02.md", "w") as file:
+        file.write(f"{text.replace('2023-', '2024-', 1)}\n\n{section}\n")
+    manager.trigger_embedding()
+
+    after = search()
+    assert 1 == cache.stats()["hits"]
+    assert any(section in doc.page_content for doc in after)
+    assert not any(section in doc.page_content for doc in before)
@@ -0,0 +1,207 @@
+import asyncio
+import os
+
+import pytest
+
+from chat_history import SqliteWorker
+from errors import SessionBusyError
+from session_lock import SessionSerializer, SqliteLease
+
+DB_FILE = "./test_cases/memorystore/sqlite/session_lock_test.db"
+
+
+def session(i: int) -> str:
+    return f"{i:064x}"
+
+
+@pytest.mark.asyncio
+async def test_requests_of_a_session_run_in_order():
+    serializer = SessionSerializer()
+    events = []
+
+    async def turn(name: str):
+        events.append(f"{name} start")
+        await asyncio.sleep(0.01)
+        events.append(f"{name} end")
+        return name
+
+    results = await asyncio.gather(
+        serializer.run(session(1), "first", lambda: turn("first")),
+        serializer.run(session(1), "second", lambda: turn("second")),
+        serializer.run(session(2), "other", lambda: turn("other")),
+    )
+    assert ["first", "second", "other"] == results
+    # The other session ran alongside the first one.
+    assert ["first start", "other start"] == events[:2]
+    assert events.index("first end") < events.index("second start")
+    assert 1 == serializer.metrics()["waited"]
+    assert 0 == serializer.metrics()["active_sessions"]
+
+
+@pytest.mark.asyncio
+async def test_duplicates_share_the_first_result():
+    serializer = SessionSerializer(dedupe_window=10)
+    calls = []
+
+    async def answer():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"answer": len(calls)}
+
+    first, duplicate = await asyncio.gather(
+        serializer.run(session(1), "hello", answer),
+        serializer.run(session(1), " hello ", answer),
+    )
+    assert first is duplicate
+    # Still within the window after it completed.
+    assert first is await serializer.run(session(1), "hello", answer)
+    # Other sessions and other messages are answered on their own.
+    await serializer.run(session(2), "hello", answer)
+    await serializer.run(session(1), "hello again", answer)
+    assert 3 == len(calls)
+    assert 2 == serializer.metrics()["deduplicated"]
+
+    async def fail():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream failed")
+
+    # Failures are shared by concurrent duplicates but not remembered.
+    results = await asyncio.gather(
+        serializer.run(session(3), "hi", fail),
+        serializer.run(session(3), "hi", fail),
+        return_exceptions=True,
+    )
+    assert all(isinstance(item, ValueError) for item in results)
+    assert 4 == len(calls)
+    assert {"answer": 5} == await serializer.run(session(3), "hi", answer)
+
+
+@pytest.mark.asyncio
+async def test_lease_serializes_across_processes():
+    if os.path.exists(DB_FILE):
+        os.remove(DB_FILE)
+    # Two serializers with their own lease stand in for two worker processes.
+    first = SessionSerializer(lease=SqliteLease(db_file=DB_FILE), dedupe_window=0)
+    second = SessionSerializer(
+        lease=SqliteLease(db_file=DB_FILE, timeout=0.1), dedupe_window=0
+    )
+    release = asyncio.Event()
+
+    async def hold():
+        await release.wait()
+        return "first"
+
+    running = asyncio.create_task(first.run(session(1), "hello", hold))
+    await asyncio.sleep(0.05)
+    with pytest.raises(SessionBusyError):
+        await second.run(session(1), "hello", lambda: asyncio.sleep(0, "second"))
+    assert "other" == await second.run(
+        session(2), "hello", lambda: asyncio.sleep(0, "other")
+    )
+
+    release.set()
+    assert "first" == await running
+    assert "second" == await second.run(
+        session(1), "hello", lambda: asyncio.sleep(0, "second")
+    )
+
+    # An expired lease, e.g. of a crashed worker, is taken over.
+    expired = SqliteLease(db_file=DB_FILE, ttl=-1)
+    async with expired.hold(session(3)):
+        async with SqliteLease(db_file=DB_FILE, timeout=0).hold(session(3)):
+            pass
+
+    SqliteWorker.close_all()
+    os.remove(DB_FILE)
+
+
+@pytest.mark.asyncio
+async def test_waiting_is_bounded():
+    serializer = SessionSerializer(dedupe_window=0, max_waiters=1, wait_timeout=0.05)
+    release = asyncio.Event()
+
+    async def hold():
+        await release.wait()
+        return "first"
+
+    running = asyncio.create_task(serializer.run(session(1), "first", hold))
+    waiting = asyncio.create_task(
+        serializer.run(session(1), "second", lambda: asyncio.sleep(0, "second"))
+    )
+    await asyncio.sleep(0.01)
+    assert 1 == serializer.metrics()["waiting"]
+    # The session already has a waiter.
+    with pytest.raises(SessionBusyError):
+        await serializer.run(session(1), "third", lambda: asyncio.sleep(0, "third"))
+    # The waiter gives up after wait_timeout.
+    with pytest.raises(SessionBusyError):
+        await waiting
+
+    release.set()
+    assert "first" == await running
+    metrics = serializer.metrics()
+    assert (1, 1, 0, 0) == (
+        metrics["shed_waiters"],
+        metrics["shed_timeout"],
+        metrics["waiting"],
+        metrics["active_sessions"],
+    )
+    assert "again" == await serializer.run(session(1), "again", lambda: asyncio.sleep(0, "again"))
+
+
+@pytest.mark.asyncio
+async def test_duplicates_of_a_cancelled_call_run_themselves():
+    serializer = SessionSerializer(dedupe_window=10)
+    calls = []
+
+    async def answer():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"answer": len(calls)}
+
+    first = asyncio.create_task(serializer.run(session(1), "hello", answer))
+    await asyncio.sleep(0.01)
+    duplicates = [
+        asyncio.create_task(serializer.run(session(1), "hello", answer)) for _ in range(2)
+    ]
+    await asyncio.sleep(0.01)
+    first.cancel()
+    results = await asyncio.gather(*duplicates)
+    # One duplicate took over the call, the other shared its result.
+    assert [{"answer": 2}, {"answer": 2}] == results
+    assert results[0] is results[1]
+    assert 2 == len(calls)
+    assert first.cancelled()
+
+
+@pytest.mark.asyncio
+async def test_answers_expire_while_other_sessions_are_in_flight():
+    serializer = SessionSerializer(dedupe_window=0.05)
+    release = asyncio.Event()
+    calls = []
+
+    async def answer():
+        calls.append(1)
+        return {"answer": len(calls)}
+
+    async def slow():
+        await release.wait()
+        return "slow"
+
+    other = asyncio.create_task(serializer.run(session(2), "long question", slow))
+    await asyncio.sleep(0)
+    first = await serializer.run(session(1), "hi", answer)
+    await asyncio.sleep(0.1)
+    # The other session still runs, the first answer is out of the window all the same.
+    assert first != await serializer.run(session(1), "hi", answer)
+    assert 2 == len(calls)
+
+    # A duplicate that is cancelled itself does not cancel the call it waits on.
+    waiting = asyncio.create_task(serializer.run(session(2), "long question", slow))
+    await asyncio.sleep(0)
+    waiting.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+    release.set()
+    assert "slow" == await other
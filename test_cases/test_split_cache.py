@@ -0,0 +1,114 @@
+import shutil
+import time
+
+from content_loader import ContentLoader
+from content_manager import ContentManager
+from langchain.embeddings import FakeEmbeddings
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from split_cache import SplitCache, splitter_key
+
+GENERAL = "./test_cases/materials/general/"
+
+
+def test_splitter_key():
+    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
+    assert splitter_key(splitter) == splitter_key(
+        RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
+    )
+    assert splitter_key(splitter) != splitter_key(
+        RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=100)
+    )
+    assert splitter_key(splitter) != splitter_key(
+        RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100, separators=["\n"])
+    )
+
+
+def test_SplitCache_evicts_least_recently_used(tmp_path):
+    cache = SplitCache(f"{tmp_path}/cache.db", max_bytes=1000)
+    chunks = {key: [(key * 200, {"title": key}, 0)] for key in "abcd"}
+    for key in "abc":
+        cache.put(key, chunks[key])
+        time.sleep(0.01)
+    assert chunks["a"] == cache.get("a")
+    time.sleep(0.01)
+
+    size = cache.stats()["bytes"] // 3
+    cache.max_bytes = size * 3
+    cache.put("d", chunks["d"])
+    assert cache.get("b") is None
+    assert chunks["a"] == cache.get("a")
+    assert {"hits": 2, "misses": 1, "evictions": 1, "entries": 3} == {
+        key: value for key, value in cache.stats().items() if key != "bytes"
+    }
+    cache.close()
+
+    # Entries outlive the connection.
+    cache = SplitCache(f"{tmp_path}/cache.db")
+    assert chunks["d"] == cache.get("d")
+    assert size * 3 == cache.stats()["bytes"]
+
+    # The cap holds for every connection to the file, e.g. of other processes.
+    other = SplitCache(f"{tmp_path}/cache.db", max_bytes=size * 3)
+    cache.put("b", chunks["b"])
+    assert size * 4 == other.stats()["bytes"]
+    other.put("e", [("e" * 200, {"title": "e"}, 0)])
+    assert size * 3 == cache.stats()["bytes"]
+    assert 3 == cache.stats()["entries"]
+    other.close()
+    cache.close()
+
+
+def test_trigger_embedding_with_split_cache(tmp_path, monkeypatch):
+    content = f"{tmp_path}/content/"
+    shutil.copytree(GENERAL, content)
+    cache = SplitCache(f"{tmp_path}/split_cache.db")
+
+    def open_manager(**kwargs) -> ContentManager:
+        manager = ContentManager(
+            original_content_path=content,
+            persist_directory=f"{tmp_path}/chroma/",
+            collection_name="split-cache-test",
+            split_cache=cache,
+            **kwargs,
+        )
+        manager.embedding = FakeEmbeddings(size=8)
+        manager.vectordb = manager._open_vectordb()
+        return manager
+
+    def documents(manager: ContentManager) -> list:
+        found = manager.vectordb._collection.get(include=["documents", "metadatas"])
+        return sorted(
+            (document, sorted(metadata.items()))
+            for document, metadata in zip(found["documents"], found["metadatas"])
+        )
+
+    manager = open_manager()
+    manager.trigger_embedding()
+    assert (0, 3) == (manager.last_sync["split_cache"]["hits"], manager.last_sync["split_cache"]["misses"])
+    expected = documents(manager)
+
+    # Each chunk is cached with its offset in the file's text.
+    file = f"{content}content03.md"
+    loader = ContentLoader(file_path=file)
+    chunks = cache.get(SplitCache.key(manager.splitter, loader.digest()))
+    with open(file) as f:
+        text = f.read()
+    assert 1 < len(chunks)
+    assert all(text[start:].startswith(chunk) for chunk, _, start in chunks)
+    assert 1 == cache.stats()["hits"]
+
+    # The front matter of unchanged files is not parsed again.
+    def load_metadata(self):
+        raise AssertionError(f"{self.file_path} was parsed again")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(ContentLoader, "load_metadata", load_metadata)
+        open_manager().trigger_embedding(rebuild=True)
+    manager = open_manager()
+    assert 4 == cache.stats()["hits"]
+    assert expected == documents(manager)
+    assert [] == manager.verify()
+
+    # Another splitter misses.
+    open_manager(chunk_size=500).trigger_embedding(rebuild=True)
+    assert (4, 6) == (cache.stats()["hits"], cache.stats()["misses"])
@@ -0,0 +1,132 @@
+import os
+from uuid import uuid4
+
+import pytest
+from langchain.embeddings import FakeEmbeddings
+from langchain.schema import LLMResult
+
+from chat_history import SqliteWorker
+from usage import MeteredEmbeddings, UsageRecorder, UsageStore, measure_embeddings
+
+DB_FILE = "./test_cases/memorystore/sqlite/usage_test.db"
+
+
+def chain(name: str) -> dict:
+    return {"id": ["langchain", "chains", name]}
+
+
+def llm_result(prompt_tokens: int, completion_tokens: int) -> LLMResult:
+    return LLMResult(
+        generations=[],
+        llm_output={
+            "token_usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+            },
+            "model_name": "gpt-3.5-turbo",
+        },
+    )
+
+
+def replay_turn(recorder: UsageRecorder, scale: int = 1, moderation_tier: str = "remote") -> None:
+    """Replay the callback events of one moderated conversation turn."""
+    top, moderation, chat = uuid4(), uuid4(), uuid4()
+    recorder.on_chain_start(chain("SequentialChain"), {}, run_id=top)
+    recorder.on_chain_start(chain("KydenModerationChain"), {}, run_id=moderation, parent_run_id=top)
+    if moderation_tier != "remote":
+        recorder.on_text("", run_id=moderation, moderation_tier=moderation_tier)
+    recorder.on_chain_end({}, run_id=moderation)
+    recorder.on_chain_start(chain("ConversationalRetrievalChain"), {}, run_id=chat, parent_run_id=top)
+
+    def llm_call(parent, prompt_tokens, completion_tokens):
+        llm_chain, llm = uuid4(), uuid4()
+        recorder.on_chain_start(chain("LLMChain"), {}, run_id=llm_chain, parent_run_id=parent)
+        recorder.on_chat_model_start({"id": ["ChatOpenAI"]}, [], run_id=llm, parent_run_id=llm_chain)
+        recorder.on_llm_end(llm_result(prompt_tokens, completion_tokens), run_id=llm)
+
+    llm_call(chat, 100 * scale, 10 * scale)  # question generator
+
+    retriever = uuid4()
+    recorder.on_retriever_start({"id": ["AsyncSelfQueryRetriever"]}, "q", run_id=retriever, parent_run_id=chat)
+    llm_call(retriever, 800 * scale, 30 * scale)
+
+    stuff = uuid4()
+    recorder.on_chain_start(chain("StuffDocumentsChain"), {}, run_id=stuff, parent_run_id=chat)
+    llm_call(stuff, 1200 * scale, 200 * scale)
+
+
+def test_UsageRecorder():
+    recorder = UsageRecorder(session_id="a" * 64, message="Who is Kyden?")
+    replay_turn(recorder)
+
+    summary = recorder.summary()
+    assert 2100 == summary["prompt_tokens"]
+    assert 240 == summary["completion_tokens"]
+    assert 2340 == summary["total_tokens"]
+    steps = summary["steps"]
+    assert {"moderation", "condense", "self_query", "answer"} == set(steps)
+    assert 800 == steps["self_query"]["prompt_tokens"]
+    assert 200 == steps["answer"]["completion_tokens"]
+    assert 1 == steps["moderation"]["calls"]
+    assert 0 == steps["moderation"]["prompt_tokens"]
+
+    # Verdicts that made no request are kept apart.
+    recorder = UsageRecorder(session_id="a" * 64, message="hi")
+    replay_turn(recorder, moderation_tier="cache")
+    steps = recorder.summary()["steps"]
+    assert "moderation" not in steps
+    assert 1 == steps["moderation_cache"]["calls"]
+
+
+def test_MeteredEmbeddings():
+    embeddings = MeteredEmbeddings(FakeEmbeddings(size=4), model="text-embedding-ada-002")
+    # Outside of a measured search, e.g. while syncing, nothing is collected.
+    embeddings.embed_query("not measured")
+
+    def search(query: str) -> int:
+        embeddings.embed_query(query)
+        return 3
+
+    result, calls = measure_embeddings(search, "who is kyden")
+    assert 3 == result
+    assert ["embedding"] == [call.step for call in calls]
+    assert "text-embedding-ada-002" == calls[0].model
+    assert 0 < calls[0].prompt_tokens
+
+    recorder = UsageRecorder(session_id="a" * 64)
+    retriever = uuid4()
+    recorder.on_retriever_start({"id": ["AsyncSelfQueryRetriever"]}, "q", run_id=retriever)
+    recorder.on_text("", run_id=retriever, usage_calls=calls)
+    summary = recorder.summary()
+    assert calls[0].prompt_tokens == summary["prompt_tokens"]
+    assert 1 == summary["steps"]["embedding"]["calls"]
+
+
+@pytest.mark.asyncio
+async def test_UsageStore():
+    if os.path.exists(DB_FILE):
+        os.remove(DB_FILE)
+    store = UsageStore(db_file=DB_FILE)
+
+    for session_id, turns, scale in (("a" * 64, 2, 1), ("b" * 64, 1, 3)):
+        for _ in range(turns):
+            recorder = UsageRecorder(session_id=session_id, message="hello")
+            replay_turn(recorder, scale)
+            store.record(recorder)
+    await store.worker.aflush()
+
+    sessions = await store.heaviest_sessions()
+    assert ["b" * 64, "a" * 64] == [item["session_id"] for item in sessions]
+    assert 3 * 2340 == sessions[0]["total_tokens"]
+    assert 2 == sessions[1]["requests"]
+
+    prompts = await store.heaviest_prompts(limit=2)
+    assert ["answer", "self_query"] == [item["step"] for item in prompts]
+    assert 3 == prompts[0]["calls"]
+
+    requests = await store.heaviest_requests(limit=1)
+    assert "b" * 64 == requests[0]["session_id"]
+    assert 2 == len(await store.session_usage("a" * 64))
+
+    SqliteWorker.close_all()
+    os.remove(DB_FILE)
@@ -0,0 +1,390 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from functools import lru_cache, partial
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
+from uuid import UUID
+
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.embeddings.base import Embeddings
+from langchain.schema import LLMResult
+from pydantic import BaseModel
+
+from sqlite_worker import SqliteWorker
+
+
+class UsageCall(BaseModel):
+    """One upstream model call made while answering a request."""
+
+    step: str
+    model: Optional[str] = None
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    latency_ms: float = 0.0
+
+
+T = TypeVar("T")
+
+# The calls of the MeteredEmbeddings made by the search running on this thread.
+_embedding_calls = threading.local()
+
+
+@lru_cache(maxsize=None)
+def _encoding(model: str) -> Any:
+    try:
+        import tiktoken
+
+        return tiktoken.encoding_for_model(model)
+    except Exception:
+        # E.g. an unknown model, or no network to fetch the encoding.
+        return None
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """The tokens `text` is billed as by `model`, about 4 characters each if
+    its tokenizer is not available."""
+    encoding = _encoding(model) if model else None
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text))
+
+
+class MeteredEmbeddings(Embeddings):
+    """Wraps the embeddings of a vector store, so that the query embeddings of a
+    search run by `measure_embeddings` are reported with the request's usage.
+
+    Each query is counted where it is asked for, also when an EmbeddingBatcher
+    inside embeds it together with others.
+    """
+
+    def __init__(self, embeddings: Embeddings, model: Optional[str] = None):
+        self.embeddings = embeddings
+        self.model = model or getattr(embeddings, "model", None)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        start = time.perf_counter()
+        try:
+            return self.embeddings.embed_query(text)
+        finally:
+            calls = getattr(_embedding_calls, "calls", None)
+            if calls is not None:
+                calls.append(
+                    UsageCall(
+                        step="embedding",
+                        model=self.model,
+                        prompt_tokens=count_tokens(text, self.model),
+                        latency_ms=(time.perf_counter() - start) * 1000,
+                    )
+                )
+
+
+def measure_embeddings(
+    fn: Callable[..., T], *args: Any, **kwargs: Any
+) -> Tuple[T, List[UsageCall]]:
+    """Run `fn` and return its result with the calls of the MeteredEmbeddings it
+    made on this thread."""
+    _embedding_calls.calls = calls = []
+    try:
+        return fn(*args, **kwargs), calls
+    finally:
+        _embedding_calls.calls = None
+
+
+class UsageRecorder(BaseCallbackHandler):
+    """Collects the token counts and latency of every model call of one request.
+
+    Pass it in the callbacks of the chain call. Calls are attributed to the
+    step of the conversation they belong to, found from the run tree:
+    "condense" rephrases the question, "self_query" writes the retriever's
+    structured query, "answer" combines the documents, "moderation" checks the
+    input; anything else is "other". The retriever reports its query embeddings
+    as "embedding". Moderation verdicts of the local tier and of the cache make
+    no request, they are kept apart as "moderation_local" and "moderation_cache".
+    """
+
+    run_inline = True
+
+    def __init__(self, session_id: str, message: str = ""):
+        self.request_id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.message = message
+        self.calls: List[UsageCall] = []
+        self._runs: Dict[UUID, tuple] = {}  # run_id -> (parent_run_id, kind, name)
+        self._started: Dict[UUID, float] = {}
+        self._moderation_tiers: Dict[UUID, str] = {}
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, **kwargs):
+        name = self._name(serialized)
+        self._runs[run_id] = (parent_run_id, "chain", name)
+        if "Moderation" in name:
+            self._started[run_id] = time.perf_counter()
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end_moderation(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end_moderation(run_id)
+
+    def on_text(self, text, *, run_id, **kwargs):
+        # Reported by KydenModerationChain and AsyncSelfQueryRetriever.
+        if "moderation_tier" in kwargs:
+            self._moderation_tiers[run_id] = kwargs["moderation_tier"]
+        self.calls.extend(kwargs.get("usage_calls", ()))
+
+    def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, **kwargs):
+        self._runs[run_id] = (parent_run_id, "retriever", self._name(serialized))
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs):
+        self._runs[run_id] = (parent_run_id, "llm", self._name(serialized))
+        self._started[run_id] = time.perf_counter()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs):
+        self.on_llm_start(serialized, [], run_id=run_id, parent_run_id=parent_run_id)
+
+    def on_llm_end(self, response: LLMResult, *, run_id, **kwargs):
+        llm_output = response.llm_output or {}
+        token_usage = llm_output.get("token_usage") or {}
+        self.calls.append(
+            UsageCall(
+                step=self._step(run_id),
+                model=llm_output.get("model_name"),
+                prompt_tokens=token_usage.get("prompt_tokens", 0),
+                completion_tokens=token_usage.get("completion_tokens", 0),
+                latency_ms=self._elapsed_ms(run_id),
+            )
+        )
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self.calls.append(
+            UsageCall(step=self._step(run_id), latency_ms=self._elapsed_ms(run_id))
+        )
+
+    def summary(self) -> Dict[str, Any]:
+        steps: Dict[str, Dict[str, Any]] = {}
+        for call in self.calls:
+            step = steps.setdefault(
+                call.step,
+                {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "latency_ms": 0.0},
+            )
+            step["calls"] += 1
+            step["prompt_tokens"] += call.prompt_tokens
+            step["completion_tokens"] += call.completion_tokens
+            step["latency_ms"] = round(step["latency_ms"] + call.latency_ms, 1)
+        prompt_tokens = sum(call.prompt_tokens for call in self.calls)
+        completion_tokens = sum(call.completion_tokens for call in self.calls)
+        return {
+            "request_id": self.request_id,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "latency_ms": round(sum(call.latency_ms for call in self.calls), 1),
+            "steps": steps,
+        }
+
+    def _end_moderation(self, run_id: UUID) -> None:
+        if run_id in self._started:
+            tier = self._moderation_tiers.pop(run_id, "remote")
+            self.calls.append(
+                UsageCall(
+                    step="moderation" if tier == "remote" else f"moderation_{tier}",
+                    model="moderation" if tier == "remote" else None,
+                    latency_ms=self._elapsed_ms(run_id),
+                )
+            )
+
+    def _elapsed_ms(self, run_id: UUID) -> float:
+        started = self._started.pop(run_id, None)
+        if started is None:
+            return 0.0
+        return (time.perf_counter() - started) * 1000
+
+    def _step(self, run_id: UUID) -> str:
+        ancestors = []
+        parent_run_id = self._runs.get(run_id, (None,))[0]
+        while parent_run_id in self._runs:
+            parent_run_id, kind, name = self._runs[parent_run_id]
+            ancestors.append((kind, name))
+        if any(kind == "retriever" for kind, _ in ancestors):
+            return "self_query"
+        if any(name.endswith("DocumentsChain") for _, name in ancestors):
+            return "answer"
+        if ancestors[1:2] == [("chain", "ConversationalRetrievalChain")]:
+            # The question generator is an LLMChain directly under the chain.
+            return "condense"
+        return "other"
+
+    @staticmethod
+    def _name(serialized: Optional[Dict[str, Any]]) -> str:
+        ids = (serialized or {}).get("id") or ["unknown"]
+        return ids[-1]
+
+
+def _create_usage_tables(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS usage_requests (
+            request_id TEXT PRIMARY KEY,
+            session_id TEXT NOT NULL,
+            message TEXT,
+            prompt_tokens INTEGER NOT NULL,
+            completion_tokens INTEGER NOT NULL,
+            latency_ms REAL NOT NULL,
+            created_time TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS usage_requests_session ON usage_requests (session_id)"
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS usage_calls (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            request_id TEXT NOT NULL,
+            step TEXT NOT NULL,
+            model TEXT,
+            prompt_tokens INTEGER NOT NULL,
+            completion_tokens INTEGER NOT NULL,
+            latency_ms REAL NOT NULL
+        )
+    """
+    )
+
+
+def _insert_usage(conn: sqlite3.Connection, recorder: UsageRecorder) -> None:
+    summary = recorder.summary()
+    conn.execute(
+        """
+        INSERT INTO usage_requests
+            (request_id, session_id, message, prompt_tokens, completion_tokens, latency_ms)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """,
+        (
+            recorder.request_id,
+            recorder.session_id,
+            recorder.message,
+            summary["prompt_tokens"],
+            summary["completion_tokens"],
+            summary["latency_ms"],
+        ),
+    )
+    conn.executemany(
+        """
+        INSERT INTO usage_calls
+            (request_id, step, model, prompt_tokens, completion_tokens, latency_ms)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """,
+        [
+            (
+                recorder.request_id,
+                call.step,
+                call.model,
+                call.prompt_tokens,
+                call.completion_tokens,
+                call.latency_ms,
+            )
+            for call in recorder.calls
+        ],
+    )
+
+
+def _query(conn: sqlite3.Connection, sql: str, params: tuple) -> List[Dict[str, Any]]:
+    cursor = conn.execute(sql, params)
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+class UsageStore:
+    """Token usage per request and per model call, kept in the chat history
+    database and written with its group commits."""
+
+    _shared: Optional["UsageStore"] = None
+
+    def __init__(self, db_file: str = "./memorystore/chat_message_history.db"):
+        self.worker = SqliteWorker.for_file(db_file)
+        self.worker.submit(_create_usage_tables)
+
+    @classmethod
+    def shared(cls) -> "UsageStore":
+        if cls._shared is None:
+            cls._shared = cls(
+                db_file=os.environ.get(
+                    "USAGE_DB_FILE", "./memorystore/chat_message_history.db"
+                )
+            )
+        return cls._shared
+
+    def record(self, recorder: UsageRecorder) -> Future:
+        return self.worker.submit_write(partial(_insert_usage, recorder=recorder))
+
+    async def heaviest_sessions(self, limit: int = 10) -> List[Dict[str, Any]]:
+        return await self._query(
+            """
+            SELECT session_id,
+                   COUNT(*) AS requests,
+                   SUM(prompt_tokens) AS prompt_tokens,
+                   SUM(completion_tokens) AS completion_tokens,
+                   SUM(prompt_tokens + completion_tokens) AS total_tokens,
+                   SUM(latency_ms) AS latency_ms
+            FROM usage_requests
+            GROUP BY session_id
+            ORDER BY total_tokens DESC
+            LIMIT ?
+        """,
+            (limit,),
+        )
+
+    async def heaviest_prompts(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """Usage per conversation step and model, i.e. per prompt template."""
+        return await self._query(
+            """
+            SELECT step,
+                   model,
+                   COUNT(*) AS calls,
+                   SUM(prompt_tokens) AS prompt_tokens,
+                   SUM(completion_tokens) AS completion_tokens,
+                   AVG(prompt_tokens) AS avg_prompt_tokens,
+                   AVG(latency_ms) AS avg_latency_ms
+            FROM usage_calls
+            GROUP BY step, model
+            ORDER BY SUM(prompt_tokens + completion_tokens) DESC
+            LIMIT ?
+        """,
+            (limit,),
+        )
+
+    async def heaviest_requests(self, limit: int = 10) -> List[Dict[str, Any]]:
+        return await self._query(
+            """
+            SELECT request_id, session_id, message, prompt_tokens, completion_tokens,
+                   prompt_tokens + completion_tokens AS total_tokens, latency_ms,
+                   created_time
+            FROM usage_requests
+            ORDER BY total_tokens DESC
+            LIMIT ?
+        """,
+            (limit,),
+        )
+
+    async def session_usage(self, session_id: str) -> List[Dict[str, Any]]:
+        """The requests of a session, oldest first."""
+        return await self._query(
+            """
+            SELECT request_id, message, prompt_tokens, completion_tokens,
+                   prompt_tokens + completion_tokens AS total_tokens, latency_ms,
+                   created_time
+            FROM usage_requests
+            WHERE session_id = ?
+            ORDER BY created_time, rowid
+        """,
+            (session_id,),
+        )
+
+    async def _query(self, sql: str, params: tuple) -> List[Dict[str, Any]]:
+        return await self.worker.run(partial(_query, sql=sql, params=params))
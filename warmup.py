@@ -0,0 +1,132 @@
+import asyncio
+import importlib
+import logging
+import time
+from functools import partial
+from typing import Any, Awaitable, Dict, Optional
+
+import aiohttp
+import openai
+
+from executors import Executors
+from http_pool import HttpClientPool
+from sqlite_worker import SqliteWorker
+
+logger = logging.getLogger(__name__)
+
+# Importing anything from langchain costs about two seconds, so `main` does not
+# import these modules itself; the warm-up does, after the server has started.
+HEAVY_MODULES = ["conversation", "usage"]
+
+
+class WarmUp:
+    """Prepares a freshly started process for its first request.
+
+    In the background it imports the heavy modules, opens the vector index and
+    runs a probe query on it, builds the default chain graph, which compiles
+    its prompts, creates the SQLite tables and opens a keep-alive connection to
+    the OpenAI API. Each step is timed; `ready` turns true once all of them are
+    done, and is what /readyz reports to load balancers.
+    """
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.timings: Dict[str, float] = {}
+        self.error: Optional[str] = None
+        self.index: Optional[Dict[str, Any]] = None  # stats of the probed index
+
+    @property
+    def ready(self) -> bool:
+        return self.task is not None and self.task.done() and self.error is None
+
+    def start(self) -> asyncio.Task:
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+        return self.task
+
+    async def wait(self) -> None:
+        """Wait until the warm-up has ended, successfully or not. Requests that
+        arrive early wait here instead of repeating its work concurrently."""
+        if self.task is not None:
+            await asyncio.shield(self.task)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "error": self.error,
+            "index": self.index,
+            "timings_ms": {name: round(value * 1000, 1) for name, value in self.timings.items()},
+        }
+
+    async def _run(self) -> None:
+        cpu = Executors.shared().cpu
+        start = time.perf_counter()
+        try:
+            await self._step("imports", cpu.run(self._import_modules))
+            await self._step("index", cpu.run(self._open_index))
+            await self._step("probe", self._probe_index())
+            await self._step("chains", cpu.run(self._build_chains))
+            await self._step("databases", self._open_databases())
+            await self._step("http_pool", self._prime_http_pool())
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            logger.exception("Warm-up failed, requests will initialize lazily")
+        self.timings["total"] = time.perf_counter() - start
+
+    async def _step(self, name: str, work: Awaitable) -> None:
+        start = time.perf_counter()
+        await work
+        self.timings[name] = time.perf_counter() - start
+
+    @staticmethod
+    def _import_modules() -> None:
+        for module in HEAVY_MODULES:
+            importlib.import_module(module)
+
+    @staticmethod
+    def _open_index() -> None:
+        from conversation import ChainFactory
+
+        ChainFactory.content_manager()
+
+    async def _probe_index(self) -> None:
+        from conversation import ChainFactory
+
+        self.index = await Executors.shared().search.run(ChainFactory.content_manager().probe)
+
+    @staticmethod
+    def _build_chains() -> None:
+        from conversation import ChainFactory
+
+        # The default configuration of Conversation.chat_with_moderation.
+        ChainFactory.moderated_chain(memory=ChainFactory._template_memory())
+
+    @staticmethod
+    async def _open_databases() -> None:
+        from chat_history import _create_table_if_not_exists
+        from conversation import MemoryHandler
+        from usage import UsageStore
+
+        handler = MemoryHandler.from_env()
+        worker = SqliteWorker.for_file(
+            handler.db_file,
+            flush_interval=handler.flush_interval,
+            durability=handler.durability,
+        )
+        await worker.run(partial(_create_table_if_not_exists, table_name="memory_store"))
+        await UsageStore.shared().worker.aflush()
+
+    @staticmethod
+    async def _prime_http_pool() -> None:
+        # Resolves the API host and leaves a TLS connection in the pool. Best
+        # effort: failing here does not make the process unready.
+        session = HttpClientPool.shared().session()
+        try:
+            async with session.get(
+                f"{openai.api_base}/models",
+                headers={"Authorization": f"Bearer {openai.api_key}"},
+                timeout=aiohttp.ClientTimeout(total=5),
+            ) as response:
+                await response.read()
+        except Exception as e:
+            logger.warning("Could not prime the HTTP pool: %s", e)